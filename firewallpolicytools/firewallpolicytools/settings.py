@@ -117,3 +117,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Cache of parsed configuration files (normalized_fw_config.parsecache), least recently used entries are evicted
+# once it grows beyond FGT_PARSE_CACHE_MAX_BYTES
+
+FGT_PARSE_CACHE_DIR = os.path.join(BASE_DIR, '.parsecache')
+FGT_PARSE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Cache of compiled policy matchers (normalized_fw_config.policymatch), evicted like the parse cache
+
+FGT_MATCHER_CACHE_DIR = os.path.join(BASE_DIR, '.matchercache')
+FGT_MATCHER_CACHE_MAX_BYTES = 256 * 1024 * 1024
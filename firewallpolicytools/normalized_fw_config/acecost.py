@@ -0,0 +1,147 @@
+"""
+Estimate of the number of expanded ACL elements the policies of a device produce on the target firewall.
+
+A policy expands to sources x destinations x services elements for every ACL it is written to, one per source
+zone or interface. The dimensions are counted over the flattened members of the policy's sets: address groups,
+compound services and service groups are resolved to their address and service objects, and objects reached several
+ways count once. An address counts one element, an address range one per CIDR block it consists of, and a service
+one per protocol (TCP+UDP services two, TCP+UDP+SCTP three). An empty dimension means any and counts one.
+
+Policy sets are shared between policies, so the flattened members and the counts are memoized per group and per
+set, and the whole estimate reads each table once.
+"""
+
+import ipaddress
+from collections import OrderedDict, defaultdict
+
+from django.db.models import Q
+
+from normalized_fw_config.intervals import cidr_blocks, ip_to_int
+from normalized_fw_config.models import *
+from normalized_fw_config.policygraph import load_members, load_objects
+
+PROTOCOL_ELEMENTS = {256: 2, 257: 3}
+ANY_ACL = 'any'
+
+
+def address_elements(type, start_ip, end_ip):
+    if type == 'range4':
+        return len(cidr_blocks(ip_to_int(start_ip), ip_to_int(end_ip)))
+    if type == 'range6':
+        return len(list(ipaddress.summarize_address_range(ipaddress.IPv6Address(start_ip),
+                                                          ipaddress.IPv6Address(end_ip))))
+    return 1
+
+
+class Memo(dict):
+    """
+    dict computing missing values with a function of the key
+    """
+    def __init__(self, func):
+        super(Memo, self).__init__()
+        self.func = func
+
+    def __missing__(self, key):
+        value = self[key] = self.func(key)
+        return value
+
+
+class ACECostModel(object):
+    def __init__(self, devices):
+        """
+        :param devices: queryset of the devices to estimate
+        """
+        addresses = AddressObject.objects.filter(device__in=devices)
+        self.address_elements = dict(
+            (pk, address_elements(type, start_ip, end_ip))
+            for pk, type, start_ip, end_ip in addresses.values_list('pk', 'type', 'start_ip', 'end_ip'))
+        self.service_elements = dict(
+            (pk, PROTOCOL_ELEMENTS.get(protocol, 1))
+            for pk, protocol in ServiceObject.objects.filter(device__in=devices).values_list('pk', 'protocol'))
+
+        self.policies = Policy.objects.filter(device__in=devices)
+        self.groups = {
+            'addressgroup': load_members(AddressGroup.members, AddressGroup.objects.filter(device__in=devices), None),
+            'compoundservice': load_members(CompoundServiceObject.members,
+                                            CompoundServiceObject.objects.filter(device__in=devices), None),
+            'servicegroup': load_members(ServiceGroup.members, ServiceGroup.objects.filter(device__in=devices),
+                                         None),
+        }
+        addrsets = PolicyAddrSet.objects.filter(Q(pk__in=self.policies.values('source')) |
+                                                Q(pk__in=self.policies.values('destination')))
+        servicesets = PolicyServiceSet.objects.filter(pk__in=self.policies.values('services'))
+        zonesets = PolicyZoneSet.objects.filter(pk__in=self.policies.values('srczone'))
+        self.sets = {
+            'addresses': load_members(PolicyAddrSet.addresses, addrsets, None),
+            'addressgroups': load_members(PolicyAddrSet.addressgroups, addrsets, None),
+            'services': load_members(PolicyServiceSet.services, servicesets, None),
+            'compoundservices': load_members(PolicyServiceSet.compoundservices, servicesets, None),
+            'servicegroups': load_members(PolicyServiceSet.servicegroups, servicesets, None),
+            'zones': load_members(PolicyZoneSet.zones, zonesets, None),
+            'interfaces': load_members(PolicyZoneSet.interfaces, zonesets, None),
+        }
+        self.zone_names = dict((pk, o['name']) for pk, o in load_objects(
+            ZoneObject.objects.filter(device__in=devices), ('name',)).items())
+        self.interface_names = dict((pk, o['name']) for pk, o in load_objects(
+            Interface.objects.filter(device__in=devices), ('name',)).items())
+
+        self.compound_members = Memo(lambda pk: frozenset(self.groups['compoundservice'].get(pk, ())))
+        self.servicegroup_members = Memo(lambda pk: frozenset().union(
+            *(self.compound_members[c] for c in self.groups['servicegroup'].get(pk, ()))))
+        self.address_set_elements = Memo(self.count_address_set)
+        self.service_set_elements = Memo(self.count_service_set)
+        self.zone_set_acls = Memo(self.acl_names)
+
+    def count_address_set(self, pk):
+        members = set(self.sets['addresses'].get(pk, ()))
+        for group in self.sets['addressgroups'].get(pk, ()):
+            members.update(self.groups['addressgroup'].get(group, ()))
+        return sum(self.address_elements[m] for m in members) or 1
+
+    def count_service_set(self, pk):
+        members = set(self.sets['services'].get(pk, ()))
+        for compound in self.sets['compoundservices'].get(pk, ()):
+            members |= self.compound_members[compound]
+        for group in self.sets['servicegroups'].get(pk, ()):
+            members |= self.servicegroup_members[group]
+        return sum(self.service_elements[m] for m in members) or 1
+
+    def acl_names(self, pk):
+        names = [self.zone_names[z] for z in self.sets['zones'].get(pk, ())]
+        names += [self.interface_names[i] for i in self.sets['interfaces'].get(pk, ())]
+        return sorted(set(names)) or [ANY_ACL]
+
+    def estimate(self):
+        """
+        :return: list of policy dicts ('device', 'policyid', 'name', 'acls', 'sources', 'destinations', 'services',
+                 'elements' per ACL, 'total') in device and policy id order
+        """
+        result = []
+        for row in self.policies.order_by('device', 'policyid').values(
+                'device', 'policyid', 'name', 'source', 'destination', 'services', 'srczone'):
+            policy = OrderedDict([
+                ('device', row['device']),
+                ('policyid', row['policyid']),
+                ('name', row['name']),
+                ('acls', self.zone_set_acls[row['srczone']]),
+                ('sources', self.address_set_elements[row['source']]),
+                ('destinations', self.address_set_elements[row['destination']]),
+                ('services', self.service_set_elements[row['services']]),
+            ])
+            policy['elements'] = policy['sources'] * policy['destinations'] * policy['services']
+            policy['total'] = policy['elements'] * len(policy['acls'])
+            result.append(policy)
+        return result
+
+
+def acl_totals(policies):
+    """
+    :return: {(device pk, ACL name): [policies, elements]}
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for policy in policies:
+        for acl in policy['acls']:
+            total = totals[(policy['device'], acl)]
+            total[0] += 1
+            total[1] += policy['elements']
+    return totals
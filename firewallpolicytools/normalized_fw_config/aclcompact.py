@@ -0,0 +1,132 @@
+"""
+Compaction of the access-list entries of the ASA export.
+
+The ASA expands an ACE referencing object-groups into services x sources x destinations entries, with an address range
+counting once for every CIDR block it consists of. ACLCompactor collects the entries of the export as port ranges and
+address intervals instead of group lines and
+
+- merges overlapping and adjacent addresses into the minimal CIDR blocks covering the same addresses,
+- merges overlapping and adjacent port ranges of the same protocol,
+- merges entries of an ACL which differ in one dimension only into one entry with the union of that dimension,
+  until no two entries can be merged.
+
+The export writes permit entries only, so the entries of an ACL are order independent and their union is what the
+ACL permits: the compacted ACLs permit exactly the same traffic. Entries with an empty dimension match nothing and
+are left out.
+"""
+
+import ipaddress
+from collections import OrderedDict
+
+from normalized_fw_config.intervals import ADDRESS_BITS, MAX_ADDRESS, cidr_blocks, merge_intervals
+
+SERVICES, SOURCES, DESTINATIONS = 1, 2, 3
+
+
+def merge_services(services):
+    """
+    :param services: iterable of (protocol, start port, end port)
+    :return: sorted tuple with the overlapping and adjacent port ranges of each protocol merged
+    """
+    ports = OrderedDict()
+    for protocol, start, end in sorted(services):
+        ports.setdefault(protocol, []).append((start, end))
+    return tuple((protocol, start, end) for protocol, ranges in ports.items()
+                 for start, end in merge_intervals(ranges))
+
+
+def block_count(intervals):
+    return sum(len(cidr_blocks(start, end)) for start, end in intervals)
+
+
+def expanded_count(services, sources, destinations):
+    """
+    :return: number of entries an ACE expands to on the ASA
+    """
+    return len(services) * block_count(sources) * block_count(destinations)
+
+
+def network_members(intervals):
+    """
+    :return: object-group network member lines of the minimal CIDR blocks covering the intervals
+    """
+    members = []
+    for start, end in merge_intervals(intervals):
+        for network, prefixlen in cidr_blocks(start, end):
+            if prefixlen == ADDRESS_BITS:
+                members.append("network-object host %s" % ipaddress.IPv4Address(network))
+            else:
+                netmask = (MAX_ADDRESS << (ADDRESS_BITS - prefixlen)) & MAX_ADDRESS
+                members.append("network-object %s %s" % (ipaddress.IPv4Address(network),
+                                                         ipaddress.IPv4Address(netmask)))
+    return members
+
+
+def service_members(services):
+    """
+    :return: object-group service member lines of (protocol, start port, end port) tuples
+    """
+    members = []
+    for protocol, start, end in services:
+        if start == end:
+            members.append("service-object %s destination eq %s" % (protocol, start))
+        else:
+            members.append("service-object %s destination range %s %s" % (protocol, start, end))
+    return members
+
+
+class ACLCompactor(object):
+    def __init__(self):
+        # (acl, services, sources, destinations, group names) of the entries to write
+        self.entries = []
+        self.entries_before = 0
+        self.expanded_before = 0
+
+    def add(self, acl, services, sources, destinations, names, expanded):
+        """
+        :param services: iterable of (protocol, start port, end port)
+        :param sources: iterable of (start, end) address intervals
+        :param destinations: iterable of (start, end) address intervals
+        :param names: (service group, source group, destination group) names to write the entry with
+        :param expanded: number of entries the ACE expands to as written without compaction
+        """
+        self.entries_before += 1
+        self.expanded_before += expanded
+        entry = (acl, merge_services(services), merge_intervals(sources), merge_intervals(destinations), names)
+        if all(entry[SERVICES:DESTINATIONS + 1]):
+            self.entries.append(entry)
+
+    def compact(self):
+        """
+        Merge the entries and return them, in the order of the first entry merged into each
+        """
+        entries = self.entries
+        merged = True
+        while merged:
+            merged = False
+            for dimension in (DESTINATIONS, SOURCES, SERVICES):
+                groups = OrderedDict()
+                for entry in entries:
+                    # Entries of the same ACL with the same other two dimensions
+                    key = tuple(entry[i] for i in (0, SERVICES, SOURCES, DESTINATIONS) if i != dimension)
+                    groups.setdefault(key, []).append(entry)
+                if len(groups) < len(entries):
+                    merged = True
+                    entries = [self.union(group, dimension) for group in groups.values()]
+        self.entries = entries
+        return entries
+
+    def union(self, entries, dimension):
+        if len(entries) == 1:
+            return entries[0]
+        entry = list(entries[0])
+        if dimension == SERVICES:
+            entry[dimension] = merge_services(s for e in entries for s in e[dimension])
+        else:
+            entry[dimension] = merge_intervals(i for e in entries for i in e[dimension])
+        return tuple(entry)
+
+    def summary(self):
+        expanded = sum(expanded_count(*entry[SERVICES:DESTINATIONS + 1]) for entry in self.entries)
+        return "ACL compaction: %d ACEs expanding to %d entries compacted to %d ACEs expanding to %d entries" % (
+            self.entries_before, self.expanded_before, len(self.entries), expanded)
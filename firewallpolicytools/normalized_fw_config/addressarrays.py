@@ -0,0 +1,284 @@
+"""
+Vectorized analysis of the address objects of whole devices with NumPy.
+
+AddressArrays keeps the address objects of one or more devices as start/end arrays, uint32 for IPv4 and pairs of
+uint64 (high and low 64 bits) for IPv6, and answers overlap, containment and intersection queries against any number of
+networks with array operations. Queries against the union of the networks use sorted merged intervals and binary
+search, so their cost grows with (objects + networks) * log(networks) instead of objects * networks.
+
+NumPy is an optional dependency, creating AddressArrays without it raises ImportError.
+"""
+
+import ipaddress
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from normalized_fw_config.models import AddressObject
+
+MASK64 = (1 << 64) - 1
+OBJECT_FIELDS = ('pk', 'device', 'name', 'type', 'start_ip', 'end_ip', 'prefixlen')
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("NumPy is required for the vectorized address analysis (pip install numpy)")
+
+
+def object_interval(address):
+    """
+    :param address: AddressObject field dict
+    :return: (IP version, start, end) as integers, or None for objects without addresses (FQDNs)
+    """
+    if not address.get('start_ip'):
+        return None
+    start = ipaddress.ip_address(address['start_ip'])
+    if address['type'] in ('net4', 'net6'):
+        network = ipaddress.ip_network('%s/%d' % (start, address['prefixlen']), strict=False)
+        return network.version, int(network.network_address), int(network.broadcast_address)
+    if address['type'] in ('range4', 'range6'):
+        return start.version, int(start), int(ipaddress.ip_address(address['end_ip']))
+    return start.version, int(start), int(start)
+
+
+def less_equal(a, b):
+    """
+    Element wise a <= b of numbers given as tuples of words, most significant word first
+    """
+    result = a[-1] <= b[-1]
+    for x, y in zip(a[-2::-1], b[-2::-1]):
+        result = (x < y) | ((x == y) & result)
+    return result
+
+
+def take(words, index):
+    return tuple(w[index] for w in words)
+
+
+class Family(object):
+    """
+    Array representation of the integers of one IP version
+    """
+    def __init__(self, version):
+        self.version = version
+        self.nwords = 1 if version == 4 else 2
+
+    def words(self, values):
+        """
+        :param values: list of integers
+        :return: tuple of arrays, most significant word first
+        """
+        if self.nwords == 1:
+            return (numpy.array(values, dtype=numpy.uint32),)
+        return (numpy.array([v >> 64 for v in values], dtype=numpy.uint64),
+                numpy.array([v & MASK64 for v in values], dtype=numpy.uint64))
+
+    def sortable(self, words):
+        """
+        :return: an array searchsorted() compares in numeric order
+        """
+        if self.nwords == 1:
+            return words[0]
+        records = numpy.empty(len(words[0]), dtype=[('hi', numpy.uint64), ('lo', numpy.uint64)])
+        records['hi'], records['lo'] = words
+        return records
+
+    def difference(self, a, b):
+        """
+        :return: float64 array of a - b for a >= b, exact while the difference fits into the mantissa
+        """
+        if self.nwords == 1:
+            return a[0].astype(numpy.float64) - b[0].astype(numpy.float64)
+        borrow = (a[1] < b[1]).astype(numpy.uint64)
+        return (a[0] - b[0] - borrow).astype(numpy.float64) * 2.0 ** 64 + (a[1] - b[1]).astype(numpy.float64)
+
+
+class NetworkColumns(object):
+    """
+    The query networks of one IP version: as given, merged into their union, and reduced to the minimal networks
+    (those containing no other one)
+    """
+    def __init__(self, family, intervals):
+        self.family = family
+        self.count = len(intervals)
+        self.starts = family.words([s for s, e in intervals])
+        self.ends = family.words([e for s, e in intervals])
+
+        union = []
+        for start, end in sorted(intervals):
+            if union and start <= union[-1][1] + 1:
+                union[-1][1] = max(union[-1][1], end)
+            else:
+                union.append([start, end])
+        self.union_count = len(union)
+        self.union_starts = family.words([s for s, e in union])
+        self.union_ends = family.words([e for s, e in union])
+        self.union_search = family.sortable(self.union_starts)
+        # Number of union addresses before each union interval
+        self.union_sizes = numpy.array([float(e - s + 1) for s, e in union])
+        self.union_before = numpy.cumsum(numpy.concatenate(([0.0], self.union_sizes[:-1])))
+
+        # Networks nest or are disjoint, without the networks containing others the rest is disjoint and sorted
+        minimal = []
+        for start, end in sorted(intervals, key=lambda i: (i[0], -i[1])):
+            while minimal and minimal[-1][1] >= end:
+                minimal.pop()
+            minimal.append((start, end))
+        self.minimal_count = len(minimal)
+        self.minimal_starts = family.sortable(family.words([s for s, e in minimal]))
+        self.minimal_ends = family.words([e for s, e in minimal])
+
+    def covered(self, values):
+        """
+        :param values: words of one value per object
+        :return: (index of the last union interval starting at or before each value, -1 if none,
+                  words of the value clipped to the end of that interval,
+                  bool array which is True for values within the union)
+        """
+        i = numpy.searchsorted(self.union_search, self.family.sortable(values), side='right') - 1
+        ends = take(self.union_ends, numpy.maximum(i, 0))
+        inside = (i >= 0) & less_equal(values, ends)
+        return i, tuple(numpy.where(inside, v, e) for v, e in zip(values, ends)), inside
+
+
+class QueryNetworks(object):
+    """
+    Networks to query AddressArrays with, prepared once for any number of queries
+    """
+    def __init__(self, networks):
+        require_numpy()
+        self.networks = [ipaddress.ip_network(n, strict=False) for n in networks]
+        intervals = {4: [], 6: []}
+        for network in self.networks:
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self.columns = dict((version, NetworkColumns(Family(version), intervals[version])) for version in (4, 6))
+
+
+class ObjectColumns(object):
+    """
+    The address objects of one IP version
+    """
+    def __init__(self, family, index, intervals):
+        """
+        :param index: position of every object in AddressArrays.addresses
+        """
+        self.family = family
+        self.index = numpy.array(index, dtype=numpy.int64)
+        self.starts = family.words([s for s, e in intervals])
+        self.ends = family.words([e for s, e in intervals])
+
+
+class AddressArrays(object):
+    def __init__(self, addresses):
+        """
+        :param addresses: iterable of AddressObject field dicts
+        """
+        require_numpy()
+        self.addresses = list(addresses)
+        intervals = {4: [], 6: []}
+        indexes = {4: [], 6: []}
+        for i, address in enumerate(self.addresses):
+            interval = object_interval(address)
+            if interval is not None:
+                version, start, end = interval
+                intervals[version].append((start, end))
+                indexes[version].append(i)
+        self.columns = dict((version, ObjectColumns(Family(version), indexes[version], intervals[version]))
+                            for version in (4, 6))
+
+    @classmethod
+    def from_devices(cls, devices):
+        """
+        Load all address objects of the devices with one query
+        """
+        return cls(AddressObject.objects.filter(device__in=devices).order_by('pk').values(*OBJECT_FIELDS))
+
+    def query(self, networks, func, dtype=bool):
+        """
+        Run a query for both IP versions
+
+        :param func: func(ObjectColumns, NetworkColumns) returning one value per object
+        :return: array with one value per address object, False (or 0) for FQDN objects
+        """
+        if not isinstance(networks, QueryNetworks):
+            networks = QueryNetworks(networks)
+        result = numpy.zeros(len(self.addresses), dtype=dtype)
+        for version, objects in self.columns.items():
+            columns = networks.columns[version]
+            if len(objects.index) and columns.count:
+                result[objects.index] = func(objects, columns)
+        return result
+
+    def overlaps(self, networks):
+        """
+        :return: bool array, True for objects sharing at least one address with the networks
+        """
+        def overlaps(objects, columns):
+            i = numpy.searchsorted(columns.union_search, objects.family.sortable(objects.ends), side='right') - 1
+            return (i >= 0) & less_equal(objects.starts, take(columns.union_ends, numpy.maximum(i, 0)))
+        return self.query(networks, overlaps)
+
+    def within(self, networks):
+        """
+        :return: bool array, True for objects whose addresses all lie within the networks
+        """
+        def within(objects, columns):
+            i = numpy.searchsorted(columns.union_search, objects.family.sortable(objects.starts), side='right') - 1
+            return (i >= 0) & less_equal(objects.ends, take(columns.union_ends, numpy.maximum(i, 0)))
+        return self.query(networks, within)
+
+    def contains(self, networks):
+        """
+        :return: bool array, True for objects which contain at least one of the networks entirely
+        """
+        def contains(objects, columns):
+            # The first minimal network starting within the object ends first
+            i = numpy.searchsorted(columns.minimal_starts, objects.family.sortable(objects.starts), side='left')
+            found = i < columns.minimal_count
+            return found & less_equal(take(columns.minimal_ends, numpy.minimum(i, columns.minimal_count - 1)),
+                                      objects.ends)
+        return self.query(networks, contains)
+
+    def intersection_size(self, networks):
+        """
+        :return: float64 array with the number of addresses each object shares with the networks
+        """
+        def intersection_size(objects, columns):
+            family = objects.family
+            end_index, end_last, end_inside = columns.covered(objects.ends)
+            start_index, start_last, start_inside = columns.covered(objects.starts)
+            # Within one union interval the size is a difference of the words, exact for small IPv6 objects
+            same = numpy.where(start_inside, family.difference(end_last, objects.starts) + 1, 0.0)
+            # Otherwise: the rest of the first interval, the intervals in between and the start of the last one
+            first = numpy.maximum(start_index, 0)
+            last = numpy.maximum(end_index, 0)
+            rest = numpy.where(start_inside, family.difference(take(columns.union_ends, first), objects.starts) + 1,
+                               0.0)
+            between = columns.union_before[last] - columns.union_before[first] - \
+                numpy.where(start_index >= 0, columns.union_sizes[first], 0.0)
+            tail = family.difference(end_last, take(columns.union_starts, last)) + 1
+            return numpy.where(start_index == end_index, same, rest + between + tail)
+        return self.query(networks, intersection_size, dtype=numpy.float64)
+
+    def overlap_matrix(self, networks):
+        """
+        :return: bool array of shape (objects, networks), True where an object overlaps a network. The matrix holds
+                 objects * networks bytes, use overlaps() for large network lists.
+        """
+        if not isinstance(networks, QueryNetworks):
+            networks = QueryNetworks(networks)
+        matrix = numpy.zeros((len(self.addresses), len(networks.networks)), dtype=bool)
+        for version, objects in self.columns.items():
+            columns = networks.columns[version]
+            if not (len(objects.index) and columns.count):
+                continue
+            starts = tuple(w[:, None] for w in objects.starts)
+            ends = tuple(w[:, None] for w in objects.ends)
+            overlap = less_equal(starts, tuple(w[None, :] for w in columns.ends)) & \
+                less_equal(tuple(w[None, :] for w in columns.starts), ends)
+            # The columns of a version hold its networks in the given order
+            targets = [i for i, n in enumerate(networks.networks) if n.version == version]
+            matrix[numpy.ix_(objects.index, targets)] = overlap
+        return matrix
@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib import admin
 
 # Register your models here.
@@ -12,13 +13,15 @@ from normalized_fw_config.models import RawConfigFile, \
     ZoneObject, \
     Device, \
     Interface, \
+    Route, \
     PolicyAddrSet, \
     PolicyZoneSet, \
-    PolicyServiceSet
+    PolicyServiceSet, \
+    set_fingerprint
 
 @admin.register(RawConfigFile)
 class RawConfigFileAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('name', 'import_date', 'size', 'digest')
 
 @admin.register(ConfigVersion)
 class ConfigVersionAdmin(admin.ModelAdmin):
@@ -79,8 +82,44 @@ class InterfaceAdmin(admin.ModelAdmin):
     fields = ('name', 'device')
     list_display = fields
 
+@admin.register(Route)
+class RouteAdmin(admin.ModelAdmin):
+    fields = ('network', 'prefixlen', 'gateway', 'interface', 'device')
+    list_display = fields
+    list_filter = ('device',)
+
+class PolicySetForm(forms.ModelForm):
+    def clean(self):
+        """
+        Reject members which equal those of another set, their fingerprints would collide
+        """
+        cleaned_data = super(PolicySetForm, self).clean()
+        model = self._meta.model
+        members = []
+        for relation in model.FINGERPRINT_RELATIONS:
+            if relation in cleaned_data:
+                members.append([obj.pk for obj in cleaned_data[relation]])
+            elif self.instance.pk is not None:
+                # Relations which are not on the form keep their members
+                members.append(getattr(self.instance, relation).values_list('pk', flat=True))
+            else:
+                members.append([])
+        other = model.objects.filter(fingerprint=set_fingerprint(members)).exclude(pk=self.instance.pk).first()
+        if other is not None:
+            raise forms.ValidationError("Policy set %(pk)d already has exactly these members", params={'pk': other.pk},
+                                        code='duplicate')
+        return cleaned_data
+
+class PolicySetAdmin(admin.ModelAdmin):
+    form = PolicySetForm
+
+    def save_related(self, request, form, formsets, change):
+        # The members are saved with the related objects, keep the fingerprint in sync with them
+        super(PolicySetAdmin, self).save_related(request, form, formsets, change)
+        form.instance.update_fingerprint()
+
 @admin.register(PolicyAddrSet)
-class PolicyAddrSetAdmin(admin.ModelAdmin):
+class PolicyAddrSetAdmin(PolicySetAdmin):
     fields = ('addresses', 'addressgroups')
     list_display = ('addrlist', 'addrgrouplist')
 
@@ -91,7 +130,7 @@ class PolicyAddrSetAdmin(admin.ModelAdmin):
         return ", ".join([i.name for i in obj.addressgroups.all()])
 
 @admin.register(PolicyServiceSet)
-class PolicyServiceSetAdmin(admin.ModelAdmin):
+class PolicyServiceSetAdmin(PolicySetAdmin):
     fields = ('services','servicegroups')
     list_display = ('compoundservicelist','servicelist', 'servicegrouplist')
 
@@ -105,7 +144,7 @@ class PolicyServiceSetAdmin(admin.ModelAdmin):
         return ", ".join([i.name for i in obj.servicegroups.all()])
 
 @admin.register(PolicyZoneSet)
-class PolicyZoneSetAdmin(admin.ModelAdmin):
+class PolicyZoneSetAdmin(PolicySetAdmin):
     fields = ('zones', 'interfaces')
     list_display = ('zonelist', 'interfacelist')
 
@@ -0,0 +1,384 @@
+"""
+Detection of shadowed, redundant and correlated policies.
+
+Every policy is turned into five integer interval sets, one per dimension: source and destination zones, source and
+destination addresses and services. Zones and interfaces are numbered per device (a zone stands for its member
+interfaces), IPv4 addresses are their integer value with IPv6 addresses and FQDNs in separate ranges above them, and
+services are protocol * 65536 + destination port. An empty dimension or 'any' covers the whole range. An address set
+covering all IPv4 addresses also covers the FQDN range, as every FQDN resolves to some IPv4 address.
+
+Policies are walked in sequence order and classified like in Al-Shaer and Hamed's firewall anomaly model:
+
+- shadowed: an earlier policy matches all its traffic, so the policy never matches
+- redundant: a later policy with the same action matches all its traffic and no policy in between matching some of
+  it has a different action, so removing the policy changes nothing
+- correlated: an earlier policy with a different action matches some but not all of its traffic, and the policy does
+  not match all of the earlier one's either, so the order of the two decides
+
+Deny and reject count as the same action. Comparing every pair of policies does not scale to 20k policies, so every
+dimension has a DimensionIndex answering with one bitset of policies which policies overlap a set, and which contain
+its first and last value. The bitsets of the five dimensions are intersected, so overlaps need no further check and
+only the remaining containment candidates are checked exactly.
+"""
+
+import ipaddress
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.db.models import Q
+
+from normalized_fw_config.intervals import MAX_ADDRESS, address_interval, merge_intervals
+from normalized_fw_config.models import *
+from normalized_fw_config.policygraph import load_members, load_objects
+
+DIMENSIONS = ('srczone', 'dstzone', 'source', 'destination', 'services')
+
+SHADOWED = 'shadowed'
+REDUNDANT = 'redundant'
+CORRELATED = 'correlated'
+
+IPV6_OFFSET = MAX_ADDRESS + 1
+FQDN_OFFSET = IPV6_OFFSET + (1 << 128)
+PORTS = 1 << 16
+PROTOCOLS = 256
+# ServiceObject protocols standing for several protocols, and protocol 0 (IP) for all of them
+PROTOCOL_MEMBERS = {256: (6, 17), 257: (6, 17, 132)}
+ANY = ((0, FQDN_OFFSET + (1 << 64)),)
+FQDNS = (FQDN_OFFSET, ANY[0][1])
+ANY_NAME = 'any'
+
+
+def address_value_interval(address, fqdns):
+    """
+    :param address: AddressObject field dict
+    :param fqdns: {fqdn: number} the numbers of FQDNs are taken from, missing ones are added
+    :return: (start, end) in the address dimension
+    """
+    if address['type'] in ('ip6', 'net6', 'range6'):
+        start = int(ipaddress.IPv6Address(address['start_ip']))
+        if address['type'] == 'net6':
+            size = 1 << (128 - address['prefixlen'])
+            start &= ~(size - 1)
+            end = start + size - 1
+        elif address['type'] == 'range6':
+            end = int(ipaddress.IPv6Address(address['end_ip']))
+        else:
+            end = start
+        return IPV6_OFFSET + start, IPV6_OFFSET + end
+    interval = address_interval(address)
+    if interval is None:
+        number = fqdns.setdefault(address['fqdn'] or address['name'], len(fqdns))
+        return FQDN_OFFSET + number, FQDN_OFFSET + number
+    return interval
+
+
+def service_value_intervals(service):
+    """
+    :param service: ServiceObject field dict ('protocol', 'start_port', 'end_port')
+    :return: list of (start, end) in the service dimension
+    """
+    if service['protocol'] == 0:
+        return [(0, PROTOCOLS * PORTS - 1)]
+    intervals = []
+    for protocol in PROTOCOL_MEMBERS.get(service['protocol'], (service['protocol'],)):
+        if service['start_port'] is None:
+            intervals.append((protocol * PORTS, (protocol + 1) * PORTS - 1))
+        else:
+            end_port = service['start_port'] if service['end_port'] is None else service['end_port']
+            intervals.append((protocol * PORTS + service['start_port'], protocol * PORTS + end_port))
+    return intervals
+
+
+def contains(outer, inner):
+    """
+    :param outer: merged intervals, as returned by merge_intervals()
+    :param inner: merged intervals
+    :return: True if every integer of inner is in outer
+    """
+    if outer is inner:
+        return True
+    starts = [start for start, end in outer]
+    for start, end in inner:
+        i = bisect_right(starts, start) - 1
+        if i < 0 or outer[i][1] < end:
+            return False
+    return True
+
+
+def sum_masks(masks):
+    mask = 0
+    for m in masks:
+        mask |= m
+    return mask
+
+
+def bit_positions(mask):
+    """
+    :return: iterator over the positions of the set bits of mask, lowest first
+    """
+    binary = bin(mask)
+    last = len(binary) - 1
+    i = binary.rfind('1')
+    while i > 1:
+        yield last - i
+        i = binary.rfind('1', 0, i)
+
+
+class DimensionIndex(object):
+    """
+    Index of the intervals of one dimension of all policies
+
+    Policies are bits of Python integers, and every distinct interval has the bitset of the policies using it. The
+    intervals are kept in classes of the same bit length, sorted by start: an interval of length below
+    2 ** (k + 1) overlapping [start, end] starts in [start - 2 ** (k + 1) + 1, end], so each class is searched with
+    two bisects, a check of the ends of the intervals starting before start and the union of the bitsets of the
+    intervals starting within, which is taken over blocks of BLOCK intervals. Queries are exact and memoized per
+    interval.
+    """
+    BLOCK = 64
+
+    def __init__(self, sets):
+        """
+        :param sets: list of merged intervals, one per policy bit
+        """
+        bits = {}
+        for bit, intervals in enumerate(sets):
+            bits.setdefault(intervals, []).append(bit)
+        interval_masks = {}
+        for intervals, members in bits.items():
+            mask = sum(1 << bit for bit in members)
+            for interval in intervals:
+                interval_masks[interval] = interval_masks.get(interval, 0) | mask
+        classes = {}
+        for (start, end), mask in sorted(interval_masks.items()):
+            classes.setdefault((end - start + 1).bit_length(), []).append((start, end, mask))
+        self.classes = []
+        for length, entries in sorted(classes.items()):
+            masks = [mask for start, end, mask in entries]
+            blocks = [sum_masks(masks[i:i + self.BLOCK]) for i in range(0, len(masks), self.BLOCK)]
+            self.classes.append((1 << length, [start for start, end, mask in entries],
+                                 [end for start, end, mask in entries], masks, blocks))
+        # Intervals recur in many sets, and only sets of several policies are queried more than once
+        self.shared = set(intervals for intervals, members in bits.items() if len(members) > 1)
+        self.interval_cache = {}
+        self.cache = {}
+
+    def range_mask(self, masks, blocks, i, j):
+        """
+        :return: union of masks[i:j]
+        """
+        mask = 0
+        while i < j and i % self.BLOCK:
+            mask |= masks[i]
+            i += 1
+        while i + self.BLOCK <= j:
+            mask |= blocks[i // self.BLOCK]
+            i += self.BLOCK
+        while i < j:
+            mask |= masks[i]
+            i += 1
+        return mask
+
+    def interval_mask(self, start, end):
+        """
+        :return: bitset of the policies sharing an integer with [start, end]
+        """
+        mask = 0
+        for limit, starts, ends, masks, blocks in self.classes:
+            inside = bisect_left(starts, start)
+            for i in range(bisect_left(starts, start - limit + 1, 0, inside), inside):
+                if ends[i] >= start:
+                    mask |= masks[i]
+            mask |= self.range_mask(masks, blocks, inside, bisect_right(starts, end, inside))
+        return mask
+
+    def interval_overlapping(self, interval):
+        if interval not in self.interval_cache:
+            self.interval_cache[interval] = self.interval_mask(*interval)
+        return self.interval_cache[interval]
+
+    def overlapping(self, intervals):
+        """
+        :return: bitset of the policies sharing an integer with the intervals
+        """
+        if intervals in self.cache:
+            return self.cache[intervals]
+        mask = 0
+        for interval in intervals:
+            mask |= self.interval_overlapping(interval)
+        if intervals in self.shared:
+            self.cache[intervals] = mask
+        return mask
+
+
+class PolicyIntervals(object):
+    def __init__(self, device):
+        """
+        Load the policies of a device in sequence order with the interval sets of their dimensions. The whole device
+        is read with a fixed number of queries.
+        """
+        self.device = device
+        policies = Policy.objects.filter(device=device).order_by('sequence', 'policyid')
+        self.policies = list(policies.values('policyid', 'name', 'sequence', 'action', *DIMENSIONS))
+
+        addrsets = PolicyAddrSet.objects.filter(Q(pk__in=policies.values('source')) |
+                                                Q(pk__in=policies.values('destination')))
+        servicesets = PolicyServiceSet.objects.filter(pk__in=policies.values('services'))
+        zonesets = PolicyZoneSet.objects.filter(Q(pk__in=policies.values('srczone')) |
+                                                Q(pk__in=policies.values('dstzone')))
+
+        addresses = load_objects(AddressObject.objects.filter(device=device),
+                                 ('type', 'name', 'start_ip', 'end_ip', 'prefixlen', 'fqdn'))
+        fqdns = {}
+        address_intervals = dict((pk, address_value_interval(a, fqdns)) for pk, a in sorted(addresses.items()))
+        services = load_objects(ServiceObject.objects.filter(device=device), ('protocol', 'start_port', 'end_port'))
+        service_intervals = dict((pk, service_value_intervals(s)) for pk, s in services.items())
+
+        addrgroups = load_members(AddressGroup.members, AddressGroup.objects.filter(device=device), None)
+        compoundservices = load_members(CompoundServiceObject.members,
+                                        CompoundServiceObject.objects.filter(device=device), None)
+        servicegroups = load_members(ServiceGroup.members, ServiceGroup.objects.filter(device=device), None)
+        set_addresses = load_members(PolicyAddrSet.addresses, addrsets, None)
+        set_addrgroups = load_members(PolicyAddrSet.addressgroups, addrsets, None)
+        set_services = load_members(PolicyServiceSet.services, servicesets, None)
+        set_compoundservices = load_members(PolicyServiceSet.compoundservices, servicesets, None)
+        set_servicegroups = load_members(PolicyServiceSet.servicegroups, servicesets, None)
+
+        # Interfaces are numbered first, zones without members after them
+        interfaces = load_objects(Interface.objects.filter(device=device), ('name',))
+        zones = load_objects(ZoneObject.objects.filter(device=device), ('name',))
+        zone_members = load_members(ZoneObject.members, ZoneObject.objects.filter(device=device), None)
+        numbers = dict((pk, number) for number, pk in enumerate(sorted(interfaces)))
+        any_names = set(pk for pk, i in interfaces.items() if i['name'] == ANY_NAME)
+        # {interface or zone name: values}, interfaces win over zones of the same name like in the import
+        self.zone_values = dict((z['name'], tuple(numbers[i] for i in zone_members.get(pk, ())) or
+                                 (len(numbers) + pk,)) for pk, z in zones.items())
+        self.zone_values.update((i['name'], (numbers[pk],)) for pk, i in interfaces.items())
+        set_zones = load_members(PolicyZoneSet.zones, zonesets, None)
+        set_interfaces = load_members(PolicyZoneSet.interfaces, zonesets, None)
+
+        def address_set(pk):
+            intervals = [address_intervals[a] for a in set_addresses.get(pk, ())]
+            for group in set_addrgroups.get(pk, ()):
+                intervals.extend(address_intervals[a] for a in addrgroups.get(group, ()))
+            merged = merge_intervals(intervals)
+            if merged and merged[0][0] == 0 and merged[0][1] >= MAX_ADDRESS:
+                merged = merge_intervals(merged + (FQDNS,))
+            return merged or ANY
+
+        def service_set(pk):
+            members = set(set_services.get(pk, ()))
+            for compound in set_compoundservices.get(pk, ()):
+                members.update(compoundservices.get(compound, ()))
+            for group in set_servicegroups.get(pk, ()):
+                for compound in servicegroups.get(group, ()):
+                    members.update(compoundservices.get(compound, ()))
+            return merge_intervals(i for s in members for i in service_intervals[s]) or ANY
+
+        def zone_set(pk):
+            if any(i in any_names for i in set_interfaces.get(pk, ())) or \
+                    any(zones[z]['name'] == ANY_NAME for z in set_zones.get(pk, ())):
+                return ANY
+            values = [numbers[i] for i in set_interfaces.get(pk, ())]
+            for zone in set_zones.get(pk, ()):
+                values += [numbers[i] for i in zone_members.get(zone, ())] or [len(numbers) + zone]
+            return merge_intervals((v, v) for v in values) or ANY
+
+        converters = {'source': address_set, 'destination': address_set, 'services': service_set,
+                      'srczone': zone_set, 'dstzone': zone_set}
+        # Sets shared between policies are converted once and are the same tuple, which contains() compares without
+        # looking at the intervals
+        converted = {}
+        self.intervals = {}
+        for dimension in DIMENSIONS:
+            convert = converters[dimension]
+            values = []
+            for policy in self.policies:
+                key = (convert, policy[dimension])
+                if key not in converted:
+                    converted[key] = ANY if policy[dimension] is None else convert(policy[dimension])
+                values.append(converted[key])
+            self.intervals[dimension] = values
+
+
+class PolicyAnomalies(PolicyIntervals):
+    def __init__(self, device):
+        super(PolicyAnomalies, self).__init__(device)
+        self.indexes = dict((dimension, DimensionIndex(self.intervals[dimension])) for dimension in DIMENSIONS)
+        self.permits = sum(1 << bit for bit, policy in enumerate(self.policies) if policy['action'] == 'permit')
+        self.all = (1 << len(self.policies)) - 1
+
+    def overlapping(self, bit):
+        """
+        :return: bitset of the policies sharing traffic with the policy
+        """
+        mask = self.all
+        for dimension in DIMENSIONS:
+            mask &= self.indexes[dimension].overlapping(self.intervals[dimension][bit])
+            if not mask:
+                break
+        return mask
+
+    def containing(self, bit, overlapping):
+        """
+        :param overlapping: the policies overlapping the policy
+        :return: bitset of the candidates for containing the policy: the policies overlapping its first and last
+                 interval in every dimension
+        """
+        mask = overlapping
+        for dimension in DIMENSIONS:
+            intervals = self.intervals[dimension][bit]
+            index = self.indexes[dimension]
+            mask &= index.interval_overlapping(intervals[0]) & index.interval_overlapping(intervals[-1])
+            if not mask:
+                break
+        return mask
+
+    def covers(self, outer, inner):
+        return all(contains(self.intervals[d][outer], self.intervals[d][inner]) for d in DIMENSIONS)
+
+    def other_action(self, bit):
+        return self.all & ~self.permits if self.permits >> bit & 1 else self.permits
+
+    def finding(self, kind, bit, other):
+        policy = self.policies[bit]
+        other = self.policies[other]
+        return OrderedDict([
+            ('kind', kind),
+            ('policyid', policy['policyid']),
+            ('name', policy['name']),
+            ('action', policy['action']),
+            ('other_policyid', other['policyid']),
+            ('other_name', other['name']),
+            ('other_action', other['action']),
+        ])
+
+    def analyze(self):
+        """
+        :return: list of findings ('kind', 'policyid', 'name', 'action' and the same of the other policy), in the
+                 sequence order of the policies. A shadowed policy is reported once, with the first policy
+                 shadowing it, and is not checked for redundancy or correlation.
+        """
+        findings = []
+        for bit in range(len(self.policies)):
+            earlier = (1 << bit) - 1
+            overlapping = self.overlapping(bit) & ~(1 << bit)
+            containing = self.containing(bit, overlapping)
+            shadowing = next((other for other in bit_positions(containing & earlier) if self.covers(other, bit)),
+                             None)
+            if shadowing is not None:
+                findings.append(self.finding(SHADOWED, bit, shadowing))
+                continue
+
+            conflicting = overlapping & self.other_action(bit)
+            # Only the first later policy containing this one can make it redundant: a later one with the same action
+            # has the first one in between, which matches traffic of this policy with the other action.
+            later = next((other for other in bit_positions(containing & ~earlier) if self.covers(other, bit)), None)
+            if later is not None and not (self.permits >> later ^ self.permits >> bit) & 1:
+                if not conflicting & ((1 << later) - 1) & ~earlier:
+                    findings.append(self.finding(REDUNDANT, bit, later))
+
+            for other in bit_positions(conflicting & earlier):
+                if not self.covers(bit, other):
+                    findings.append(self.finding(CORRELATED, bit, other))
+        return findings
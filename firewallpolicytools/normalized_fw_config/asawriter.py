@@ -0,0 +1,99 @@
+"""
+Streaming writer for Cisco ASA configurations.
+
+ASAConfigWriter writes every definition to the output file as soon as it is produced instead of collecting the
+configuration in strings. Network objects are written once, before the first object-group using them, and
+object-groups before the access-list entries referencing them, so the output is in dependency order while only the
+names written so far are kept in memory.
+
+Object-groups are hash-consed: a group is identified by its kind and its set of member lines, and a group with the
+same members as one written before is not written again, its first name is used instead.
+"""
+
+
+def group_key(kind, members):
+    return kind, tuple(sorted(set(members)))
+
+
+class ASAConfigWriter(object):
+    def __init__(self, fh, dedup=True):
+        """
+        :param dedup: share one object-group between all requests with the same members
+        """
+        self.fh = fh
+        self.dedup = dedup
+        self.objects = set()
+        self.groups = set()
+        # {group key: name} of the groups written, and of the preferred names of member sets
+        self.written = {}
+        self.preferred = {}
+        # Names asked for, whether written or replaced with the name of an identical group
+        self.requested = set()
+        self.groups_written = 0
+        self.groups_reused = 0
+        self.lines_saved = 0
+
+    def comment(self, text):
+        self.fh.write("!%s\n" % text)
+
+    def network_object(self, name, kind, *values):
+        """
+        Write an object network definition unless it has been written before
+
+        :param kind: 'subnet', 'range' or 'host'
+        :param values: e.g. the network address and netmask of a subnet
+        """
+        if name in self.objects:
+            return
+        self.objects.add(name)
+        self.fh.write("object network %s\n %s %s\nexit\n" % (name, kind, ' '.join(values)))
+
+    def prefer_name(self, kind, name, members):
+        """
+        Name the group of these members name instead of the name of its first request, e.g. to keep the name of an
+        existing group with exactly these members
+        """
+        self.preferred.setdefault(group_key(kind, members), name)
+
+    def object_group(self, kind, name, members, objects=()):
+        """
+        Write an object-group, or find the group written before with the same members
+
+        :param kind: 'network' or 'service'
+        :param members: member lines, e.g. 'network-object host 10.0.0.1'
+        :param objects: (name, kind, values) of the network objects the members reference, written before the group
+        :return: the name of the group to reference
+        """
+        key = group_key(kind, members)
+        if self.dedup:
+            if key in self.written:
+                # Requests repeating a name, like the service group of both directions of a policy, save nothing
+                if name not in self.requested:
+                    self.requested.add(name)
+                    self.groups_reused += 1
+                    self.lines_saved += len(key[1]) + 2
+                return self.written[key]
+            preferred = self.preferred.get(key)
+            if preferred is not None and preferred not in self.groups:
+                name = preferred
+        elif name in self.groups:
+            return name
+        for object_name, object_kind, values in objects:
+            self.network_object(object_name, object_kind, *values)
+        self.groups.add(name)
+        self.requested.add(name)
+        self.written[key] = name
+        self.groups_written += 1
+        self.fh.write("object-group %s %s\n" % (kind, name))
+        for member in key[1]:
+            self.fh.write(" %s\n" % member)
+        self.fh.write("exit\n")
+        return name
+
+    def summary(self):
+        return "%d object-groups written, %d replaced with an identical group, %d lines saved" % (
+            self.groups_written, self.groups_reused, self.lines_saved)
+
+    def access_list(self, acl, service, source, destination):
+        self.fh.write("access-list %s line 1 extended permit object-group %s object-group %s object-group %s log\n" % (
+            acl, service, source, destination))
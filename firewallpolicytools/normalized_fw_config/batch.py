@@ -0,0 +1,81 @@
+"""
+Parsing of many configuration files in worker processes for the parsefgconfig-batch command.
+
+The workers only parse, the tree of every file is handed back to the calling process which imports the files one
+after another in the order they were given, so the database keeps a single writer.
+"""
+
+import glob
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+
+from normalized_fw_config.parsecache import ParseCache, load_config
+
+# Sections counted as objects for the throughput report
+OBJECT_SECTIONS = ('firewall address', 'firewall addrgrp', 'firewall service custom', 'firewall service group',
+                   'firewall policy')
+
+
+def expand_paths(patterns):
+    """
+    :param patterns: configuration files, directories (all files directly in them) or glob patterns
+    :return: sorted list of files, without duplicates
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(os.path.join(pattern, name) for name in os.listdir(pattern))
+        else:
+            paths.update(glob.glob(pattern) or [pattern])
+    return sorted(p for p in paths if not os.path.isdir(p))
+
+
+def count_objects(configdict):
+    vdoms = list(configdict['vdom'].values()) if 'vdom' in configdict else [configdict]
+    return sum(len(vdom.get(section, {})) for vdom in vdoms for section in OBJECT_SECTIONS)
+
+
+def parse_file(path, usecache=True):
+    """
+    :return: (configdict, modification time, True if read from the parse cache, number of objects, seconds)
+    """
+    start = time.time()
+    configtime = os.path.getmtime(path)
+    configdict, cached = load_config(path, ParseCache() if usecache else None)
+    return configdict, configtime, cached, count_objects(configdict), time.time() - start
+
+
+def parse_files(paths, workers, usecache=True):
+    """
+    Parse files in a pool of worker processes
+
+    :return: generator of (path, future) tuples in the order of paths, the future's result is the tuple returned by
+             parse_file(). At most twice as many files as there are workers are parsed ahead of the consumer.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context, initializer = multiprocessing.get_context('fork'), None
+    else:
+        context, initializer = None, django.setup
+    # Forked workers must not share the open database connection
+    connections.close_all()
+    paths = iter(paths)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer) as pool:
+        def submit():
+            path = next(paths, None)
+            if path is not None:
+                pending.append((path, pool.submit(parse_file, path, usecache)))
+
+        for i in range(2 * workers):
+            submit()
+        while pending:
+            path, future = pending.popleft()
+            # Keep the workers busy while the consumer imports this file
+            submit()
+            yield path, future
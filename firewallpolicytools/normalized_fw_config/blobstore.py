@@ -0,0 +1,117 @@
+"""
+Content-addressed store for raw configuration files.
+
+A file is split into chunks at line boundaries chosen by the content of the lines, so an edit only changes the chunks
+around it and the chunks of the rest of the file are shared with earlier imports. Every chunk is compressed and
+stored once under the sha256 of its uncompressed bytes, a Blob lists the chunks of a file under the sha256 of the
+whole file. Storing identical content again only looks up the existing rows.
+"""
+
+import hashlib
+import io
+import lzma
+import zlib
+
+from normalized_fw_config.models import Blob, BlobChunk
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+DEFAULT_CODEC = 'zlib'
+
+# A chunk ends after a line whose crc32 is a multiple of CHUNK_BOUNDARY once it holds MIN_CHUNK_SIZE bytes, and is
+# cut at the next line end after MAX_CHUNK_SIZE bytes. With typical configuration lines chunks average ~300 KiB.
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+CHUNK_BOUNDARY = 8192
+
+
+def split_chunks(fh):
+    """
+    :param fh: binary file object
+    :return: generator of chunks (bytes), each ending at a line boundary unless it is the end of the file
+    """
+    lines = []
+    size = 0
+    for line in fh:
+        lines.append(line)
+        size += len(line)
+        if size >= MIN_CHUNK_SIZE and (size >= MAX_CHUNK_SIZE or zlib.crc32(line) % CHUNK_BOUNDARY == 0):
+            yield b''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b''.join(lines)
+
+
+class BlobStore(object):
+    """
+    Stores and reads blobs. The models can be replaced by the historical models of a data migration.
+    """
+    def __init__(self, blobmodel=Blob, chunkmodel=BlobChunk, codec=DEFAULT_CODEC):
+        if codec not in CODECS:
+            raise ValueError("Unknown compression codec '%s'" % codec)
+        self.blobmodel = blobmodel
+        self.chunkmodel = chunkmodel
+        self.codec = codec
+
+    def put(self, fh):
+        """
+        Store the content of a binary file object
+
+        :return: the Blob
+        """
+        compress = CODECS[self.codec][0]
+        filehash = hashlib.sha256()
+        digests = []
+        size = 0
+        for chunk in split_chunks(fh):
+            filehash.update(chunk)
+            size += len(chunk)
+            digest = hashlib.sha256(chunk).hexdigest()
+            digests.append(digest)
+            if not self.chunkmodel.objects.filter(digest=digest).exists():
+                self.chunkmodel.objects.create(digest=digest, size=len(chunk), codec=self.codec,
+                                               data=compress(chunk))
+        blob, created = self.blobmodel.objects.get_or_create(
+            digest=filehash.hexdigest(), defaults={'size': size, 'chunks': ' '.join(digests)})
+        return blob
+
+    def iter_chunks(self, digest):
+        """
+        :return: generator of the uncompressed chunks of a blob, each chunk is only read when it is reached
+        """
+        blob = self.blobmodel.objects.get(digest=digest)
+        for chunkdigest in blob.chunks.split():
+            codec, data = self.chunkmodel.objects.filter(digest=chunkdigest).values_list('codec', 'data').get()
+            yield CODECS[codec][1](bytes(data))
+
+    def open(self, digest):
+        """
+        :return: binary file object decompressing the blob while it is read
+        """
+        return io.BufferedReader(ChunkStream(self.iter_chunks(digest)))
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Read only raw stream over an iterator of bytes objects
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buf), len(self.pending))
+        buf[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
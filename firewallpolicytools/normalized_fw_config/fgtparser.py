@@ -0,0 +1,174 @@
+"""
+Streaming parser for FortiGate configuration files.
+
+tokenize() reads a configuration from an open file handle one line at a time and yields (path, action, key, value)
+events. ConfigTreeBuilder consumes those events and builds the nested configdict used by the populate_* functions,
+keeping a pointer to the current node so every line is handled in constant time.
+"""
+
+import re
+
+# Bump this whenever the shape of the tree produced by parse_config() changes
+PARSER_VERSION = 1
+
+# A quoted string (with backslash escapes) or a run of non-blank characters
+TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+# Matches only lines where every opening quote has a closing quote
+BALANCED_RE = re.compile(r'^(?:[^"\\]|\\.|"(?:[^"\\]|\\.)*")*$', re.DOTALL)
+ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+def split_tokens(line):
+    """
+    Split a configuration line into tokens, honouring double quoted strings and backslash escapes.
+
+    :param line: a single (possibly multi-line, for long quoted values) configuration statement
+    :return: list of unquoted tokens
+    """
+    if '"' not in line and '\\' not in line:
+        return line.split()
+    tokens = []
+    for quoted, bare in TOKEN_RE.findall(line):
+        if bare:
+            tokens.append(bare)
+        else:
+            tokens.append(ESCAPE_RE.sub(r'\1', quoted))
+    return tokens
+
+
+def value_list(value):
+    """
+    Return a 'set' value as a list of tokens. Single token values are stored as plain strings in the config tree.
+    """
+    if isinstance(value, list):
+        return value
+    if value == '':
+        return []
+    return [value]
+
+
+def statements(fh):
+    """
+    Yield complete configuration statements from a file handle, joining lines of quoted values that span multiple
+    lines (certificates, replacement messages, etc.)
+    """
+    pending = None
+    for line in fh:
+        line = line.rstrip('\r\n')
+        if pending is not None:
+            line = pending + '\n' + line
+            pending = None
+        if '"' in line:
+            if '\\' in line:
+                balanced = BALANCED_RE.match(line) is not None
+            else:
+                balanced = line.count('"') % 2 == 0
+            if not balanced:
+                pending = line
+                continue
+        yield line
+    if pending is not None:
+        yield pending
+
+
+def tokenize(fh):
+    """
+    Generate (path, action, key, value) events from a FortiGate configuration.
+
+    path is a tuple of the 'config' headers and 'edit' names enclosing the statement, action is one of 'config',
+    'edit', 'set', 'unset', 'next' or 'end'. For 'config' and 'edit' the key is the header or section name, for
+    'set' and 'unset' it is the attribute name. value is only used by 'set': a string for single token values and a
+    list of strings when several tokens are given.
+
+    :param fh: iterable of configuration lines (usually an open file)
+    """
+    path = ()
+    # Depth of nested 'config vdom' statements inside a vdom which are not added to the tree
+    ignored = 0
+    for line in statements(fh):
+        stripped = line.lstrip()
+        if not stripped or stripped[0] == '#':
+            continue
+        arguments = split_tokens(stripped)
+        if not arguments:
+            continue
+        action = arguments[0]
+        if action == 'config':
+            header = ' '.join(arguments[1:])
+            if header == 'vdom' and 'vdom' in path:
+                ignored += 1
+                continue
+            yield path, action, header, None
+            path = path + (header,)
+        elif action == 'edit':
+            section = ' '.join(arguments[1:])
+            yield path, action, section, None
+            path = path + (section,)
+        elif action == 'set':
+            if len(arguments) < 2:
+                continue
+            if len(arguments) == 3:
+                value = arguments[2]
+            elif len(arguments) == 2:
+                value = ''
+            else:
+                value = arguments[2:]
+            yield path, action, arguments[1], value
+        elif action == 'unset':
+            if len(arguments) > 1:
+                yield path, action, arguments[1], None
+        elif action == 'end' or action == 'next':
+            if action == 'end' and ignored:
+                ignored -= 1
+                continue
+            if path:
+                yield path, action, None, None
+                path = path[:-1]
+
+
+class ConfigTreeBuilder(object):
+    """
+    Builds the nested configuration dict from tokenize() events
+    """
+    def __init__(self):
+        self.root = {}
+        self.stack = [self.root]
+
+    def feed(self, event):
+        path, action, key, value = event
+        node = self.stack[-1]
+        if action == 'config' or action == 'edit':
+            child = node.get(key)
+            if not isinstance(child, dict):
+                child = node[key] = {}
+            self.stack.append(child)
+        elif action == 'set':
+            node[key] = value
+        elif action == 'end' or action == 'next':
+            if len(self.stack) > 1:
+                self.stack.pop()
+
+
+def parse_config(fh):
+    """
+    Parse a FortiGate configuration into a nested dict
+
+    :param fh: open file handle (or any iterable of lines)
+    :return: configdict
+    """
+    builder = ConfigTreeBuilder()
+    feed = builder.feed
+    for event in tokenize(fh):
+        feed(event)
+    return builder.root
+
+
+def find_hostname(configdict):
+    """
+    Return the hostname from 'config system global', which lives under 'config global' on multi-VDOM devices
+    """
+    for scope in (configdict.get('global', {}), configdict):
+        systemglobal = scope.get('system global')
+        if isinstance(systemglobal, dict) and 'hostname' in systemglobal:
+            return systemglobal['hostname']
+    return None
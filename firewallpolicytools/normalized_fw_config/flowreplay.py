@@ -0,0 +1,391 @@
+"""
+Replay of flow records against the compiled policies of a device with NumPy.
+
+FlowReader reads flow files in blocks of whole lines: CSV files with a header naming the columns, or FortiGate traffic
+logs with key=value fields. A CSV block of IPv4 addresses and numeric protocols and ports is converted at once, its
+separators are replaced with spaces and numpy.fromstring() parses all numbers of the block. Other blocks, with protocol
+or interface names, IPv6 addresses or syslog lines, are parsed line by line.
+
+FlowReplay looks up the segment of every flow in the source, destination and service partitions of a PolicyMatcher
+with numpy.searchsorted() and combines the segments and the interface codes into one integer key per flow. All flows
+with the same key match the same policies, so the first matching policy is only computed, from the bitsets of the
+matcher, once for every distinct key. The results are kept across chunks in sorted arrays and found with
+searchsorted(), so a chunk of flows which were seen before costs a few array operations only.
+
+NumPy is an optional dependency, creating a FlowReplay without it raises ImportError.
+"""
+
+import re
+import warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from normalized_fw_config.addressarrays import require_numpy
+from normalized_fw_config.anomalies import ANY, PORTS
+from normalized_fw_config.intervals import MAX_ADDRESS
+from normalized_fw_config.policymatch import address_value, protocol_number
+from normalized_fw_config.routing import parse_ip
+
+COLUMNS = {
+    'src': 'source', 'srcip': 'source', 'source': 'source',
+    'dst': 'destination', 'dstip': 'destination', 'destination': 'destination',
+    'proto': 'protocol', 'protocol': 'protocol',
+    'dport': 'port', 'dstport': 'port', 'port': 'port',
+    'srcintf': 'srczone', 'dstintf': 'dstzone',
+}
+REQUIRED_COLUMNS = ('source', 'destination', 'protocol')
+# Columns of the CSV files the fast path parses, with the count of numbers in each
+NUMERIC_COLUMNS = {'source': 4, 'destination': 4, 'protocol': 1, 'port': 1}
+SYSLOG_FIELD_RE = re.compile(r'(\w+)=(?:"([^"]*)"|(\S+))')
+SEPARATORS = bytes.maketrans(b'.,', b'  ')
+MAX_KEY = 1 << 63
+CHUNK_BYTES = 32 << 20
+
+
+class FlowChunk(object):
+    def __init__(self, source, destination, service, srczone=None, dstzone=None, others=(), invalid=0):
+        """
+        :param source: array of the IPv4 source addresses
+        :param destination: array of the IPv4 destination addresses
+        :param service: array of protocol * 65536 + port
+        :param srczone: list of the ingress interface names, or None when the flows have none
+        :param dstzone: list of the egress interface names, or None
+        :param others: (source, destination, protocol, port, srczone, dstzone) of the IPv6 flows
+        :param invalid: number of lines which could not be parsed
+        """
+        self.source = source
+        self.destination = destination
+        self.service = service
+        self.srczone = srczone
+        self.dstzone = dstzone
+        self.others = list(others)
+        self.invalid = invalid
+
+
+class FlowReader(object):
+    def __init__(self, fh, chunk_bytes=CHUNK_BYTES):
+        """
+        :param fh: binary file object. A CSV file starts with a header line naming its columns (src or srcip, dst or
+                   dstip, proto, dport, and optionally srcintf and dstintf), other files are read as FortiGate traffic
+                   logs.
+        :param chunk_bytes: size of the blocks read at once, chunks end at the last line break of a block
+        """
+        self.fh = fh
+        self.chunk_bytes = chunk_bytes
+        first = fh.readline()
+        if b'=' in first:
+            self.columns = None
+            self.pending = first
+        else:
+            self.columns = [COLUMNS.get(c.strip().lower()) for c in first.decode('utf-8', 'replace').split(',')]
+            missing = [c for c in REQUIRED_COLUMNS if c not in self.columns]
+            if missing:
+                raise ValueError("Flow file without %s column" % ', '.join(missing))
+            self.pending = b''
+        self.fast = self.columns is not None and all(c in NUMERIC_COLUMNS for c in self.columns)
+
+    def blocks(self):
+        """
+        :return: iterator over blocks of whole lines
+        """
+        while True:
+            block = self.fh.read(self.chunk_bytes)
+            if not block:
+                if self.pending.strip():
+                    yield self.pending + b'\n'
+                return
+            data = self.pending + block
+            end = data.rfind(b'\n') + 1
+            self.pending = data[end:]
+            if end:
+                yield data[:end]
+
+    def chunks(self):
+        """
+        :return: iterator over the FlowChunks of the file
+        """
+        for data in self.blocks():
+            chunk = self.parse_numeric(data) if self.fast else None
+            if chunk is None:
+                # Once a block needed the line parser the following ones are likely to need it as well
+                self.fast = False
+                chunk = self.parse_lines(data.splitlines())
+            yield chunk
+
+    def parse_numeric(self, data):
+        """
+        :return: FlowChunk, or None when the lines hold anything but IPv4 addresses and numbers
+        """
+        lines = data.count(b'\n')
+        with warnings.catch_warnings():
+            # Older NumPy versions warn about text which is not numbers and return the numbers before it
+            warnings.simplefilter('ignore', DeprecationWarning)
+            try:
+                numbers = numpy.fromstring(data.translate(SEPARATORS), dtype=numpy.int32, sep=' ')
+            except ValueError:
+                return None
+        width = sum(NUMERIC_COLUMNS[c] for c in self.columns)
+        if len(numbers) != lines * width:
+            return None
+        rows = numbers.reshape(lines, width)
+        if not lines:
+            return FlowChunk(*(numpy.zeros(0, dtype=numpy.int64),) * 3)
+        top = rows.max(axis=0)
+        if rows.min() < 0:
+            return None
+        values = {}
+        position = 0
+        for column in self.columns:
+            count = NUMERIC_COLUMNS[column]
+            if top[position:position + count].max() >= (PORTS if column == 'port' else 256):
+                return None
+            values[column] = rows[:, position:position + count]
+            position += count
+        service = values['protocol'][:, 0] * numpy.int64(PORTS)
+        if 'port' in values:
+            service += values['port'][:, 0]
+        return FlowChunk(ipv4_values(values['source']), ipv4_values(values['destination']), service)
+
+    def fields(self, line):
+        """
+        :return: {flow field: value} of one line
+        """
+        if self.columns is None:
+            fields = {}
+            for key, quoted, value in SYSLOG_FIELD_RE.findall(line):
+                if key in COLUMNS:
+                    fields[COLUMNS[key]] = value or quoted
+            return fields
+        return dict((column, value.strip()) for column, value in zip(self.columns, line.split(',')) if column)
+
+    def parse_lines(self, lines):
+        source = []
+        destination = []
+        service = []
+        zones = ([], [])
+        others = []
+        invalid = 0
+        for line in lines:
+            line = line.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            fields = self.fields(line)
+            try:
+                flow = (fields['source'], fields['destination'], protocol_number(fields['protocol']),
+                        int(fields.get('port') or 0), fields.get('srczone') or None, fields.get('dstzone') or None)
+                if not 0 <= flow[3] < PORTS:
+                    raise ValueError("Invalid port: %s" % flow[3])
+                if ':' in flow[0] or ':' in flow[1]:
+                    address_value(flow[0]), address_value(flow[1])
+                    others.append(flow)
+                    continue
+                addresses = parse_ip(flow[0]), parse_ip(flow[1])
+            except (KeyError, ValueError):
+                invalid += 1
+                continue
+            source.append(addresses[0])
+            destination.append(addresses[1])
+            service.append(flow[2] * PORTS + flow[3])
+            zones[0].append(flow[4])
+            zones[1].append(flow[5])
+        havezones = any(zones[0]) or any(zones[1])
+        return FlowChunk(numpy.array(source, dtype=numpy.int64), numpy.array(destination, dtype=numpy.int64),
+                         numpy.array(service, dtype=numpy.int64), zones[0] if havezones else None,
+                         zones[1] if havezones else None, others, invalid)
+
+
+class FlowReplay(object):
+    def __init__(self, matcher, samples=20):
+        """
+        :param matcher: PolicyMatcher of the device
+        :param samples: number of unmatched flows to keep as examples
+        """
+        require_numpy()
+        self.matcher = matcher
+        self.samples = samples
+        # Flow keys combine the segments in this order, the mask of the interfaces and services is shared by many
+        # keys and computed once for all of them
+        self.dimensions = ('services', 'source', 'destination')
+        # IPv4 addresses lie below all boundaries of IPv6 and FQDN intervals, so the segment index in the IPv4
+        # boundaries is the one in all boundaries
+        self.boundaries = [numpy.array([b for b in matcher.partitions[d].boundaries if b <= MAX_ADDRESS + 1],
+                                       dtype=numpy.int64) for d in self.dimensions]
+        # Segments of the first and the last address of every /16, most addresses are in a /16 within one segment
+        prefixes = numpy.arange(1 << 16, dtype=numpy.int64) << 16
+        self.prefix_segments = [None] + [(numpy.searchsorted(b, prefixes, side='right') - 1,
+                                          numpy.searchsorted(b, prefixes + 0xffff, side='right') - 1)
+                                         for b in self.boundaries[1:]]
+        # Interface codes: 0 for flows without interface, then the names in the order they are met
+        self.zone_names = [None]
+        self.zone_codes = {None: 0}
+        self.zone_radix = len(matcher.zone_values) + 16
+        self.radices = [self.zone_radix, self.zone_radix] + [len(b) for b in self.boundaries]
+        size = 1
+        for radix in self.radices:
+            size *= radix
+        if size >= MAX_KEY:
+            raise ValueError("The policies have too many distinct intervals for 64 bit flow keys")
+        # {(srczone code, dstzone code, services segment): bitset}
+        self.prefix_masks = {}
+        # Sorted keys seen so far and the index of their first matching policy, len(policies) when none matches
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.results = numpy.zeros(0, dtype=numpy.int64)
+        self.unmatched = len(matcher.policies)
+        self.hits = numpy.zeros(len(matcher.policies) + 1, dtype=numpy.int64)
+        self.flows = 0
+        self.invalid = 0
+        self.examples = []
+
+    def zone_code(self, name):
+        try:
+            return self.zone_codes[name]
+        except KeyError:
+            pass
+        if len(self.zone_names) >= self.zone_radix:
+            raise ValueError("More interface names in the flows than the device has")
+        code = self.zone_codes[name] = len(self.zone_names)
+        self.zone_names.append(name)
+        return code
+
+    def zone_mask(self, dimension, code):
+        name = self.zone_names[code]
+        try:
+            return self.matcher.zone_mask(dimension, name)
+        except ValueError:
+            # An interface the device does not know only matches policies for any interface
+            return self.matcher.partitions[dimension].mask(ANY[0][1])
+
+    def prefix_mask(self, prefix):
+        try:
+            return self.prefix_masks[prefix]
+        except KeyError:
+            mask = self.prefix_masks[prefix] = self.zone_mask('srczone', prefix[0]) & \
+                self.zone_mask('dstzone', prefix[1]) & self.matcher.partitions['services'].segment_mask(prefix[2])
+            return mask
+
+    def first_matches(self, keys):
+        """
+        :param keys: array of keys
+        :return: list of the index of the first policy matching the flows of every key
+        """
+        segments = []
+        for radix in reversed(self.radices):
+            segments.append((keys % radix).tolist())
+            keys = keys // radix
+        destinations, sources, services, dstzones, srczones = segments
+        source_mask = self.matcher.partitions['source'].segment_mask
+        destination_mask = self.matcher.partitions['destination'].segment_mask
+        prefix_masks = self.prefix_masks
+        results = []
+        for prefix, source, destination in zip(zip(srczones, dstzones, services), sources, destinations):
+            mask = prefix_masks.get(prefix)
+            if mask is None:
+                mask = self.prefix_mask(prefix)
+            if mask:
+                mask &= source_mask(source)
+                if mask:
+                    mask &= destination_mask(destination)
+            results.append((mask & -mask).bit_length() - 1 if mask else self.unmatched)
+        return results
+
+    def lookup(self, keys):
+        """
+        :param keys: sorted array of distinct keys
+        :return: array of the index of the first matching policy of every key
+        """
+        index = numpy.searchsorted(self.keys, keys)
+        found = index < len(self.keys)
+        found[found] = self.keys[index[found]] == keys[found]
+        if found.all():
+            return self.results[index]
+        results = numpy.empty(len(keys), dtype=numpy.int64)
+        results[found] = self.results[index[found]]
+        missing = keys[~found]
+        computed = numpy.array(self.first_matches(missing), dtype=numpy.int64)
+        results[~found] = computed
+        keys = numpy.concatenate((self.keys, missing))
+        order = numpy.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.results = numpy.concatenate((self.results, computed))[order]
+        return results
+
+    def segments(self, i, values):
+        """
+        :return: array of the segments of values in self.boundaries[i]
+        """
+        if self.prefix_segments[i] is None:
+            return numpy.searchsorted(self.boundaries[i], values, side='right') - 1
+        first, last = self.prefix_segments[i]
+        prefixes = values >> 16
+        segments = first[prefixes]
+        split = numpy.flatnonzero(segments != last[prefixes])
+        segments[split] = numpy.searchsorted(self.boundaries[i], values[split], side='right') - 1
+        return segments
+
+    def replay(self, chunk):
+        """
+        Count the hits of the flows of a FlowChunk
+        """
+        self.invalid += chunk.invalid
+        self.flows += len(chunk.source) + len(chunk.others)
+        keys = numpy.zeros(len(chunk.source), dtype=numpy.int64)
+        for names in (chunk.srczone, chunk.dstzone):
+            keys *= self.zone_radix
+            if names is not None:
+                keys += numpy.array([self.zone_code(name) for name in names], dtype=numpy.int64)
+        for i, values in enumerate((chunk.service, chunk.source, chunk.destination)):
+            keys *= len(self.boundaries[i])
+            keys += self.segments(i, values)
+        distinct, inverse = numpy.unique(keys, return_inverse=True)
+        results = self.lookup(distinct)[inverse]
+        self.hits += numpy.bincount(results, minlength=len(self.hits))
+
+        if len(self.examples) < self.samples:
+            for i in numpy.flatnonzero(results == self.unmatched)[:self.samples - len(self.examples)].tolist():
+                service = int(chunk.service[i])
+                self.examples.append((str_ip(chunk.source[i]), str_ip(chunk.destination[i]), service // PORTS,
+                                      service % PORTS, chunk.srczone[i] if chunk.srczone else None,
+                                      chunk.dstzone[i] if chunk.dstzone else None))
+        for flow in chunk.others:
+            result = self.first_match(flow)
+            self.hits[result] += 1
+            if result == self.unmatched and len(self.examples) < self.samples:
+                self.examples.append(flow)
+
+    def first_match(self, flow):
+        """
+        :param flow: (source, destination, protocol, port, srczone, dstzone) of an IPv6 flow
+        :return: index of the first matching policy
+        """
+        partitions = self.matcher.partitions
+        mask = self.zone_mask('srczone', self.zone_code(flow[4])) & self.zone_mask('dstzone', self.zone_code(flow[5]))
+        mask &= partitions['source'].mask(address_value(flow[0]))
+        mask &= partitions['destination'].mask(address_value(flow[1]))
+        mask &= partitions['services'].mask(flow[2] * PORTS + flow[3])
+        return (mask & -mask).bit_length() - 1 if mask else self.unmatched
+
+    def policy_hits(self):
+        """
+        :return: list of (policy dict, hits) in sequence order
+        """
+        return list(zip(self.matcher.policies, self.hits[:-1].tolist()))
+
+
+def ipv4_values(octets):
+    """
+    :param octets: array of rows of the four octets of IPv4 addresses
+    :return: array of the addresses
+    """
+    values = octets[:, 0].astype(numpy.int64) << 24
+    values |= octets[:, 1] << 16
+    values |= octets[:, 2] << 8
+    values |= octets[:, 3]
+    return values
+
+
+def str_ip(value):
+    value = int(value)
+    return '%d.%d.%d.%d' % (value >> 24, value >> 16 & 255, value >> 8 & 255, value & 255)
@@ -0,0 +1,136 @@
+"""
+Content digests for incremental re-imports.
+
+Every object entry of the parsed configuration sections of a VDOM is hashed, and every section gets a digest over
+its object digests. The digests are stored on the device's current ConfigVersion, so a re-import only writes the
+objects which were added, modified or removed since the previous import.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+
+from normalized_fw_config.models import *
+
+# Sections in the order returned by ingest.vdom_sections(), with the model and lookup field of their entries
+DIGEST_SECTIONS = (
+    ('firewall address', AddressObject, 'name'),
+    ('firewall addrgrp', AddressGroup, 'name'),
+    ('firewall service custom', CompoundServiceObject, 'name'),
+    ('firewall service group', ServiceGroup, 'name'),
+    ('firewall zone', ZoneObject, 'name'),
+    ('system interface', Interface, 'name'),
+    ('firewall policy', Policy, 'policyid'),
+)
+
+
+def object_digest(*parts):
+    """
+    Digest of the canonical JSON form of a configuration entry
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:20]
+
+
+def compute_digests(vsys, sections):
+    """
+    :param sections: the sections of the VDOM as returned by ingest.vdom_sections()
+    :return: OrderedDict {section: {'digest': section digest, 'objects': {name: object digest}}}
+    """
+    digests = OrderedDict()
+    for (section, model, keyfield), entries in zip(DIGEST_SECTIONS, sections):
+        objects = OrderedDict()
+        for position, (name, obj) in enumerate(entries.items()):
+            if section == 'system interface':
+                # Interfaces are global, only the ones assigned to this VDOM are imported for it
+                if obj.get('vdom') != vsys:
+                    continue
+                objects[name] = object_digest(obj)
+            elif section == 'firewall policy':
+                # The position of a policy is imported as its sequence
+                objects[name] = object_digest(position, obj)
+            else:
+                objects[name] = object_digest(obj)
+        digests[section] = {'digest': object_digest(list(objects.items())), 'objects': objects}
+    return digests
+
+
+def config_digest(digests):
+    return hashlib.sha256(json.dumps([d['digest'] for d in digests.values()]).encode('utf-8')).hexdigest()
+
+
+class SectionChanges(object):
+    def __init__(self, added=(), modified=(), removed=()):
+        self.added = set(added)
+        self.modified = set(modified)
+        self.removed = set(removed)
+
+    @property
+    def changed(self):
+        return self.added | self.modified
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed)
+
+
+def diff_digests(old, new):
+    """
+    Compare the digests of the previous and the current import
+
+    :return: {section: SectionChanges}
+    """
+    changes = OrderedDict()
+    for section, current in new.items():
+        previous = old.get(section)
+        if previous is None:
+            changes[section] = SectionChanges(added=current['objects'])
+            continue
+        if previous['digest'] == current['digest']:
+            changes[section] = SectionChanges()
+            continue
+        oldobjects = previous['objects']
+        newobjects = current['objects']
+        changes[section] = SectionChanges(
+            added=[n for n in newobjects if n not in oldobjects],
+            modified=[n for n, d in newobjects.items() if n in oldobjects and oldobjects[n] != d],
+            removed=[n for n in oldobjects if n not in newobjects])
+    return changes
+
+
+def filter_staged(staged, changes):
+    """
+    Reduce a StagedVDOM to the added and modified objects
+    """
+    def keep(records, names):
+        return OrderedDict((n, records[n]) for n in records if n in names)
+
+    staged.addresses = keep(staged.addresses, changes['firewall address'].changed)
+    staged.addrgroups = keep(staged.addrgroups, changes['firewall addrgrp'].changed)
+    staged.compoundservices = keep(staged.compoundservices, changes['firewall service custom'].changed)
+    members = set()
+    for names in staged.compoundservices.values():
+        members.update(names)
+    staged.services = keep(staged.services, members)
+    staged.servicegroups = keep(staged.servicegroups, changes['firewall service group'].changed)
+    staged.interfaces = [n for n in staged.interfaces if n in changes['system interface'].changed]
+    policyids = set(int(n) for n in changes['firewall policy'].changed)
+    staged.policies = [p for p in staged.policies if p['policyid'] in policyids]
+    return staged
+
+
+def delete_removed(device, changes):
+    """
+    Delete the objects which are no longer part of the configuration
+
+    :return: number of deleted objects
+    """
+    deleted = 0
+    for section, model, keyfield in DIGEST_SECTIONS:
+        removed = list(changes[section].removed)
+        if keyfield == 'policyid':
+            removed = [int(n) for n in removed]
+        for i in range(0, len(removed), 500):
+            qs = model.objects.filter(device=device, **{keyfield + '__in': removed[i:i + 500]})
+            deleted += qs.count()
+            qs.delete()
+    return deleted
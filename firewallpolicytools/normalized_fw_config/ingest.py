@@ -0,0 +1,582 @@
+"""
+Bulk ingest of normalized FortiGate objects.
+
+stage_vdom() turns the parsed configuration of one VDOM into plain records without touching the database. BulkIngest
+then writes those records for a Device with a number of queries that does not depend on the number of objects:
+existing rows are preloaded into {name: pk} maps, new rows are inserted with bulk_create, changed rows are updated in
+batches and many-to-many through rows are inserted in bulk.
+"""
+
+import ipaddress
+import multiprocessing
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Case, When, Value
+
+from normalized_fw_config.models import *
+from normalized_fw_config.fgtparser import value_list
+from normalized_fw_config.resolver import ObjectResolver
+
+BATCH_SIZE = 500
+# Stay below the default SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds
+MAX_QUERY_PARAMS = 999
+
+# Pragmas for the importing connection. WAL lets other connections (the admin) keep reading the last committed state
+# of the database file while an import transaction is open, and with WAL synchronous=NORMAL only syncs at
+# checkpoints while still never corrupting the database.
+IMPORT_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+)
+
+
+def chunks(seq, size=BATCH_SIZE):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def set_import_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver applying IMPORT_PRAGMAS to SQLite connections. SQLite refuses to change the
+    journal mode and safety level inside a transaction, connections already in one are left untouched.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        return
+    cursor = connection.cursor()
+    for pragma in IMPORT_PRAGMAS:
+        cursor.execute(pragma)
+
+
+def enable_import_pragmas():
+    """
+    Tune SQLite for bulk imports on this connection and on every connection opened afterwards by this process
+    """
+    connection_created.connect(set_import_pragmas, dispatch_uid='normalized_fw_config.import_pragmas')
+    for connection in connections.all():
+        if connection.connection is not None:
+            set_import_pragmas(connection.__class__, connection)
+
+
+def vdom_sections(vdomconfig, interfacedict):
+    """
+    Return the parsed sections of a VDOM in the argument order of init_discovery() and stage_vdom()
+
+    :param vdomconfig: configdict['vdom'][vdom], or the whole configdict for devices without VDOMs
+    :param interfacedict: the 'system interface' section, which is global on devices with VDOMs
+    """
+    return (vdomconfig.get('firewall address', {}),
+            vdomconfig.get('firewall addrgrp', {}),
+            vdomconfig.get('firewall service custom', {}),
+            vdomconfig.get('firewall service group', {}),
+            vdomconfig.get('firewall zone', {}),
+            interfacedict,
+            vdomconfig.get('firewall policy', {}))
+
+
+def normalize_addressobj(objname, obj):
+    """
+    Return the AddressObject fields for a 'firewall address' entry, or None when the object type is not supported
+    (and the object is therefore not saved)
+    """
+    fields = {}
+    if 'type' in obj:
+        if obj['type'] == 'fqdn':
+            fields['type'] = 'fqdn'
+            fields['fqdn'] = obj['fqdn']
+        if obj['type'] == 'iprange':
+            fields['type'] = 'range4'
+            fields['start_ip'] = obj['start-ip']
+            fields['end_ip'] = obj['end-ip']
+    elif 'subnet' in obj:
+        fields['start_ip'], netmask = value_list(obj['subnet'])
+        prefixlen = ipaddress.IPv4Network('0.0.0.0/%s' % netmask).prefixlen
+        if prefixlen == 32:
+            fields['type'] = 'ip4'
+        else:
+            fields['type'] = 'net4'
+            fields['prefixlen'] = prefixlen
+    if 'description' in obj:
+        fields['description'] = obj['description']
+    # Handle the special case "all" object
+    if objname == 'all':
+        fields['type'] = 'net4'
+        fields['start_ip'] = '0.0.0.0'
+        fields['prefixlen'] = 0
+    elif not (fields.get('start_ip') or fields.get('fqdn')):
+        return None
+    return fields
+
+
+def parse_portrange(key, portrange):
+    """
+    Convert one FortiGate port range 'dstlow[-dsthigh][:srclow[-srchigh]]' from a tcp-portrange or udp-portrange
+    setting to a ServiceObject name and its fields.
+
+    Format of objects created for compound service groups is proto-dstportlow<-dstporthigh-src-portlow-srcporthigh>
+    """
+    dstlow = None
+    dsthigh = None
+    srclow = None
+    srchigh = None
+    if ':' in portrange:
+        dstrange, srcrange = portrange.split(':')
+        if '-' in dstrange:
+            dstlow, dsthigh = [int(p) for p in dstrange.split('-')]
+        else:
+            dstlow = int(dstrange)
+        if '-' in srcrange:
+            srclow, srchigh = [int(p) for p in srcrange.split('-')]
+        else:
+            srclow = int(srcrange)
+    elif '-' in portrange:
+        dstlow, dsthigh = [int(p) for p in portrange.split('-')]
+    else:
+        dstlow = int(portrange)
+    portrangename = key[0:3] + '-' + str(dstlow)
+    if dsthigh:
+        portrangename += '-' + str(dsthigh)
+    if srclow:
+        portrangename += ':' + str(srclow)
+    if srchigh:
+        portrangename += '-' + str(srchigh)
+    fields = {
+        'protocol': 6 if key[0:3] == 'tcp' else 17,
+        'start_port': dstlow,
+        'end_port': dsthigh,
+        'src_start_port': srclow,
+        'src_end_port': srchigh,
+    }
+    return portrangename, fields
+
+
+def decompose_service(obj):
+    """
+    Split a 'firewall service custom' entry into its member ServiceObjects.
+
+    By default FortiGate Service Objects are UDP+TCP+SCTP with multiple port-ranges per protocol included, so every
+    port range becomes its own ServiceObject and the custom service becomes a CompoundServiceObject.
+
+    :return: list of (name, fields) tuples
+    """
+    members = []
+    for k in obj:
+        if k == 'tcp-portrange' or k == 'udp-portrange':
+            for portrange in value_list(obj[k]):
+                members.append(parse_portrange(k, portrange))
+        elif k == 'protocol' and obj[k] == 'ICMP':
+            if 'unset' in obj and obj['unset'] == "icmptype":
+                members.append(("icmp", {'start_port': 0, 'end_port': 255}))
+            elif 'icmptype' in obj:
+                members.append(("icmp-" + obj['icmptype'], {'start_port': int(obj['icmptype'])}))
+        elif k == 'protocol' and obj[k] == 'IP':
+            if 'protocol-number' in obj:
+                members.append(("ip-proto-" + obj['protocol-number'], {'protocol': int(obj['protocol-number'])}))
+    return members
+
+
+def policy_action(obj):
+    # FG policies write 'permit' as 'accept'
+    if obj.get('action') == 'accept':
+        return 'permit'
+    return 'deny'
+
+
+class StagedVDOM(object):
+    """
+    Plain python records for all objects of one VDOM, ready to be written by BulkIngest
+    """
+    def __init__(self, vsys):
+        self.vsys = vsys
+        # name: fields (None when only the row itself is created)
+        self.addresses = OrderedDict()
+        # name: [member names]
+        self.addrgroups = OrderedDict()
+        self.services = OrderedDict()
+        self.compoundservices = OrderedDict()
+        self.servicegroups = OrderedDict()
+        self.interfaces = []
+        # One dict per policy with the policyid, sequence, action and the member names of every policy field
+        self.policies = []
+
+
+POLICY_FIELDS = ('srcaddr', 'dstaddr', 'srcintf', 'dstintf', 'service')
+
+
+def stage_vdom(vsys, addressobjdict, addrgrpdict, serviceobjdict, servicegroupdict, zoneobjdict, interfacedict,
+               policydict):
+    """
+    Normalize the parsed configuration sections of one VDOM into a StagedVDOM without any database access
+    """
+    staged = StagedVDOM(vsys)
+    for objname, obj in addressobjdict.items():
+        staged.addresses[objname] = normalize_addressobj(objname, obj)
+    for objname, obj in addrgrpdict.items():
+        staged.addrgroups[objname] = value_list(obj['member'])
+    for objname, obj in serviceobjdict.items():
+        members = decompose_service(obj)
+        for name, fields in members:
+            staged.services.setdefault(name, {}).update(fields)
+        staged.compoundservices[objname] = [name for name, fields in members]
+    for objname, obj in servicegroupdict.items():
+        staged.servicegroups[objname] = value_list(obj['member'])
+    for objname, obj in interfacedict.items():
+        if obj.get('vdom') == vsys:
+            staged.interfaces.append(objname)
+    sequence = 0
+    for objid, obj in policydict.items():
+        sequence += 1
+        policy = {'policyid': int(objid), 'sequence': sequence, 'action': policy_action(obj)}
+        for key in POLICY_FIELDS:
+            if key in obj:
+                policy[key] = value_list(obj[key])
+        staged.policies.append(policy)
+    return staged
+
+
+def staged_resolver(staged):
+    """
+    Return an ObjectResolver over the names of a StagedVDOM which resolves without any database access
+    """
+    resolver = ObjectResolver(None)
+    for model, names in ((AddressObject, staged.addresses), (AddressGroup, staged.addrgroups),
+                         (ServiceObject, staged.services), (CompoundServiceObject, staged.compoundservices),
+                         (ServiceGroup, staged.servicegroups), (Interface, staged.interfaces), (ZoneObject, ())):
+        resolver.update(model, dict((name, name) for name in names))
+    return resolver
+
+
+def validate_staged(staged):
+    """
+    Check the references of a StagedVDOM in memory
+
+    :return: (missing group members as (group, member) tuples, resolver holding the unresolved policy members)
+    """
+    resolver = staged_resolver(staged)
+    missing = []
+    for groups, model in ((staged.addrgroups, AddressObject), (staged.servicegroups, CompoundServiceObject)):
+        for group, members in groups.items():
+            missing.extend((group, m) for m in members if resolver.resolve(m, (model,))[0] is None)
+    for policy in staged.policies:
+        for key, models in (('srcaddr', (AddressObject, AddressGroup)), ('dstaddr', (AddressObject, AddressGroup)),
+                            ('srcintf', (Interface, ZoneObject)), ('dstintf', (Interface, ZoneObject)),
+                            ('service', (CompoundServiceObject, ServiceGroup))):
+            if key in policy:
+                resolver.resolve_all(policy[key], models, 'policy %d %s' % (policy['policyid'], key))
+    return missing, resolver
+
+
+def staged_summary(staged):
+    """
+    :return: list of (model name, number of records) which an import of the StagedVDOM writes
+    """
+    memberships = sum(len(m) for groups in (staged.addrgroups, staged.compoundservices, staged.servicegroups)
+                      for m in groups.values())
+    return [('AddressObject', len(staged.addresses)),
+            ('AddressGroup', len(staged.addrgroups)),
+            ('ServiceObject', len(staged.services)),
+            ('CompoundServiceObject', len(staged.compoundservices)),
+            ('ServiceGroup', len(staged.servicegroups)),
+            ('Interface', len(staged.interfaces)),
+            ('Policy', len(staged.policies)),
+            ('group members', memberships)]
+
+
+# Sections of the VDOMs being staged, inherited by forked worker processes so they are not pickled for every task
+_FORKED_SECTIONS = {}
+
+
+def _stage_vdom_worker(vsys, sections):
+    if sections is None:
+        sections = _FORKED_SECTIONS[vsys]
+    start = time.time()
+    staged = stage_vdom(vsys, *sections)
+    return staged, time.time() - start
+
+
+def stage_vdoms(vdomsections, workers):
+    """
+    Stage several VDOMs in a pool of worker processes. Staging does not use the database, the StagedVDOMs are handed
+    back to the calling process which remains the only writer.
+
+    :param vdomsections: list of (vsys, sections) tuples, sections as returned by vdom_sections()
+    :return: generator of (vsys, future) tuples in completion order, the future's result is (StagedVDOM, seconds)
+    """
+    global _FORKED_SECTIONS
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        initializer = None
+        _FORKED_SECTIONS = dict(vdomsections)
+    else:
+        context = None
+        initializer = django.setup
+    # Forked workers must not share the open database connection
+    connections.close_all()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer) as pool:
+            futures = {}
+            for vsys, sections in vdomsections:
+                futures[pool.submit(_stage_vdom_worker, vsys, None if _FORKED_SECTIONS else sections)] = vsys
+            for future in as_completed(futures):
+                yield futures[future], future
+    finally:
+        _FORKED_SECTIONS = {}
+
+
+def bulk_update(model, rows, fields):
+    """
+    Update several rows of a model with one UPDATE ... CASE statement per batch
+
+    :param rows: list of (pk, {field: value}) tuples, all having the same fields
+    """
+    if not rows or not fields:
+        return
+    batchsize = max(1, MAX_QUERY_PARAMS // (2 * len(fields) + 1))
+    for batch in chunks(rows, batchsize):
+        updates = {}
+        for fieldname in fields:
+            field = model._meta.get_field(fieldname)
+            whens = [When(pk=pk, then=Value(values[fieldname])) for pk, values in batch]
+            updates[fieldname] = Case(*whens, output_field=field)
+        model.objects.filter(pk__in=[pk for pk, values in batch]).update(**updates)
+
+
+class PolicySetIndex(object):
+    """
+    Resolves PolicyAddrSet / PolicyZoneSet / PolicyServiceSet members to the pk of the set with exactly these
+    members, looked up by fingerprint. Sets which do not exist yet are created by resolve(), their members by
+    flush().
+    """
+    def __init__(self, ingest, model):
+        self.ingest = ingest
+        self.model = model
+        self.relations = model.FINGERPRINT_RELATIONS
+        # fingerprint: one frozenset of member pks per relation
+        self.members = OrderedDict()
+        self.pks = {}
+        self.new = []
+
+    def add(self, members):
+        """
+        :param members: one iterable of member pks per relation, in the order of the model's FINGERPRINT_RELATIONS
+        :return: the fingerprint of the set, or None for an empty set
+        """
+        members = tuple(frozenset(m) for m in members)
+        if not any(members):
+            return None
+        fingerprint = set_fingerprint(members)
+        self.members.setdefault(fingerprint, members)
+        return fingerprint
+
+    def resolve(self):
+        """
+        Look up the pks of all added sets, creating the ones which are new
+        """
+        unknown = [fp for fp in self.members if fp not in self.pks]
+        self.lookup(unknown)
+        missing = [fp for fp in unknown if fp not in self.pks]
+        if missing:
+            # The database assigns the pks, the new sets are read back by their unique fingerprints
+            self.ingest.create(self.model, [self.model(fingerprint=fp) for fp in missing])
+            self.lookup(missing)
+            self.new.extend(missing)
+
+    def lookup(self, fingerprints):
+        for batch in chunks(fingerprints, MAX_QUERY_PARAMS):
+            self.pks.update(self.model.objects.filter(fingerprint__in=batch).values_list('fingerprint', 'pk'))
+
+    def flush(self):
+        for i, relation in enumerate(self.relations):
+            field = self.model._meta.get_field(relation)
+            through, src, tgt = field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+            rows = []
+            for fingerprint in self.new:
+                for memberid in self.members[fingerprint][i]:
+                    rows.append(through(**{src + '_id': self.pks[fingerprint], tgt + '_id': memberid}))
+            self.ingest.create(through, rows)
+        self.new = []
+
+
+class BulkIngest(object):
+    """
+    Writes a StagedVDOM for a Device with bulk queries.
+
+    Matches the results of the populate_* functions: objects are looked up by (name, device), fields are only
+    overwritten when they are present in the configuration and group members are only ever added.
+
+    With a configversion every written object is added to that version's 'configs', and with replace the members of
+    the written groups are replaced instead of extended.
+    """
+    def __init__(self, device, configversion=None, replace=False):
+        self.device = device
+        self.configversion = configversion
+        self.replace = replace
+        self.stats = Counter()
+        # {name: pk} of the written objects, unresolved policy members are reported by self.resolver.report()
+        self.resolver = ObjectResolver(device, pks=True)
+
+    def create(self, model, objs):
+        if not objs:
+            return
+        self.stats[('created', model.__name__)] += len(objs)
+        model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+    def update(self, model, rows):
+        if not rows:
+            return
+        self.stats[('updated', model.__name__)] += len(rows)
+        byfields = OrderedDict()
+        for pk, values in rows:
+            byfields.setdefault(tuple(sorted(values)), []).append((pk, values))
+        for fields, batch in byfields.items():
+            bulk_update(model, batch, fields)
+
+    def sync_objects(self, model, records, keyfield='name'):
+        """
+        Create or update the rows of a device scoped model
+
+        :param records: {key: {field: value} or None}
+        :return: {key: pk}
+        """
+        fieldnames = set()
+        for fields in records.values():
+            if fields:
+                fieldnames.update(fields)
+        existing = {}
+        for row in model.objects.filter(device=self.device).values('pk', keyfield, *fieldnames):
+            existing[row[keyfield]] = row
+        newobjs = []
+        changed = []
+        for key, fields in records.items():
+            fields = fields or {}
+            if key in existing:
+                row = existing[key]
+                diff = dict((f, v) for f, v in fields.items() if row[f] != v)
+                if diff:
+                    changed.append((row['pk'], diff))
+            else:
+                newobjs.append(model(device=self.device, **dict(fields, **{keyfield: key})))
+        self.create(model, newobjs)
+        self.update(model, changed)
+        pks = dict((key, row['pk']) for key, row in existing.items())
+        if newobjs:
+            pks = dict(model.objects.filter(device=self.device).values_list(keyfield, 'pk'))
+        if self.configversion is not None:
+            field = model._meta.get_field('configs')
+            through, src, tgt = field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+            self.create(through, [through(**{src + '_id': pks[key], tgt + '_id': self.configversion.pk})
+                                  for key in records])
+        return pks
+
+    def sync_members(self, model, relation, ownerpks, memberpks, membership):
+        """
+        Add the missing many-to-many rows between group like objects and their members
+
+        :param membership: {owner name: [member names]}
+        """
+        field = model._meta.get_field(relation)
+        through, src, tgt = field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+        existing = {}
+        for rowpk, ownerpk, memberpk in through.objects.filter(**{src + '__device': self.device}).values_list(
+                'pk', src + '_id', tgt + '_id'):
+            existing[(ownerpk, memberpk)] = rowpk
+        wanted = set()
+        rows = []
+        for owner, members in membership.items():
+            ownerpk = ownerpks[owner]
+            for member in members:
+                if member not in memberpks:
+                    remote = field.remote_field.model
+                    raise remote.DoesNotExist("%s '%s' (member of '%s') does not exist on %s" % (
+                        remote.__name__, member, owner, self.device))
+                pair = (ownerpk, memberpks[member])
+                if pair not in existing and pair not in wanted:
+                    rows.append(through(**{src + '_id': pair[0], tgt + '_id': pair[1]}))
+                wanted.add(pair)
+        if self.replace:
+            owners = set(ownerpks[owner] for owner in membership)
+            stale = [rowpk for pair, rowpk in existing.items() if pair[0] in owners and pair not in wanted]
+            self.delete(through, stale)
+        self.create(through, rows)
+
+    def delete(self, model, pks):
+        if not pks:
+            return
+        self.stats[('deleted', model.__name__)] += len(pks)
+        for batch in chunks(pks, MAX_QUERY_PARAMS):
+            model.objects.filter(pk__in=batch).delete()
+
+    def resolve(self, names, models, context):
+        """
+        Resolve policy member names against the objects of several models in order
+
+        :return: one set of pks per model, unknown names are recorded by the resolver
+        """
+        return [set(pks) for pks in self.resolver.resolve_all(names, models, context).values()]
+
+    def sync_policies(self, policies):
+        addrsets = PolicySetIndex(self, PolicyAddrSet)
+        zonesets = PolicySetIndex(self, PolicyZoneSet)
+        servicesets = PolicySetIndex(self, PolicyServiceSet)
+        # Policy fields referencing a set hold (index, fingerprint) until the sets are resolved
+        records = OrderedDict()
+        for policy in policies:
+            fields = {'sequence': policy['sequence'], 'action': policy['action']}
+            context = 'policy %d %%s' % policy['policyid']
+            for key, fieldname in (('srcaddr', 'source_id'), ('dstaddr', 'destination_id')):
+                if key in policy:
+                    fields[fieldname] = (addrsets, addrsets.add(
+                        self.resolve(policy[key], (AddressObject, AddressGroup), context % key)))
+            for key, fieldname in (('srcintf', 'srczone_id'), ('dstintf', 'dstzone_id')):
+                if key in policy:
+                    # PolicyZoneSet relations are (zones, interfaces) while names resolve to interfaces first
+                    intfs, zones = self.resolve(policy[key], (Interface, ZoneObject), context % key)
+                    fields[fieldname] = (zonesets, zonesets.add((zones, intfs)))
+            if 'service' in policy:
+                compoundservices, servicegroups = self.resolve(
+                    policy['service'], (CompoundServiceObject, ServiceGroup), context % 'service')
+                fields['services_id'] = (servicesets, servicesets.add(((), compoundservices, servicegroups)))
+            records[policy['policyid']] = fields
+        for index in (addrsets, zonesets, servicesets):
+            index.resolve()
+            index.flush()
+        for fields in records.values():
+            for fieldname, value in list(fields.items()):
+                if isinstance(value, tuple):
+                    index, fingerprint = value
+                    if fingerprint is None:
+                        del fields[fieldname]
+                    else:
+                        fields[fieldname] = index.pks[fingerprint]
+        self.sync_objects(Policy, records, keyfield='policyid')
+
+    def apply(self, staged):
+        """
+        Write a StagedVDOM for the device
+        """
+        with transaction.atomic():
+            resolver = self.resolver
+            resolver.update(AddressObject, self.sync_objects(AddressObject, staged.addresses))
+            resolver.update(AddressGroup, self.sync_objects(
+                AddressGroup, OrderedDict((n, None) for n in staged.addrgroups)))
+            self.sync_members(AddressGroup, 'members', resolver.cache(AddressGroup), resolver.cache(AddressObject),
+                              staged.addrgroups)
+            services = self.sync_objects(ServiceObject, staged.services)
+            resolver.update(CompoundServiceObject, self.sync_objects(
+                CompoundServiceObject, OrderedDict((n, None) for n in staged.compoundservices)))
+            self.sync_members(CompoundServiceObject, 'members', resolver.cache(CompoundServiceObject), services,
+                              staged.compoundservices)
+            resolver.update(ServiceGroup, self.sync_objects(
+                ServiceGroup, OrderedDict((n, None) for n in staged.servicegroups)))
+            self.sync_members(ServiceGroup, 'members', resolver.cache(ServiceGroup),
+                              resolver.cache(CompoundServiceObject), staged.servicegroups)
+            resolver.update(Interface, self.sync_objects(Interface, OrderedDict((n, None) for n in staged.interfaces)))
+            self.sync_policies(staged.policies)
+        return self.stats
@@ -0,0 +1,168 @@
+"""
+Integer interval and prefix arithmetic for IPv4 address objects.
+
+Addresses are handled as integers and address objects as inclusive (start, end) intervals. cidr_blocks() splits an
+interval into the same maximal CIDR blocks as ipaddress.summarize_address_range(), PrefixSet answers whether a block
+lies within one of many networks with one hash lookup per distinct prefix length, and IntervalSet keeps the union of
+networks as sorted disjoint intervals for bisect lookups.
+"""
+
+import ipaddress
+from bisect import bisect_right
+
+ADDRESS_BITS = 32
+MAX_ADDRESS = (1 << ADDRESS_BITS) - 1
+
+
+def ip_to_int(ip):
+    return int(ipaddress.IPv4Address(ip))
+
+
+def network_interval(network):
+    """
+    :param network: IPv4Network or 'a.b.c.d/len' string
+    :return: (start, end)
+    """
+    network = ipaddress.IPv4Network(network)
+    start = int(network.network_address)
+    return start, start + network.num_addresses - 1
+
+
+def address_interval(address):
+    """
+    :param address: AddressObject field dict ('type', 'start_ip', 'end_ip', 'prefixlen')
+    :return: (start, end), or None for objects without addresses (FQDNs)
+    """
+    if not address.get('start_ip'):
+        return None
+    start = ip_to_int(address['start_ip'])
+    if address['type'] == 'net4':
+        size = 1 << (ADDRESS_BITS - address['prefixlen'])
+        start &= ~(size - 1)
+        return start, start + size - 1
+    if address['type'] == 'range4':
+        return start, ip_to_int(address['end_ip'])
+    return start, start
+
+
+def cidr_blocks(start, end):
+    """
+    Split an interval into maximal aligned blocks
+
+    :return: list of (network, prefixlen)
+    """
+    blocks = []
+    while start <= end:
+        # The largest block aligned at start which does not extend beyond end
+        size = start & -start if start else 1 << ADDRESS_BITS
+        while size > end - start + 1:
+            size >>= 1
+        blocks.append((start, ADDRESS_BITS - size.bit_length() + 1))
+        start += size
+    return blocks
+
+
+class PrefixSet(object):
+    """
+    Set of networks answering whether a CIDR block lies within any of them
+    """
+    def __init__(self, networks=()):
+        self.prefixes = set()
+        self.lengths = []
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        start, end = network_interval(network)
+        prefixlen = ADDRESS_BITS - (end - start + 1).bit_length() + 1
+        self.prefixes.add((start >> (ADDRESS_BITS - prefixlen), prefixlen))
+        if prefixlen not in self.lengths:
+            self.lengths = sorted(self.lengths + [prefixlen])
+
+    def contains_block(self, network, prefixlen):
+        """
+        :return: True if the block network/prefixlen is a subnet of (or equal to) one of the networks
+        """
+        for length in self.lengths:
+            if length > prefixlen:
+                break
+            if (network >> (ADDRESS_BITS - length), length) in self.prefixes:
+                return True
+        return False
+
+
+def merge_intervals(intervals):
+    """
+    :return: tuple of the sorted, disjoint and non adjacent (start, end) intervals covering the same integers
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+
+class IntervalSet(object):
+    """
+    Union of intervals as sorted, disjoint and non adjacent intervals
+    """
+    def __init__(self, intervals=()):
+        merged = merge_intervals(intervals)
+        self.starts = [start for start, end in merged]
+        self.ends = [end for start, end in merged]
+
+    def overlaps(self, start, end):
+        i = bisect_right(self.starts, end) - 1
+        return i >= 0 and self.ends[i] >= start
+
+
+def address_key(address):
+    """
+    :return: the fields an address object is classified by, objects with equal keys get the same class
+    """
+    return address['type'], address['start_ip'], address['end_ip'], address['prefixlen']
+
+
+INSIDE = 'inside'
+OUTSIDE = 'outside'
+PARTIAL = 'partial'
+
+
+class NetworkClassifier(object):
+    """
+    Classifies address objects against a set of networks (e.g. the monitored networks of the ASA export)
+
+    An object is split into its maximal CIDR blocks and a block counts as inside when it lies within one of the
+    networks. A block which merely contains one of the networks, like 0.0.0.0/0, does not. The object is INSIDE when
+    all its blocks are inside, PARTIAL when some are and OUTSIDE when none is. Results are cached per object.
+    """
+    def __init__(self, networks):
+        networks = list(networks)
+        self.prefixes = PrefixSet(networks)
+        self.union = IntervalSet(network_interval(n) for n in networks)
+        self.cache = {}
+
+    def classify_interval(self, start, end):
+        if not self.union.overlaps(start, end):
+            return OUTSIDE
+        inside = [self.prefixes.contains_block(network, prefixlen) for network, prefixlen in cidr_blocks(start, end)]
+        if all(inside):
+            return INSIDE
+        return PARTIAL if any(inside) else OUTSIDE
+
+    def classify(self, address):
+        """
+        :param address: AddressObject field dict
+        :return: INSIDE, OUTSIDE, PARTIAL, or None for objects without addresses (FQDNs)
+        """
+        key = address_key(address)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        interval = address_interval(address)
+        result = None if interval is None else self.classify_interval(*interval)
+        self.cache[key] = result
+        return result
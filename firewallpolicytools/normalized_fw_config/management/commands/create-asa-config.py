@@ -4,84 +4,202 @@ Author: Fahad Yousuf <fahadysf@gmail.com>
 This will create a Cisco ASA configuration from the normalized configuration of a device.
 """
 
+import contextlib
 import ipaddress
+import sys
+from collections import defaultdict
 from django.core.management.base import BaseCommand, CommandError
-from django.core import serializers
 import json
+import re
 
+from normalized_fw_config.aclcompact import ACLCompactor, expanded_count, network_members, service_members
+from normalized_fw_config.addressarrays import AddressArrays
+from normalized_fw_config.asawriter import ASAConfigWriter
+from normalized_fw_config.intervals import NetworkClassifier, OUTSIDE, address_key, ip_to_int, network_interval
 from normalized_fw_config.models import *
+from normalized_fw_config.policygraph import load_policies
+from normalized_fw_config.profiling import PhaseProfiler
+from normalized_fw_config.routing import RouteTable, read_routes
+
+MONITOR_NETS = ["10.21.32.0/19", "10.21.128.0/19", "10.21.160.0/20"]
+PROTOCOL_NAMES = {6: 'tcp', 17: 'udp'}
+
+
+def asa_object_name(addr):
+    """
+    Name of the ASA network object (or the host address) of an AddressObject field dict
+    """
+    if addr['type'] == 'net4':
+        return addr['start_ip'] + '_' + str(addr['prefixlen'])
+    elif addr['type'] == 'range4':
+        return addr['start_ip'] + '-' + addr['end_ip']
+    return addr['start_ip']
+
+
+def address_group_entries(names, addrs):
+    """
+    The members of a policy's address group
+
+    :param names: ASA object names of the addresses in the group
+    :param addrs: the policy's address dicts the names were made from
+    :return: list of (kind, name, address dict), kind being 'subnet', 'range' or 'host'
+    """
+    entries = []
+    for netstr in names:
+        for addr in addrs:
+            if addr['type'] == 'net4' and netstr.replace('_', '/') == addr['name']:
+                entries.append(('subnet', netstr, addr))
+            elif addr['type'] == 'range4' and netstr == addr['start_ip'] + '-' + addr['end_ip']:
+                entries.append(('range', netstr, addr))
+            elif netstr == addr['start_ip']:
+                entries.append(('host', netstr, addr))
+    return entries
+
+
+def address_group_members(names, addrs):
+    """
+    Member lines of a policy's address group
+
+    :return: (member lines, (name, kind, values) of the network objects they reference)
+    """
+    members = []
+    objects = []
+    for kind, netstr, addr in address_group_entries(names, addrs):
+        if kind == 'subnet':
+            net = ipaddress.IPv4Network(netstr.replace('_', '/'))
+            objects.append((netstr, 'subnet', (str(net.network_address), str(net.netmask))))
+            members.append("network-object object %s" % netstr)
+        elif kind == 'range':
+            objects.append((netstr, 'range', (addr['start_ip'], addr['end_ip'])))
+            members.append("network-object object %s" % netstr)
+        else:
+            members.append("network-object host %s" % netstr)
+    return members, objects
+
+
+def address_group_intervals(names, addrs):
+    """
+    :return: list of the distinct (start, end) address intervals of a policy's address group
+    """
+    intervals = set()
+    for kind, netstr, addr in address_group_entries(names, addrs):
+        if kind == 'subnet':
+            intervals.add(network_interval(netstr.replace('_', '/')))
+        elif kind == 'range':
+            intervals.add((ip_to_int(addr['start_ip']), ip_to_int(addr['end_ip'])))
+        else:
+            intervals.add((ip_to_int(netstr), ip_to_int(netstr)))
+    return list(intervals)
+
+
+def prefer_group_names(writer, pol, compact=False):
+    """
+    Keep the names of the policy's FortiGate address groups for ASA groups with exactly their members
+    """
+    for addrset in (pol['source'], pol['destination']):
+        for group in addrset['addressgroups']:
+            addrs = [a for a in group['members'] if a['start_ip']]
+            names = set(asa_object_name(a) for a in addrs)
+            if compact:
+                members = network_members(address_group_intervals(names, addrs))
+            else:
+                members = address_group_members(names, addrs)[0]
+            if members:
+                writer.prefer_name('network', re.sub(r'\s+', '_', group['name']), members)
+
+
+def service_group_entries(services):
+    """
+    (protocol name, start port, end port or None) of a policy's service group. Only the TCP and UDP ports of
+    compound services are exported, the members of service groups are not resolved.
+    """
+    entries = []
+    for svc in services['compoundservices']:
+        for i in svc['members']:
+            protostr = PROTOCOL_NAMES.get(i['protocol'])
+            if protostr is not None:
+                entries.append((protostr, i['start_port'], i['end_port']))
+    return entries
+
+
+def service_group_members(services):
+    """
+    Member lines of a policy's service group
+    """
+    members = []
+    for protostr, start_port, end_port in service_group_entries(services):
+        if end_port is None:
+            members.append("service-object %s destination eq %s" % (protostr, start_port))
+        else:
+            members.append("service-object %s destination range %s %s" % (protostr, start_port, end_port))
+    return members
+
+
+def write_policy(writer, pol, acl, direction, sources, destinations, compactor=None):
+    """
+    Write the address groups, the service group and the access-list entry of one direction of a policy
+
+    :param sources: (ASA object names, address dicts) of the source addresses
+    :param destinations: (ASA object names, address dicts) of the destination addresses
+    :param compactor: ACLCompactor to add the entry to instead of writing it
+    """
+    prefix = 'pol-%s-%s' % (pol['policyid'], direction)
+    # Both directions of a policy share its service group
+    names = ('pol-%s-services' % pol['policyid'], prefix + '-srcs', prefix + '-dsts')
+    if compactor is not None:
+        services = set((protostr, start, start if end is None else end)
+                       for protostr, start, end in service_group_entries(pol['services']) if start is not None)
+        srcs = address_group_intervals(*sources)
+        dsts = address_group_intervals(*destinations)
+        compactor.add(acl, services, srcs, dsts, names, expanded_count(services, srcs, dsts))
+        return
+    srcgroup = writer.object_group('network', names[1], *address_group_members(*sources))
+    dstgroup = writer.object_group('network', names[2], *address_group_members(*destinations))
+    services = writer.object_group('service', names[0], service_group_members(pol['services']))
+    writer.access_list(acl, services, srcgroup, dstgroup)
+
+
+def write_compacted(writer, compactor):
+    for acl, services, sources, destinations, names in compactor.compact():
+        srcgroup = writer.object_group('network', names[1], network_members(sources))
+        dstgroup = writer.object_group('network', names[2], network_members(destinations))
+        svcgroup = writer.object_group('service', names[0], service_members(services))
+        writer.access_list(acl, svcgroup, srcgroup, dstgroup)
+
+
+def write_routed_policy(writer, table, pol, srcaddrs, dstaddrs, compactor=None):
+    """
+    Write one access-list entry per ingress interface of a policy: the sources routed to the interface, to all
+    destinations routed to another one. An address spanning routes to several interfaces is used for each of them,
+    addresses without a route are left out.
+    """
+    srcs = defaultdict(set)
+    dsts = defaultdict(set)
+    for addrs, interfaces in ((srcaddrs, srcs), (dstaddrs, dsts)):
+        for addr in addrs:
+            for interface in table.resolve(addr):
+                interfaces[interface].add(asa_object_name(addr))
+    for ingress in sorted(srcs):
+        egress = set()
+        for interface, names in dsts.items():
+            if interface != ingress:
+                egress |= names
+        if egress:
+            write_policy(writer, pol, '%s_in' % ingress, ingress, (srcs[ingress], srcaddrs), (egress, dstaddrs),
+                         compactor)
+
+
+@contextlib.contextmanager
+def writable_file(path, default=None):
+    """
+    Open path for writing, or use default (e.g. sys.stdout) if path is None
+    """
+    if path is None:
+        yield default
+    else:
+        with open(path, 'w') as fh:
+            yield fh
 
-def remove_fields_key(jsonobj):
-    for i,obj in enumerate(jsonobj):
-        jsonobj[i] = jsonobj[i]['fields']
-    return jsonobj
-
-def serializepolicyaddrset(id):
-    try:
-        pas = PolicyAddrSet.objects.get(pk=id)
-        pasjson =  json.loads(serializers.serialize('json', [pas]))[0]['fields']
-        pasjson['addresses'] = remove_fields_key(json.loads(
-                serializers.serialize('json', AddressObject.objects.filter(pk__in=pasjson['addresses']))
-            )
-        )
-        pasjson['addressgroups'] = remove_fields_key(json.loads(
-                serializers.serialize('json', AddressGroup.objects.filter(pk__in=pasjson['addressgroups']))
-            )
-        )
-        for agso in pasjson['addressgroups']:
-            agso['members'] = remove_fields_key(json.loads(
-                    serializers.serialize('json', AddressObject.objects.filter(pk__in=agso['members']))
-                )
-            )
-        return pasjson
-    except:
-        print('PolicyAddressSet ID: %d' % id)
-        raise
-
-def serializepolicyserviceset(id):
-    try:
-        pss = PolicyServiceSet.objects.get(pk=id)
-        pssjson =  json.loads(serializers.serialize('json', [pss]))[0]['fields']
-        pssjson['services'] = remove_fields_key(json.loads(
-                serializers.serialize('json', ServiceObject.objects.filter(pk__in=pssjson['services']))
-            )
-        )
-        pssjson['compoundservices'] = remove_fields_key(json.loads(
-                serializers.serialize('json', CompoundServiceObject.objects.filter(pk__in=pssjson['compoundservices']))
-            )
-        )
-        for cso in pssjson['compoundservices']:
-            cso['members'] = remove_fields_key(json.loads(
-                    serializers.serialize('json', ServiceObject.objects.filter(pk__in=cso['members']))
-                )
-            )
-        pssjson['servicegroups'] = remove_fields_key(json.loads(
-                serializers.serialize('json', ServiceGroup.objects.filter(pk__in=pssjson['servicegroups']))
-            )
-        )
-        return pssjson
-    except:
-        raise
-
-
-def serializepolicy(jsonpolicy):
-    try:
-        if len(jsonpolicy)!=1:
-            print("Unparsable policy: \n%s" % str(jsonpolicy))
-
-        # Remove the 'fields' subkey
-        jsonpolicy[0] = jsonpolicy[0]['fields']
-        # Serialize the destinatoin in place
-        jsonpolicy[0]['destination'] = serializepolicyaddrset(jsonpolicy[0]['destination'])
-        # Serialize the source in place
-        jsonpolicy[0]['source'] = serializepolicyaddrset(jsonpolicy[0]['source'])
-        # Serialize the services list
-        jsonpolicy[0]['services'] = serializepolicyserviceset(jsonpolicy[0]['services'])
-        return jsonpolicy[0]
-    except:
-        print("Exception while handling policy: ")
-        print(json.dumps(jsonpolicy, indent=2, sort_keys=True))
-        raise
 
 class Command(BaseCommand):
     help = 'Process Fortigate configuration and populate Normalized Model Objects'
@@ -97,7 +215,127 @@ class Command(BaseCommand):
                             default='n'
                             )
 
+        parser.add_argument('--monitor-net', metavar='a.b.c.d/len', action='append',
+                            help='Monitored (inside) network, may be repeated (default: %s)' % ' '.join(MONITOR_NETS),
+                            default=[]
+                            )
+
+        parser.add_argument('--monitor-file', metavar='<file>',
+                            help='File with one monitored network per line',
+                            default=None
+                            )
+
+        parser.add_argument('-o', metavar='<asa-config-file>',
+                            help='Write the ASA configuration to this file (default: stdout)',
+                            default=None
+                            )
+
+        parser.add_argument('--json-dump', metavar='<jsonl-file>',
+                            help='Also write the exported policies with their objects to a JSON lines file, '
+                                 'one policy per line',
+                            default=None
+                            )
+
+        parser.add_argument('--routes-file', metavar='<file>',
+                            help="Derive the ACLs from a routing table instead of the monitored networks. One route "
+                                 "per line: 'route <interface> <network> <netmask> <gateway>' or "
+                                 "'<network>/<prefixlen> <gateway> <interface>'",
+                            default=None
+                            )
+
+        parser.add_argument('--db-routes', action='store_true',
+                            help='Derive the ACLs from the routes stored for the device with import-routes',
+                            default=False
+                            )
+
+        parser.add_argument('--compact', action='store_true',
+                            help='Aggregate addresses into minimal CIDR blocks, merge port ranges and merge the ACEs '
+                                 'of an ACL which differ in one of sources, destinations or services only. The ACEs '
+                                 'are written after all policies are converted.',
+                            default=False
+                            )
+
+        parser.add_argument('--no-group-dedup', action='store_true',
+                            help='Write separate object-groups for every policy, even when their members are identical',
+                            default=False
+                            )
+
+        parser.add_argument('--numpy', action='store_true',
+                            help='Find the addresses outside of the monitored networks for the whole device at once '
+                                 'with NumPy',
+                            default=False
+                            )
+
+        parser.add_argument('--profile', action='store_true',
+                            help='Print wall time, CPU time, SQL queries and peak memory of every export phase',
+                            default=False
+                            )
+
+        parser.add_argument('--profile-json', metavar='<report-file>',
+                            help='Write the profile to a JSON file (implies --profile)',
+                            default=None
+                            )
+
     def handle(self, *args, **options):
+        profiler = PhaseProfiler(enabled=options['profile'] or bool(options['profile_json']))
+        # The outermost phase keeps memory tracing and query counting installed for the whole command
+        profiler.start('total')
+        try:
+            self.export(profiler, options)
+        finally:
+            profiler.finish()
+            if profiler.enabled:
+                profiler.print_summary()
+                if options['profile_json']:
+                    profiler.write_json(options['profile_json'])
+
+    def monitor_networks(self, options):
+        networks = list(options['monitor_net'])
+        if options['monitor_file']:
+            with open(options['monitor_file']) as fh:
+                networks += [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+        try:
+            return [ipaddress.IPv4Network(n) for n in networks or MONITOR_NETS]
+        except ValueError as e:
+            raise CommandError("Invalid monitored network: %s" % e)
+
+    def classify_outside(self, classifier, devices, options):
+        """
+        Fill the classifier's cache for all addresses of the devices not overlapping the monitored networks, only
+        the remaining ones are classified block by block
+        """
+        try:
+            addresses = AddressArrays.from_devices(devices)
+            outside = ~addresses.overlaps(self.monitor_networks(options))
+        except ImportError as e:
+            raise CommandError(str(e))
+        for i in outside.nonzero()[0]:
+            addr = addresses.addresses[i]
+            # IPv6 and FQDN objects are left to the classifier
+            if addr['type'] in ('ip4', 'net4', 'range4'):
+                classifier.cache[address_key(addr)] = OUTSIDE
+
+    def route_table(self, devices, options):
+        """
+        :return: RouteTable of the routes file or the devices' stored routes, None to use the monitored networks
+        """
+        if options['routes_file']:
+            try:
+                with open(options['routes_file']) as fh:
+                    routes = read_routes(fh)
+            except ValueError as e:
+                raise CommandError("%s: %s" % (options['routes_file'], e))
+        elif options['db_routes']:
+            routes = [('%s/%d' % (network, prefixlen), gateway, interface) for network, prefixlen, gateway, interface
+                      in Route.objects.filter(device__in=devices).order_by('pk').values_list(
+                          'network', 'prefixlen', 'gateway', 'interface')]
+            if not routes:
+                raise CommandError("No routes stored for %s, see import-routes" % devices)
+        else:
+            return None
+        return RouteTable(routes)
+
+    def export(self, profiler, options):
         hn = options['hostname']
         try:
             if 'vsys' in options:
@@ -106,413 +344,80 @@ class Command(BaseCommand):
                 srcdevobj = Device.objects.filter(hostname=hn)
         except:
             raise
-        print(("!Policies for source device: %s" % srcdevobj))
-        input_policies = Policy.objects.filter(device=srcdevobj)
-
-        #Print out the policies
-        jsonpollist = []
-        for inputpol in input_policies:
-            jsonpolicy = json.loads(serializers.serialize('json', [inputpol]))
-            jsonpollist.append(serializepolicy(jsonpolicy))
-            #if len(jsonpollist) > 20:
-            #    break
-
-        jsonout = open("full-json-output.json", 'w')
-        jsonout.write(json.dumps(jsonpollist, indent=2, sort_keys=True))
-        jsonout.close()
-
-        # define the Cisco ASA routing table here
-        ROUTES=[
-               ("0.0.0.0", "0.0.0.0", "10.20.8.3", "Outside"),
-               ("10.20.45.0", "255.255.255.0", "10.20.11.4", "FWOut-GenBand3850-1300"),
-               ("10.20.46.0", "255.255.255.240", "10.20.11.4", "FWOut-GenBand3850-1300"),
-               ("10.21.0.0", "255.255.240.0", "10.20.10.1", "FabricasGW-1201"),
-               ("10.21.16.0", "255.255.240.0", "10.20.10.9", "FabricasGW-1202"),
-               ("10.21.32.0", "255.255.224.0", "10.20.10.201", "FabricasGW-1294"),
-               ("10.21.128.0", "255.255.224.0", "10.20.10.201", "FabricasGW-1294"),
-               ("10.21.160.0", "255.255.240.0", "10.20.10.201", "FabricasGW-1294"),
-               ("10.21.176.0", "255.255.240.0", "10.20.10.209", "FabricasGW-1295"),
-               ("10.22.192.0", "255.255.240.0", "10.20.10.131", "LBasGW-1901"),
-               ("10.22.208.0", "255.255.240.0", "10.20.10.139", "LBasGW-1902"),
-        ]
-
-        for i,dest in enumerate(ROUTES):
-            ROUTES[i] = (ipaddress.IPv4Network(ROUTES[i][0]+'/'+ROUTES[i][1]), ROUTES[i][2], ROUTES[i][3])
-
-        #print(ROUTES)
-
-        MONITOR_NETS = [ "10.21.32.0/19", "10.21.128.0/19", "10.21.160.0/20" ]
-        for i,net in enumerate(MONITOR_NETS):
-            MONITOR_NETS[i] = ipaddress.IPv4Network(MONITOR_NETS[i])
-
-        #print(MONITOR_NETS)
-
-        addrobjs = dict()
-        addrobjgroups = dict()
-        serviceobjgroups = dict()
-        in_to_out_policies = dict()
-        out_to_in_policies = dict()
+
+        profiler.start('load policies')
+        jsonpollist = load_policies(srcdevobj)
+        profiler.stop()
+
+        profiler.start('routes')
+        table = self.route_table(srcdevobj, options)
+        profiler.stop()
+        classifier = NetworkClassifier(self.monitor_networks(options))
 
         INSIDE_ACL_NAME = 'FabricasGW-1294_in'
         OUTSIDE_ACL_NAME = 'outside_in'
 
-        for pol in jsonpollist:
-            #print('!parsing policyid %s' % pol['policyid'])
-            policysrcnets = list()
-            #We first determine whether policy is valid for us or not
-            combined_pol_source_addrs = pol['source']['addresses']
-            for addr in pol['source']['addressgroups']:
-                for member in addr['members']:
-                    combined_pol_source_addrs.append(member)
-            #print('!policy source addresses')
-            #print('!'+(', '.join([i['name'] for i in combined_pol_source_addrs])))
-            combined_pol_destination_addrs = pol['destination']['addresses']
-            for addr in pol['destination']['addressgroups']:
-                for member in addr['members']:
-                    combined_pol_destination_addrs.append(member)
-            #print('!policy destination addresses')
-            #print('!'+(', '.join([i['name'] for i in combined_pol_destination_addrs])))
-
-            requires_in2out_policy = False
-            requires_out2in_policy = False
-            inside_srcs = set()
-            outside_dsts = set()
-            outside_srcs = set()
-            inside_dsts = set()
-
-            # Check for inside sources
-            for srcaddr in combined_pol_source_addrs:
-                try:
-                    if srcaddr['type'] == 'net4':
-                        netstr = srcaddr['start_ip'] + '_' + str(srcaddr['prefixlen'])
-                        net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(monnet, net) and (net.prefixlen >= monnet.prefixlen):
-                                inside_srcs.add(netstr)
-                    elif srcaddr['type'] == 'range4':
-                        netstr = srcaddr['start_ip'] + '-' + srcaddr['end_ip']
-                        rangenets = [ipaddr for ipaddr in ipaddress.summarize_address_range(
-                            ipaddress.IPv4Address(srcaddr['start_ip']),
-                            ipaddress.IPv4Address(srcaddr['end_ip']))
-                                     ]
-                        # If atleast 1 rangenet overlaps with monnets
-                        singlematch = False
-                        for rnet in rangenets:
-                            if not singlematch:
-                                for monnet in MONITOR_NETS:
-                                    if (ipaddress.IPv4Network.overlaps(rnet, monnet) and (rnet.prefixlen >= monnet.prefixlen)):
-                                        singlematch = True
-                        if singlematch == True:
-                            inside_srcs.add(netstr)
-                    else:
-                        netstr = srcaddr['start_ip']
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(ipaddress.IPv4Network(netstr + '/32'), monnet):
-                                inside_srcs.add(netstr)
-                except:
-                    print("!Error on srcaddr %s" % str(srcaddr))
-                    raise
-            # Check for outside destinations
-            for dstaddr in combined_pol_destination_addrs:
-                try:
-                    if dstaddr['type'] == 'net4':
-                        netstr = dstaddr['start_ip'] + '_' + str(dstaddr['prefixlen'])
-                        net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(monnet, net) and (net.prefixlen >= monnet.prefixlen):
-                                pass
-                            else:
-                                outside_dsts.add(netstr)
-                    elif dstaddr['type'] == 'range4':
-                        netstr = dstaddr['start_ip'] + '-' + dstaddr['end_ip']
-                        rangenets = [ipaddr for ipaddr in ipaddress.summarize_address_range(
-                            ipaddress.IPv4Address(dstaddr['start_ip']),
-                            ipaddress.IPv4Address(dstaddr['end_ip']))
-                                     ]
-                        # If NO rangenet overlaps with monnets
-                        overlapcount = 0
-                        for rnet in rangenets:
-                            for monnet in MONITOR_NETS:
-                                if (ipaddress.IPv4Network.overlaps(rnet, monnet) and (rnet.prefixlen >= monnet.prefixlen)):
-                                    overlapcount += 1
-                        if overlapcount == 0:
-                            outside_dsts.add(netstr)
-                    else:
-                        netstr = dstaddr['start_ip']
-                        overlapcount = 0
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(ipaddress.IPv4Network(netstr + '/32'), monnet):
-                                overlapcount += 1
-                            if overlapcount == 0:
-                                outside_dsts.add(netstr)
-                except:
-                    print("!Error on dstaddr %s" % str(dstaddr))
-                    raise
-            # Check for outside sources
-            for srcaddr in combined_pol_source_addrs:
-                try:
-                    if srcaddr['type'] == 'net4':
-                        netstr = srcaddr['start_ip'] + '_' + str(srcaddr['prefixlen'])
-                        net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(monnet, net) and (net.prefixlen >= monnet.prefixlen):
-                                pass
-                            else:
-                                outside_srcs.add(netstr)
-                    elif srcaddr['type'] == 'range4':
-                        netstr = srcaddr['start_ip'] + '-' + srcaddr['end_ip']
-                        rangenets = [ipaddr for ipaddr in ipaddress.summarize_address_range(
-                            ipaddress.IPv4Address(srcaddr['start_ip']),
-                            ipaddress.IPv4Address(srcaddr['end_ip']))
-                                     ]
-                        # If not a single rangenet overlap with monnets
-                        overlapcount = 0
-                        for rnet in rangenets:
-                            for monnet in MONITOR_NETS:
-                                if (ipaddress.IPv4Network.overlaps(rnet, monnet) and (rnet.prefixlen >= monnet.prefixlen)):
-                                    overlapcount += 1
-                        if overlapcount == 0:
-                            outside_srcs.add(netstr)
-                    else:
-                        netstr = srcaddr['start_ip']
-                        overlapcount = 0
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(ipaddress.IPv4Network(netstr + '/32'), monnet):
-                                overlapcount += 1
-                            if overlapcount == 0:
-                                outside_srcs.add(netstr)
-                except:
-                    print("!Error on srcaddr %s" % str(srcaddr))
-                    raise
-            # Check for inside destinations
-            for dstaddr in combined_pol_destination_addrs:
-                try:
-                    if dstaddr['type'] == 'net4':
-                        netstr = dstaddr['start_ip'] + '_' + str(dstaddr['prefixlen'])
-                        net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(monnet, net) and (net.prefixlen >= monnet.prefixlen):
-                                inside_dsts.add(netstr)
-                    elif dstaddr['type'] == 'range4':
-                        netstr = dstaddr['start_ip'] + '-' + dstaddr['end_ip']
-                        rangenets = [ipaddr for ipaddr in ipaddress.summarize_address_range(
-                            ipaddress.IPv4Address(dstaddr['start_ip']),
-                            ipaddress.IPv4Address(dstaddr['end_ip']))
-                                     ]
-                        # If atleast 1 rangenet overlaps with monnets
-                        singlematch = False
-                        for rnet in rangenets:
-                            if not singlematch:
-                                for monnet in MONITOR_NETS:
-                                    if (ipaddress.IPv4Network.overlaps(rnet, monnet) and (rnet.prefixlen >= monnet.prefixlen)):
-                                        singlematch = True
-                        if singlematch == True:
-                            inside_dsts.add(netstr)
-                    else:
-                        netstr = dstaddr['start_ip']
-                        for monnet in MONITOR_NETS:
-                            if ipaddress.IPv4Network.overlaps(ipaddress.IPv4Network(netstr + '/32'), monnet):
-                                inside_dsts.add(netstr)
-                except:
-                    print("!Error on dstaddr %s" % str(dstaddr))
-                    raise
-            if len(inside_srcs) and len(outside_dsts):
-                requires_in2out_policy = True
-                #print("!Inside sources: %s" % (', '.join([i for i in inside_srcs])))
-                #print("!Outside destinations: %s" % (', '.join([i for i in outside_dsts])))
-
-            if len(outside_srcs) and len(inside_dsts):
-                requires_out2in_policy = True
-                #print("!Outside sources: %s" % (', '.join([i for i in outside_srcs])))
-                #print("!Inside destinations: %s" % (', '.join([i for i in inside_dsts])))
-
-            if requires_in2out_policy:
-
-                #Create the source objects
-                srcaddrobjgrpstr = 'pol-' + str(pol['policyid']) + '-in2out-srcs'
-                addrobjgroups[srcaddrobjgrpstr] = "object-group network %s\n" % (srcaddrobjgrpstr)
-                for inside_src in inside_srcs:
-                    for srcaddr in combined_pol_source_addrs:
-                        netstr = inside_src
-                        if srcaddr['type'] == 'net4' and (netstr.replace('_', '/') == srcaddr['name']):
-                            net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                            if inside_src not in addrobjs:
-                                addrobjs[inside_src] = "object network %s\n subnet %s %s\nexit" % (netstr,
-                                                                                                    str(
-                                                                                                        net.network_address),
-                                                                                                    str(net.netmask))
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif srcaddr['type'] == 'range4' and netstr == srcaddr['start_ip'] + '-' + srcaddr['end_ip']:
-                            if inside_src not in addrobjs:
-                                addrobjs[netstr] = "object network %s\n range %s %s\nexit" % (netstr,
-                                                                                              srcaddr['start_ip'],
-                                                                                              srcaddr['end_ip'])
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif netstr == srcaddr['start_ip']:
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object host %s\n" % netstr
-                addrobjgroups[srcaddrobjgrpstr] += "exit"
-
-                # Create the destination objects
-                dstaddrobjgrpstr = 'pol-' + str(pol['policyid']) + '-in2out-dsts'
-                addrobjgroups[dstaddrobjgrpstr] = "object-group network %s\n" % (dstaddrobjgrpstr)
-                for outside_dst in outside_dsts:
-                    for dstaddr in combined_pol_destination_addrs:
-                        netstr = outside_dst
-                        if dstaddr['type'] == 'net4' and (netstr.replace('_','/') == dstaddr['name']):
-                            net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                            if outside_dst not in addrobjs:
-                                addrobjs[outside_dst] = "object network %s\n subnet %s %s\nexit" % (netstr,
-                                                                                               str(net.network_address),
-                                                                                               str(net.netmask))
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif dstaddr['type'] == 'range4' and netstr == dstaddr['start_ip']+'-'+dstaddr['end_ip']:
-                            if outside_dst not in addrobjs:
-                                addrobjs[netstr] = "object network %s\n range %s %s\nexit" % (netstr,
-                                                                                              dstaddr['start_ip'],
-                                                                                              dstaddr['end_ip'])
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif netstr == dstaddr['start_ip']:
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object host %s\n" % netstr
-                addrobjgroups[dstaddrobjgrpstr] += "exit"
-
-                # Create the Service Objects Group for the Policy
-                serviceobjgrpstr = 'pol-' + str(pol['policyid']) + '-services'
-                if serviceobjgrpstr not in serviceobjgroups:
-                    serviceobjgroups[serviceobjgrpstr] = "object-group service %s\n" % serviceobjgrpstr
-                    for key in pol['services']:
-                        if key == 'compoundservices':
-                            for svc in pol['services'][key]:
-                                for i in svc['members']:
-                                    if i['protocol'] == 6:
-                                        protostr = 'tcp'
-                                    elif i['protocol'] == 17:
-                                        protostr = 'udp'
-                                    if i['end_port'] is None:
-                                        serviceobjgroups[
-                                            serviceobjgrpstr] += ' service-object %s destination eq %s\n' % (
-                                        protostr, str(
-                                            i['start_port']))
-                                    else:
-                                        serviceobjgroups[
-                                            serviceobjgrpstr] += ' service-object %s destination range %s %s\n' % (
-                                            protostr, str(i['start_port']), str(i['end_port']))
-
-                        if key == 'servicegroups':
-                            for svcgrp in pol['services'][key]:
-                                for key in svcgrp['members']:
-                                    if key == 'compoundservices':
-                                        for svc in pol['services'][key]:
-                                            for i in svc['members']:
-                                                if i['protocol'] == 6:
-                                                    protostr = 'tcp'
-                                                elif i['protocol'] == 17:
-                                                    protostr = 'udp'
-                                                if i['end_port'] is None:
-                                                    serviceobjgroups[
-                                                        serviceobjgrpstr] += ' service-object %s destination eq %s\n' % (
-                                                        protostr, str(
-                                                            i['start_port']))
-                                                else:
-                                                    serviceobjgroups[
-                                                        serviceobjgrpstr] += ' service-object %s destination range %s %s\n' % (
-                                                        protostr, str(i['start_port']), str(i['end_port']))
-                    serviceobjgroups[serviceobjgrpstr] += 'exit'
-
-                # Build the policy
-                in_to_out_policies[pol['policyid']] = "access-list %s line 1 extended permit object-group %s object-group %s  object-group %s log" % (
-                    INSIDE_ACL_NAME, serviceobjgrpstr, srcaddrobjgrpstr, dstaddrobjgrpstr)
-            if requires_out2in_policy:
-
-                #Create the source objects
-                srcaddrobjgrpstr = 'pol-' + str(pol['policyid']) + '-out2in-srcs'
-                addrobjgroups[srcaddrobjgrpstr] = "object-group network %s\n" % (srcaddrobjgrpstr)
-                for outside_src in outside_srcs:
-                    for srcaddr in combined_pol_source_addrs:
-                        netstr = outside_src
-                        if srcaddr['type'] == 'net4' and (netstr.replace('_', '/') == srcaddr['name']):
-                            net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                            if outside_src not in addrobjs:
-                                addrobjs[outside_src] = "object network %s\n subnet %s %s\nexit" % (netstr,
-                                                                                                    str(
-                                                                                                        net.network_address),
-                                                                                                    str(net.netmask))
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif srcaddr['type'] == 'range4' and netstr == srcaddr['start_ip'] + '-' + srcaddr['end_ip']:
-                            if outside_src not in addrobjs:
-                                addrobjs[netstr] = "object network %s\n range %s %s\nexit" % (netstr,
-                                                                                              srcaddr['start_ip'],
-                                                                                              srcaddr['end_ip'])
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif netstr == srcaddr['start_ip']:
-                            addrobjgroups[srcaddrobjgrpstr] += " network-object host %s\n" % netstr
-                addrobjgroups[srcaddrobjgrpstr] += "exit"
-
-                # Create the destination objects
-                dstaddrobjgrpstr = 'pol-' + str(pol['policyid']) + '-out2in-dsts'
-                addrobjgroups[dstaddrobjgrpstr] = "object-group network %s\n" % (dstaddrobjgrpstr)
-                for inside_dst in inside_dsts:
-                    for dstaddr in combined_pol_destination_addrs:
-                        netstr = inside_dst
-                        if dstaddr['type'] == 'net4' and (netstr.replace('_','/') == dstaddr['name']):
-                            net = ipaddress.IPv4Network(netstr.replace('_', '/'))
-                            if inside_dst not in addrobjs:
-                                addrobjs[inside_dst] = "object network %s\n subnet %s %s\nexit" % (netstr,
-                                                                                               str(net.network_address),
-                                                                                               str(net.netmask))
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif dstaddr['type'] == 'range4' and netstr == dstaddr['start_ip']+'-'+dstaddr['end_ip']:
-                            if inside_dst not in addrobjs:
-                                addrobjs[netstr] = "object network %s\n range %s %s\nexit" % (netstr,
-                                                                                              dstaddr['start_ip'],
-                                                                                              dstaddr['end_ip'])
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object object %s\n" % netstr
-                        elif netstr == dstaddr['start_ip']:
-                            addrobjgroups[dstaddrobjgrpstr] += " network-object host %s\n" % netstr
-                addrobjgroups[dstaddrobjgrpstr] += "exit"
-
-                # Create the Service Objects Group for the Policy
-                serviceobjgrpstr = 'pol-' + str(pol['policyid']) + '-services'
-                if serviceobjgrpstr not in serviceobjgroups:
-                    serviceobjgroups[serviceobjgrpstr] = "object-group service %s\n" % serviceobjgrpstr
-                    for key in pol['services']:
-                        if key == 'compoundservices':
-                            for svc in pol['services'][key]:
-                                for i in svc['members']:
-                                    if i['protocol'] == 6:
-                                        protostr = 'tcp'
-                                    elif i['protocol'] == 17:
-                                        protostr = 'udp'
-                                    if i['end_port'] is None:
-                                        serviceobjgroups[
-                                            serviceobjgrpstr] += ' service-object %s destination eq %s\n' % (
-                                        protostr, str(
-                                            i['start_port']))
-                                    else:
-                                        serviceobjgroups[
-                                            serviceobjgrpstr] += ' service-object %s destination range %s %s\n' % (
-                                            protostr, str(i['start_port']), str(i['end_port']))
-
-                        if key == 'servicegroups':
-                            for svcgrp in pol['services'][key]:
-                                print(json.dumps(svcgrp))
-                    serviceobjgroups[serviceobjgrpstr] += 'exit'
-
-                # Build the policy
-                out_to_in_policies[pol['policyid']] = "access-list %s line 1 extended permit object-group %s object-group %s object-group %s log" % (
-                    OUTSIDE_ACL_NAME, serviceobjgrpstr, srcaddrobjgrpstr, dstaddrobjgrpstr)
-
-        for a in addrobjs:
-            #print("!Address Object %s" % a)
-            print(addrobjs[a])
-        for ag in addrobjgroups:
-            #print("!Address Object Group %s" % ag)
-            print(addrobjgroups[ag])
-        for svcg in serviceobjgroups:
-            #print("!Service Object Group %s" % svcg)
-            print(serviceobjgroups[svcg])
-        for policy in in_to_out_policies:
-            #print("!Policy ID %s" % policy)
-            print(in_to_out_policies[policy])
-        for policy in out_to_in_policies:
-            #print("!Policy ID %s" % policy)
-            print(out_to_in_policies[policy])
+        with writable_file(options['o'], sys.stdout) as fh, writable_file(options['json_dump']) as jsondump:
+            writer = ASAConfigWriter(fh, dedup=not options['no_group_dedup'])
+            compactor = ACLCompactor() if options['compact'] else None
+            writer.comment("Policies for source device: %s" % srcdevobj)
+
+            profiler.start('convert')
+            if options['numpy']:
+                self.classify_outside(classifier, srcdevobj, options)
+            for pol in jsonpollist:
+                if jsondump:
+                    jsondump.write(json.dumps(pol, sort_keys=True) + '\n')
+                if writer.dedup:
+                    prefer_group_names(writer, pol, compact=compactor is not None)
+                #We first determine whether policy is valid for us or not
+                # The address lists are shared with other policies using the same set
+                combined_pol_source_addrs = list(pol['source']['addresses'])
+                for addr in pol['source']['addressgroups']:
+                    for member in addr['members']:
+                        combined_pol_source_addrs.append(member)
+                combined_pol_destination_addrs = list(pol['destination']['addresses'])
+                for addr in pol['destination']['addressgroups']:
+                    for member in addr['members']:
+                        combined_pol_destination_addrs.append(member)
+                # FQDN objects have no address to classify
+                combined_pol_source_addrs = [a for a in combined_pol_source_addrs if a['start_ip']]
+                combined_pol_destination_addrs = [a for a in combined_pol_destination_addrs if a['start_ip']]
+
+                if table is not None:
+                    write_routed_policy(writer, table, pol, combined_pol_source_addrs, combined_pol_destination_addrs,
+                                        compactor)
+                    continue
+
+                inside_srcs = set()
+                outside_dsts = set()
+                outside_srcs = set()
+                inside_dsts = set()
+
+                # An address with at least one block within the monitored networks is inside, any other one outside
+                for addrs, inside, outside in ((combined_pol_source_addrs, inside_srcs, outside_srcs),
+                                               (combined_pol_destination_addrs, inside_dsts, outside_dsts)):
+                    for addr in addrs:
+                        if classifier.classify(addr) == OUTSIDE:
+                            outside.add(asa_object_name(addr))
+                        else:
+                            inside.add(asa_object_name(addr))
+
+                if len(inside_srcs) and len(outside_dsts):
+                    write_policy(writer, pol, INSIDE_ACL_NAME, 'in2out', (inside_srcs, combined_pol_source_addrs),
+                                 (outside_dsts, combined_pol_destination_addrs), compactor)
+                if len(outside_srcs) and len(inside_dsts):
+                    write_policy(writer, pol, OUTSIDE_ACL_NAME, 'out2in', (outside_srcs, combined_pol_source_addrs),
+                                 (inside_dsts, combined_pol_destination_addrs), compactor)
+            profiler.stop()
+
+            summaries = [writer.summary()]
+            if compactor is not None:
+                profiler.start('compact')
+                write_compacted(writer, compactor)
+                profiler.stop()
+                summaries = [compactor.summary(), writer.summary()]
+            for summary in summaries:
+                writer.comment(summary)
+                if options['o']:
+                    print(summary)
@@ -0,0 +1,79 @@
+#!/usr/local/bin/python
+"""
+Report the number of expanded ACL elements the policies of devices will produce on the target firewall, per device,
+per ACL and for the most expensive policies. See normalized_fw_config.acecost for how elements are counted.
+"""
+
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.acecost import ACECostModel, acl_totals
+from normalized_fw_config.models import *
+
+
+class Command(BaseCommand):
+    help = 'Estimate the expanded ACL element count per policy, per ACL and per device'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Only estimate the devices with this hostname (default: all devices)',
+                            default=None
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='Only estimate this vsys/vdom/context',
+                            default=None
+                            )
+
+        parser.add_argument('--top', metavar='N', type=int,
+                            help='Number of most expensive policies to list (default: 20)',
+                            default=20
+                            )
+
+        parser.add_argument('--json', metavar='<report-file>',
+                            help='Also write the estimate of every policy to a JSON file',
+                            default=None
+                            )
+
+    def handle(self, *args, **options):
+        devices = Device.objects.all()
+        if options['hostname']:
+            devices = devices.filter(hostname=options['hostname'])
+        if options['vsys']:
+            devices = devices.filter(vsys=options['vsys'])
+        names = dict((device.pk, '%s [%s]' % (device.hostname, device.vsys or '')) for device in devices)
+        if not names:
+            raise CommandError("No matching devices")
+
+        policies = ACECostModel(devices).estimate()
+        acls = acl_totals(policies)
+
+        totals = defaultdict(lambda: [0, 0, 0])
+        for p in policies:
+            totals[p['device']][0] += 1
+            totals[p['device']][2] += p['total']
+        for device, acl in acls:
+            totals[device][1] += 1
+
+        print("%-40s %10s %6s %14s" % ('Device', 'Policies', 'ACLs', 'Elements'))
+        for device, name in sorted(names.items(), key=lambda item: item[1]):
+            print("%-40s %10d %6d %14d" % ((name,) + tuple(totals[device])))
+
+        print("\n%-40s %-30s %10s %14s" % ('Device', 'ACL', 'Policies', 'Elements'))
+        for (device, acl), (count, elements) in sorted(acls.items(), key=lambda item: -item[1][1]):
+            print("%-40s %-30s %10d %14d" % (names[device], acl + '_in', count, elements))
+
+        print("\nTop %d policies" % options['top'])
+        print("%-40s %8s %-30s %8s %8s %8s %5s %14s" % ('Device', 'Policy', 'Name', 'Sources', 'Dests', 'Services',
+                                                         'ACLs', 'Elements'))
+        for p in sorted(policies, key=lambda p: -p['total'])[:options['top']]:
+            print("%-40s %8d %-30s %8d %8d %8d %5d %14d" % (names[p['device']], p['policyid'], (p['name'] or '')[:30],
+                                                             p['sources'], p['destinations'], p['services'],
+                                                             len(p['acls']), p['total']))
+
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(policies, fh, indent=2)
+            print("\nEstimate written to %s" % options['json'])
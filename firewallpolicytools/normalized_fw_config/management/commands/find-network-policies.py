@@ -0,0 +1,98 @@
+#!/usr/local/bin/python
+"""
+List the policies whose source or destination addresses touch a list of networks.
+
+All address objects of the selected devices are matched against the networks at once with
+normalized_fw_config.addressarrays, which needs NumPy. A policy is listed when one of its addresses, directly or
+through an address group, matches.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.addressarrays import AddressArrays, QueryNetworks
+from normalized_fw_config.models import *
+from normalized_fw_config.policygraph import load_policies
+
+MODES = ('overlaps', 'within', 'contains')
+
+
+def policy_addresses(addrset):
+    addresses = list(addrset['addresses'])
+    for group in addrset['addressgroups']:
+        addresses += group['members']
+    return addresses
+
+
+class Command(BaseCommand):
+    help = 'Find the policies using addresses which overlap, lie within or contain the given networks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('networks', metavar='a.b.c.d/len', nargs='*',
+                            help='Networks to search for (IPv4 or IPv6)'
+                            )
+
+        parser.add_argument('--networks-file', metavar='<file>',
+                            help='File with one network per line',
+                            default=None
+                            )
+
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Only search the devices with this hostname (default: all devices)',
+                            default=None
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='Only search this vsys/vdom/context',
+                            default=None
+                            )
+
+        parser.add_argument('--mode', choices=MODES,
+                            help='overlaps: the address shares at least one address with the networks, within: all '
+                                 'its addresses lie within them, contains: it contains one of the networks entirely '
+                                 '(default: overlaps)',
+                            default='overlaps'
+                            )
+
+    def read_networks(self, options):
+        networks = list(options['networks'])
+        if options['networks_file']:
+            with open(options['networks_file']) as fh:
+                networks += [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+        if not networks:
+            raise CommandError("No networks given")
+        try:
+            return QueryNetworks(networks)
+        except ValueError as e:
+            raise CommandError("Invalid network: %s" % e)
+
+    def handle(self, *args, **options):
+        devices = Device.objects.all()
+        if options['hostname']:
+            devices = devices.filter(hostname=options['hostname'])
+        if options['vsys']:
+            devices = devices.filter(vsys=options['vsys'])
+        try:
+            networks = self.read_networks(options)
+            addresses = AddressArrays.from_devices(devices)
+        except ImportError as e:
+            raise CommandError(str(e))
+
+        matches = getattr(addresses, options['mode'])(networks)
+        matched = set((addresses.addresses[i]['device'], addresses.addresses[i]['name'])
+                      for i in matches.nonzero()[0])
+        print("%d of %d address objects match" % (len(matched), len(addresses.addresses)))
+
+        names = dict((device.pk, '%s [%s]' % (device.hostname, device.vsys or '')) for device in devices)
+        count = 0
+        for pol in load_policies(devices):
+            found = []
+            for side in ('source', 'destination'):
+                hits = sorted(set(a['name'] for a in policy_addresses(pol[side])
+                                 if (a['device'], a['name']) in matched))
+                if hits:
+                    found.append("%s: %s" % (side, ', '.join(hits)))
+            if found:
+                count += 1
+                print("%s policy %s (%s) %s" % (names[pol['device']], pol['policyid'], pol['name'] or '',
+                                               '; '.join(found)))
+        print("%d policies found" % count)
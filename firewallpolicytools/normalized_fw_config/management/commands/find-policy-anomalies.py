@@ -0,0 +1,75 @@
+#!/usr/local/bin/python
+"""
+Report the shadowed, redundant and correlated policies of a device. See normalized_fw_config.anomalies for the
+definitions and how policies are compared.
+"""
+
+import json
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.anomalies import PolicyAnomalies, SHADOWED, REDUNDANT, CORRELATED
+from normalized_fw_config.models import *
+
+DESCRIPTIONS = {
+    SHADOWED: 'shadowed by',
+    REDUNDANT: 'redundant with',
+    CORRELATED: 'correlated with',
+}
+
+
+def policy_label(policyid, name, action):
+    if name:
+        return '%d (%s, %s)' % (policyid, name, action)
+    return '%d (%s)' % (policyid, action)
+
+
+class Command(BaseCommand):
+    help = 'Find the policies of a device shadowed by earlier, redundant with later or conflicting with earlier ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Hostname of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='vsys/vdom/context of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--kind', choices=(SHADOWED, REDUNDANT, CORRELATED), action='append',
+                            help='Only report this kind of finding, may be given several times (default: all)',
+                            default=None
+                            )
+
+        parser.add_argument('--json', metavar='<report-file>',
+                            help='Also write the findings to a JSON file',
+                            default=None
+                            )
+
+    def handle(self, *args, **options):
+        try:
+            device = Device.objects.get(hostname=options['hostname'], vsys=options['vsys'])
+        except Device.DoesNotExist:
+            raise CommandError("Device %s [%s] does not exist" % (options['hostname'], options['vsys']))
+
+        start = time.time()
+        analysis = PolicyAnomalies(device)
+        findings = analysis.analyze()
+        if options['kind']:
+            findings = [f for f in findings if f['kind'] in options['kind']]
+
+        for f in findings:
+            print("%s %s %s" % (policy_label(f['policyid'], f['name'], f['action']), DESCRIPTIONS[f['kind']],
+                                policy_label(f['other_policyid'], f['other_name'], f['other_action'])))
+        counts = Counter(f['kind'] for f in findings)
+        print("\n%d policies analyzed in %.2fs: %d shadowed, %d redundant, %d correlated" % (
+            len(analysis.policies), time.time() - start, counts[SHADOWED], counts[REDUNDANT], counts[CORRELATED]))
+
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(findings, fh, indent=2)
+            print("Findings written to %s" % options['json'])
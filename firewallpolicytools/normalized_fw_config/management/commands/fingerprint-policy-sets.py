@@ -0,0 +1,71 @@
+#!/usr/local/bin/python
+"""
+Backfill the fingerprint column of PolicyAddrSet, PolicyZoneSet and PolicyServiceSet rows. Sets with identical
+members (which older imports created) are merged into the set with the lowest pk and the policies referencing the
+duplicates are pointed to it.
+"""
+
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When, Value
+
+from normalized_fw_config.models import *
+from normalized_fw_config.ingest import bulk_update, chunks, MAX_QUERY_PARAMS
+
+# Policy foreign keys referencing each set model
+POLICY_FIELDS = (
+    (PolicyAddrSet, ('source', 'destination')),
+    (PolicyZoneSet, ('srczone', 'dstzone')),
+    (PolicyServiceSet, ('services',)),
+)
+
+
+def set_members(model):
+    """
+    :return: {set pk: [set of member pks per relation]} for every set of the model
+    """
+    members = OrderedDict((pk, [set() for r in model.FINGERPRINT_RELATIONS])
+                          for pk in model.objects.order_by('pk').values_list('pk', flat=True))
+    for i, relation in enumerate(model.FINGERPRINT_RELATIONS):
+        field = model._meta.get_field(relation)
+        through, src, tgt = field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+        for setpk, memberpk in through.objects.values_list(src + '_id', tgt + '_id').iterator():
+            members[setpk][i].add(memberpk)
+    return members
+
+
+def fingerprint_sets(model, policyfields):
+    """
+    :return: (number of fingerprinted sets, number of merged duplicates)
+    """
+    canonical = OrderedDict()
+    duplicates = {}
+    for setpk, members in set_members(model).items():
+        fingerprint = set_fingerprint(members)
+        if fingerprint in canonical:
+            duplicates[setpk] = canonical[fingerprint]
+        else:
+            canonical[fingerprint] = setpk
+    # Point the policies at the surviving sets before the duplicates are deleted
+    for batch in chunks(list(duplicates), MAX_QUERY_PARAMS // 3):
+        for fieldname in policyfields:
+            field = Policy._meta.get_field(fieldname)
+            whens = [When(**{fieldname: setpk, 'then': Value(duplicates[setpk])}) for setpk in batch]
+            Policy.objects.filter(**{fieldname + '__in': batch}).update(
+                **{fieldname: Case(*whens, output_field=field)})
+        model.objects.filter(pk__in=batch).delete()
+    model.objects.update(fingerprint=None)
+    bulk_update(model, [(pk, {'fingerprint': fp}) for fp, pk in canonical.items()], ['fingerprint'])
+    return len(canonical), len(duplicates)
+
+
+class Command(BaseCommand):
+    help = 'Compute the fingerprints of existing policy sets and merge duplicate sets'
+
+    def handle(self, *args, **options):
+        for model, policyfields in POLICY_FIELDS:
+            with transaction.atomic():
+                count, merged = fingerprint_sets(model, policyfields)
+            print("%s: %d sets fingerprinted, %d duplicates merged" % (model.__name__, count, merged))
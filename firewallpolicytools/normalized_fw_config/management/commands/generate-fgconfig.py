@@ -0,0 +1,53 @@
+#!/usr/local/bin/python
+"""
+Write a synthetic FortiGate configuration, e.g. for benchmarks of the import and export commands.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.synthetic import DENY_RATIO, generate_config
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic Fortigate configuration file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', metavar='<config-file>',
+                            help='Output file',
+                            required=True
+                            )
+
+        parser.add_argument('--policies', metavar='N', type=int,
+                            help='Number of policies per VDOM (objects are scaled accordingly, default: 1000)',
+                            default=1000
+                            )
+
+        parser.add_argument('--vdoms', metavar='N', type=int,
+                            help='Number of VDOMs (default: 1)',
+                            default=1
+                            )
+
+        parser.add_argument('--seed', type=int,
+                            help='Seed of the random generator (default: 0)',
+                            default=0
+                            )
+
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Hostname of the device (default: FGT-SYNTH-<policies>)',
+                            default=None
+                            )
+
+        parser.add_argument('--deny-ratio', metavar='R', type=float,
+                            help='Share of deny policies (default: %s)' % DENY_RATIO,
+                            default=DENY_RATIO
+                            )
+
+    def handle(self, *args, **options):
+        if options['policies'] < 1 or options['vdoms'] < 1:
+            raise CommandError("--policies and --vdoms must be at least 1")
+        with open(options['o'], 'w') as fh:
+            counts = generate_config(fh, options['policies'], vdoms=options['vdoms'], seed=options['seed'],
+                                     hostname=options['hostname'], deny_ratio=options['deny_ratio'])
+        print("Configuration written to %s" % options['o'])
+        for section, count in counts.items():
+            print("%-25s %8d" % (section, count))
@@ -0,0 +1,52 @@
+#!/usr/local/bin/python
+"""
+Store the routing table of a device for the ASA export (create-asa-config --db-routes).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from normalized_fw_config.models import *
+from normalized_fw_config.routing import read_routes
+
+
+class Command(BaseCommand):
+    help = 'Replace the routing table of a device with the routes of a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-f', metavar='<routes-file>',
+                            help="Routes, one per line: 'route <interface> <network> <netmask> <gateway>' or "
+                                 "'<network>/<prefixlen> <gateway> <interface>'",
+                            required=True
+                            )
+
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Hostname of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='vsys/vdom/context of the device',
+                            required=True
+                            )
+
+    def handle(self, *args, **options):
+        try:
+            device = Device.objects.get(hostname=options['hostname'], vsys=options['vsys'])
+        except Device.DoesNotExist:
+            raise CommandError("Device %s [%s] does not exist" % (options['hostname'], options['vsys']))
+        try:
+            with open(options['f']) as fh:
+                routes = read_routes(fh)
+        except ValueError as e:
+            raise CommandError("%s: %s" % (options['f'], e))
+
+        rows = []
+        for network, gateway, interface in routes:
+            ip, prefixlen = network.split('/')
+            rows.append(Route(network=ip, prefixlen=int(prefixlen), gateway=gateway, interface=interface,
+                              device=device))
+        with transaction.atomic():
+            Route.objects.filter(device=device).delete()
+            Route.objects.bulk_create(rows, batch_size=500)
+        print("%d routes stored for %s" % (len(routes), device))
@@ -0,0 +1,91 @@
+#!/usr/local/bin/python
+"""
+Show which policy of a device handles a packet, like 'from 10.1.1.1 to 10.2.2.2 on tcp/443'. The policies are
+compiled into a normalized_fw_config.policymatch.PolicyMatcher, which is cached until the configuration changes.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.models import *
+from normalized_fw_config.policymatch import MatcherCache, compiled_matcher
+
+
+def policy_label(policy):
+    if policy['name']:
+        return 'Policy %d (%s): %s' % (policy['policyid'], policy['name'], policy['action'])
+    return 'Policy %d: %s' % (policy['policyid'], policy['action'])
+
+
+class Command(BaseCommand):
+    help = 'Find the policy matching a source, destination, protocol and port'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Source IP address')
+
+        parser.add_argument('destination', help='Destination IP address')
+
+        parser.add_argument('protocol', help="Protocol name or number, e.g. 'tcp' or 6")
+
+        parser.add_argument('port', type=int, nargs='?',
+                            help='Destination port, ICMP type for ICMP (default: 0)',
+                            default=0
+                            )
+
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Hostname of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='vsys/vdom/context of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--srcintf', metavar='<interface-or-zone>',
+                            help='Ingress interface or zone (default: any)',
+                            default=None
+                            )
+
+        parser.add_argument('--dstintf', metavar='<interface-or-zone>',
+                            help='Egress interface or zone (default: any)',
+                            default=None
+                            )
+
+        parser.add_argument('--all', action='store_true',
+                            help='List all matching policies in sequence order, not only the first',
+                            default=False
+                            )
+
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Do not read or write compiled matchers on disk',
+                            default=False
+                            )
+
+    def handle(self, *args, **options):
+        try:
+            device = Device.objects.get(hostname=options['hostname'], vsys=options['vsys'])
+        except Device.DoesNotExist:
+            raise CommandError("Device %s [%s] does not exist" % (options['hostname'], options['vsys']))
+
+        start = time.time()
+        matcher, fromcache = compiled_matcher(device, None if options['no_cache'] else MatcherCache())
+        print("%d policies %s in %.2fs" % (len(matcher.policies), 'read from the cache' if fromcache else 'compiled',
+                                          time.time() - start))
+
+        packet = (options['source'], options['destination'], options['protocol'], options['port'])
+        zones = {'srczone': options['srcintf'], 'dstzone': options['dstintf']}
+        start = time.time()
+        try:
+            policies = matcher.matches(*packet, **zones) if options['all'] else [matcher.lookup(*packet, **zones)]
+        except ValueError as e:
+            raise CommandError(e)
+        elapsed = time.time() - start
+
+        policies = [p for p in policies if p is not None]
+        for policy in policies:
+            print(policy_label(policy))
+        if not policies:
+            print("No policy matches, the implicit deny applies")
+        print("Lookup took %.1f us" % (elapsed * 1e6))
@@ -0,0 +1,122 @@
+#!/usr/local/bin/python
+"""
+Import a directory of FortiGate configuration files. The files are parsed in a pool of worker processes while this
+process imports them one after another, in file name order, with the parsefgconfig import.
+"""
+
+import contextlib
+import io
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.batch import expand_paths, parse_files
+from normalized_fw_config.blobstore import CODECS, DEFAULT_CODEC
+from normalized_fw_config.ingest import enable_import_pragmas
+from normalized_fw_config.management.commands.parsefgconfig import Command as ImportCommand
+
+
+class Command(BaseCommand):
+    help = 'Import many Fortigate configuration files, parsing them in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='<path>',
+                            help='configuration file, directory or glob pattern')
+
+        parser.add_argument('--workers', metavar='N', type=int,
+                            help='Parse the files in N worker processes (default: number of CPUs)',
+                            default=os.cpu_count() or 1
+                            )
+
+        parser.add_argument('-d', metavar='y|n',
+                            help='Dry Run (validate the configurations in memory without accessing the database)',
+                            default='n'
+                            )
+
+        parser.add_argument('--fast', action='store_true',
+                            help='Import each VDOM in a single transaction with SQLite tuned for bulk writes',
+                            default=False
+                            )
+
+        parser.add_argument('--bulk', action='store_true',
+                            help='Bulk ingest mode (preload existing objects and write in batches)',
+                            default=False
+                            )
+
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only write objects which changed since the previous import (implies --bulk)',
+                            default=False
+                            )
+
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Do not use the cache of parsed configurations',
+                            default=False
+                            )
+
+        parser.add_argument('--compression', choices=sorted(CODECS),
+                            help='Compression of the stored raw configurations (default: %s)' % DEFAULT_CODEC,
+                            default=DEFAULT_CODEC
+                            )
+
+    def import_options(self, path, options):
+        """
+        Options for the parsefgconfig import of one file
+        """
+        args = ['-f', path, '-d', options['d'], '--compression', options['compression']]
+        for flag in ('fast', 'bulk', 'incremental'):
+            if options[flag]:
+                args.append('--' + flag)
+        importer = ImportCommand()
+        return importer, vars(importer.create_parser('manage.py', 'parsefgconfig').parse_args(args))
+
+    def handle(self, *args, **options):
+        paths = expand_paths(options['paths'])
+        if not paths:
+            raise CommandError("No configuration files found")
+        workers = max(1, min(options['workers'], len(paths)))
+        print("Importing %d files with %d parser processes" % (len(paths), workers))
+        if options['fast']:
+            enable_import_pragmas()
+
+        start = time.time()
+        results = []
+        totalobjects = 0
+        for i, (path, future) in enumerate(parse_files(paths, workers, not options['no_cache']), 1):
+            output = io.StringIO()
+            objects = 0
+            parseseconds = importseconds = 0.0
+            try:
+                configdict, configtime, cached, objects, parseseconds = future.result()
+                importstart = time.time()
+                importer, importoptions = self.import_options(path, options)
+                # The output of each import is only shown when it fails, or with --verbosity 2
+                with contextlib.redirect_stdout(output):
+                    try:
+                        importer.import_config(path, configtime, configdict, cached, importoptions)
+                    finally:
+                        importseconds = time.time() - importstart
+                status, error = 'ok', ''
+                totalobjects += objects
+            except Exception as e:
+                status, error = 'FAILED', str(e) or e.__class__.__name__
+            results.append((path, status, objects, parseseconds, importseconds, error))
+            if options['verbosity'] > 1 or status != 'ok':
+                print(output.getvalue(), end='')
+            elapsed = time.time() - start
+            print("[%d/%d] %s %s: %d objects, %.2f files/s, %.0f objects/s" % (
+                i, len(paths), status, path, objects, i / elapsed, totalobjects / elapsed))
+
+        self.print_results(results, time.time() - start)
+        failed = [r[0] for r in results if r[1] != 'ok']
+        if failed:
+            raise CommandError("%d of %d files failed to import" % (len(failed), len(paths)))
+
+    def print_results(self, results, seconds):
+        width = max(len('File'), max(len(r[0]) for r in results))
+        print("\n%-*s  %-6s  %8s  %7s  %7s  %s" % (width, 'File', 'Status', 'Objects', 'Parse', 'Import', 'Error'))
+        for path, status, objects, parseseconds, importseconds, error in results:
+            print("%-*s  %-6s  %8d  %6.2fs  %6.2fs  %s" % (width, path, status, objects, parseseconds,
+                                                           importseconds, error))
+        succeeded = len([r for r in results if r[1] == 'ok'])
+        print("\n%d files imported, %d failed in %.2fs" % (succeeded, len(results) - succeeded, seconds))
@@ -12,12 +12,22 @@ import datetime
 import ipaddress
 import ntpath
 import json
+import time
 from itertools import chain
-from firewallpolicytools import settings
-from django.db.models import Count
+from django.conf import settings
+from django.db import transaction
 
 from django.core.management.base import BaseCommand, CommandError
 from normalized_fw_config.models import *
+from normalized_fw_config.blobstore import BlobStore, CODECS, DEFAULT_CODEC
+from normalized_fw_config.fgtparser import find_hostname, value_list
+from normalized_fw_config.incremental import compute_digests, config_digest, diff_digests, filter_staged, \
+    delete_removed
+from normalized_fw_config.ingest import normalize_addressobj, decompose_service, stage_vdom, stage_vdoms, \
+    vdom_sections, enable_import_pragmas, validate_staged, staged_summary, BulkIngest
+from normalized_fw_config.parsecache import ParseCache, load_config
+from normalized_fw_config.profiling import PhaseProfiler
+from normalized_fw_config.resolver import ObjectResolver
 pp = pprint.PrettyPrinter(indent=2)
 
 def pprintobj(objname, obj):
@@ -30,46 +40,15 @@ def populate_addressobjs(dev, addressobjdict, options):
     """
     for objname in addressobjdict.keys():
         addressobj, created = AddressObject.objects.get_or_create(name=objname, device=dev)
-        obj = addressobjdict[objname]
-        addressobj.name = objname
-        addressobj.device = dev
         # Check type and create correct AddressObject
-        if 'type' in obj:
-            if obj['type'] == 'fqdn':
-                addressobj.type = 'fqdn'
-                addressobj.fqdn = obj['fqdn']
-            if obj['type'] == 'iprange':
-                addressobj.type = 'range4'
-                addressobj.start_ip = obj['start-ip']
-                addressobj.end_ip = obj['end-ip']
-        elif 'subnet' in obj:
-            addressobj.start_ip, netmask = obj['subnet'].split(' ')
-            prefixlen = ipaddress.IPv4Network('0.0.0.0/%s' % netmask).prefixlen
-            if prefixlen == 32:
-                addressobj.type = 'ip4'
-            else:
-                addressobj.type = 'net4'
-                addressobj.prefixlen = prefixlen
-        if 'description' in obj:
-            addressobj.description = obj['description']
-        # Handle the special case "all" object
-        if objname == 'all':
-            addressobj.type = 'net4'
-            addressobj.start_ip = '0.0.0.0'
-            addressobj.prefixlen = 0
-            if options['d'] == 'n':
-                addressobj.save()
-            else:
-                print("Object not saved")
-                addressobj.delete()
-        elif addressobj.start_ip or addressobj.fqdn:
-            if options['d'] == 'n':
-                addressobj.save()
-            else:
-                print("Object not saved")
-                addressobj.delete()
-
-def populate_addrgrpobjects(dev, addrgrpdict, options):
+        fields = normalize_addressobj(objname, addressobjdict[objname])
+        if fields is not None:
+            for field, value in fields.items():
+                setattr(addressobj, field, value)
+            addressobj.save()
+
+def populate_addrgrpobjects(dev, addrgrpdict, options, resolver=None):
+    resolver = resolver or ObjectResolver(dev)
     for objname in addrgrpdict.keys():
         """
         Create the Address Group Objects
@@ -78,19 +57,15 @@ def populate_addrgrpobjects(dev, addrgrpdict, options):
         obj = addrgrpdict[objname]
         addrgrpobject.name = objname
         addrgrpobject.device = dev
-        members = obj['member'].split(" ")
-        for m in members:
-            m = m.strip('"')
-            try:
-                addrobj = AddressObject.objects.get(name=m, device=dev)
-                addrgrpobject.members.add(addrobj)
-            except:
-                raise
-        if options['d'] == 'n':
-            addrgrpobject.save()
-        else:
-            print("Object not saved")
-            addrgrpobject.delete()
+        members = []
+        for m in value_list(obj['member']):
+            model, addrobj = resolver.resolve(m, (AddressObject,))
+            if addrobj is None:
+                raise AddressObject.DoesNotExist("AddressObject '%s' (member of '%s') does not exist on %s" % (
+                    m, objname, dev))
+            members.append(addrobj)
+        addrgrpobject.members.add(*members)
+        addrgrpobject.save()
 
 def populate_serviceobjects(dev, serviceobjdict, options):
     """
@@ -101,102 +76,24 @@ def populate_serviceobjects(dev, serviceobjdict, options):
     """
     for objname in serviceobjdict.keys():
         obj = serviceobjdict[objname]
-        objkeys = list(obj.keys())
 
         try:
             #Make compund service object if there are multiple portranges in the service
             compserv, created = CompoundServiceObject.objects.get_or_create(name=objname, device=dev)
-            if 'comment' in obj.keys():
-                compserv.description = obj['comment']
-            for k in objkeys:
-                # Handle TCP and UDP Services
-                if k == 'tcp-portrange' or k == 'udp-portrange':
-                    #Format of objects created for compound service groups is
-                    # proto-dstportlow<-dstporthigh-src-portlow-srcporthigh>
-                    ranges = (obj[k].split(' '))
-                    for range in ranges:
-                        portrangename = k[0:3] + '-'
-                        srcrange = None
-                        dstrange = None
-                        dstlow = None
-                        dsthigh = None
-                        srclow = None
-                        srchigh = None
-                        if ':' in range:
-                            dstrange, srcrange = range.split(':')
-                            if dstrange != None:
-                                if '-' in dstrange:
-                                    dstlow,dsthigh = dstrange.split('-')
-                                    dstlow = int(dstlow)
-                                    dsthigh = int(dsthigh)
-                                else:
-                                    dstlow = int(dstrange)
-                            if srcrange != None:
-                                if '-' in srcrange:
-                                    srclow,srchigh = srcrange.split('-')
-                                    srclow = int(srclow)
-                                    srchigh = int(srchigh)
-                                else:
-                                    srclow = int(srcrange)
-                        elif '-' in range:
-                            dstlow, dsthigh = range.split('-')
-                            dstlow = int(dstlow)
-                            dsthigh = int(dsthigh)
-                        else:
-                            dstlow = int(range)
-                        portrangename += str(dstlow)
-                        if dsthigh:
-                            portrangename +='-'+str(dsthigh)
-                        if srclow:
-                            portrangename += ':' + str(srclow)
-                        if srchigh:
-                            portrangename += '-' + str(srchigh)
-                        serviceobj, created = ServiceObject.objects.get_or_create(name=portrangename, device=dev)
-                        serviceobj.device = dev
-                        serviceobj.name = portrangename
-                        if k[0:3] == 'tcp':
-                            serviceobj.protocol = 6
-                        elif k[0:3] == 'udp':
-                            serviceobj.protocol = 17
-                        serviceobj.start_port = dstlow
-                        serviceobj.end_port = dsthigh
-                        serviceobj.src_start_port = srclow
-                        serviceobj.src_start_port = srchigh
-                        compserv.members.add(serviceobj)
-                        if options['d'] == 'n':
-                            serviceobj.save()
-                        else:
-                            print("Object not saved")
-                            serviceobj.delete()
-                elif k == 'protocol' and obj[k] == 'ICMP':
-                    if 'unset' in obj.keys() and obj['unset'] == "icmptype":
-                        serviceobj, created = ServiceObject.objects.get_or_create(name="icmp", device=dev)
-                        serviceobj.start_port = 0
-                        serviceobj.end_port = 255
-                        serviceobj.save()
-                        compserv.members.add(serviceobj)
-                    elif 'icmptype' in obj.keys():
-                        serviceobj, created = ServiceObject.objects.get_or_create(name="icmp-"+obj['icmptype'], device=dev)
-                        serviceobj.start_port = obj['icmptype']
-                        serviceobj.save()
-                        compserv.members.add(serviceobj)
-                elif k == 'protocol' and obj[k] == 'IP':
-                    if 'protocol-number' in obj.keys():
-                        serviceobj, created = ServiceObject.objects.get_or_create(name="ip-proto-"+obj['protocol-number'], device=dev)
-                        serviceobj.protocol = int(obj['protocol-number'])
-                        serviceobj.save()
-                        compserv.members.add(serviceobj)
-            if options['d'] == 'n':
-                compserv.save()
-            else:
-                print("Object not saved")
-                compserv.delete()
+            for membername, fields in decompose_service(obj):
+                serviceobj, created = ServiceObject.objects.get_or_create(name=membername, device=dev)
+                for field, value in fields.items():
+                    setattr(serviceobj, field, value)
+                compserv.members.add(serviceobj)
+                serviceobj.save()
+            compserv.save()
         except:
             print("%s: " % objname)
             print(str(obj))
             raise
 
-def populate_servicegroupobjects(dev, servicegroupdict, options):
+def populate_servicegroupobjects(dev, servicegroupdict, options, resolver=None):
+    resolver = resolver or ObjectResolver(dev)
     for objname in servicegroupdict.keys():
         """
         Create the Address Group Objects
@@ -206,19 +103,15 @@ def populate_servicegroupobjects(dev, servicegroupdict, options):
         servicegroupobject.name = objname
         servicegroupobject.device = dev
         servicegroupobject.compoundservice = False
-        members = obj['member'].split(" ")
-        for m in members:
-            m = m.strip('"')
-            try:
-                servicegroup = CompoundServiceObject.objects.get(name=m, device=dev)
-                servicegroupobject.members.add(servicegroup)
-            except:
-                raise
-        if options['d'] == 'n':
-            servicegroupobject.save()
-        else:
-            print("Object not saved")
-            servicegroupobject.delete()
+        members = []
+        for m in value_list(obj['member']):
+            model, compserv = resolver.resolve(m, (CompoundServiceObject,))
+            if compserv is None:
+                raise CompoundServiceObject.DoesNotExist(
+                    "CompoundServiceObject '%s' (member of '%s') does not exist on %s" % (m, objname, dev))
+            members.append(compserv)
+        servicegroupobject.members.add(*members)
+        servicegroupobject.save()
 
 def populate_zoneobjects(dev, zoneobjdict, options):
     """
@@ -249,166 +142,91 @@ def populate_interfaces(dev, interfacedict, options):
             interfaceobj.device = dev
             interfaceobj.save()
 
-def populate_policies(dev, policydict, options):
+def get_policyset(model, *memberlists, policysets=None):
+    """
+    Return the policy set with exactly these members (found by its fingerprint), creating it if required
+
+    :param model: PolicyAddrSet, PolicyZoneSet or PolicyServiceSet
+    :param memberlists: one list of member objects per relation in the model's FINGERPRINT_RELATIONS
+    :param policysets: optional {(model, fingerprint): set} cache shared by the calls of one import
+    :return: the set, or None when there are no members at all
+    """
+    if not any(memberlists):
+        return None
+    fingerprint = set_fingerprint([[m.pk for m in members] for members in memberlists])
+    if policysets is not None and (model, fingerprint) in policysets:
+        return policysets[(model, fingerprint)]
+    policyset = model.objects.filter(fingerprint=fingerprint).first()
+    if policyset is None:
+        policyset = model.objects.create(fingerprint=fingerprint)
+        for relation, members in zip(model.FINGERPRINT_RELATIONS, memberlists):
+            getattr(policyset, relation).add(*members)
+    if policysets is not None:
+        policysets[(model, fingerprint)] = policyset
+    return policyset
+
+def populate_policies(dev, policydict, options, resolver=None):
     """
     Create the Policy objects
 
+    Member names are resolved through the resolver, names which match no object are recorded in its report.
+
     :param dev:
     :param policydict:
     :param options:
+    :param resolver: ObjectResolver of the import, created if not given
     :return:
     """
+    resolver = resolver or ObjectResolver(dev)
+    policies = dict((p.policyid, p) for p in Policy.objects.filter(device=dev))
+    policysets = {}
     sequence = 0
     for objid in policydict.keys():
         sequence += 1
         obj = policydict[objid]
-        policyobj, created = Policy.objects.get_or_create(policyid=objid, device=dev)
-        policyobj.policyid = int(objid)
-        policyobj.device = dev
+        policyobj = policies.get(int(objid))
+        if policyobj is None:
+            policyobj = Policy(policyid=int(objid), device=dev)
         policyobj.sequence = sequence
-        # Build the source AddressSet
+        context = 'policy %s %%s' % objid
         for key in obj:
-            if '" "' in obj[key]:
-                obj[key] = (obj[key]).split('" "')
-            else:
-                obj[key] = [obj[key]]
-            if key == 'srcaddr' or key=='dstaddr':
-                addrlist = []
-                addrgrplist = []
-                for i in obj[key]:
-                    try:
-                        ao = AddressObject.objects.get(name=i, device=dev)
-                        addrlist.append(ao)
-                    except:
-                        try:
-                            ago = AddressGroup.objects.get(name=i, device=dev)
-                            addrgrplist.append(ago)
-                        except:
-                            pass
-                try:
-                    paddrsetqs = PolicyAddrSet.objects.annotate(addrcount=Count('addresses'),
-                        addrgrpcount=Count('addressgroups')).filter(addrcount=len(addrlist),
-                                                                    addrgrpcount=len(addrgrplist))
-                    if len(paddrsetqs) > 0:
-                        for ao in addrlist:
-                            paddrsetqs = paddrsetqs.filter(addresses=ao)
-                        for ago in addrgrplist:
-                            paddrsetqs = paddrsetqs.filter(addressgroups=ago)
-                    if len(paddrsetqs) == 1:
-                        paddrset = paddrsetqs[0]
-                    else:
-                        paddrset = PolicyAddrSet()
-                        paddrset.save()
-                        for ao in addrlist:
-                            paddrset.addresses.add(ao)
-                        for ago in addrgrplist:
-                            paddrset.addressgroups.add(ago)
-                        paddrset.save()
-                except:
-                    raise
-                if len(paddrset.addresses.all()) + len(paddrset.addressgroups.all()) > 0:
-                    paddrset.save()
+            obj[key] = value_list(obj[key])
+            if key == 'srcaddr' or key == 'dstaddr':
+                found = resolver.resolve_all(obj[key], (AddressObject, AddressGroup), context % key)
+                paddrset = get_policyset(PolicyAddrSet, *found.values(), policysets=policysets)
+                if paddrset is not None:
                     if key == 'srcaddr':
-                        srcpaddrset = paddrset
-                        policyobj.source = srcpaddrset
-                    elif key == 'dstaddr':
-                        dstpaddrset = paddrset
-                        policyobj.destination = dstpaddrset
-
-            elif key == 'srcintf' or key=='dstintf':
-                intflist = []
-                zonelist = []
-                for i in obj[key]:
-                    try:
-                        intf = Interface.objects.get(name=i, device=dev)
-                        intflist.append(intf)
-                    except:
-                        try:
-                            zone = ZoneObject.objects.get(name=i, device=dev)
-                            zonelist.append(zone)
-                        except:
-                            pass
-                try:
-                    pzonesetqs = PolicyZoneSet.objects.annotate(intfcount=Count('interfaces'),
-                                                                zonecount=Count('zones')).filter(
-                        intfcount=len(intflist),
-                        zonecount=len(zonelist))
-                    if len(pzonesetqs) > 0:
-                        for intf in intflist:
-                            pzonesetqs = pzonesetqs.filter(interfaces=intf)
-                        for zone in zonelist:
-                            pzonesetqs = pzonesetqs.filter(zones=zone)
-                    if len(pzonesetqs) == 1:
-                        pzoneset = pzonesetqs[0]
+                        policyobj.source = paddrset
                     else:
-                        pzoneset = PolicyZoneSet()
-                        pzoneset.save()
-                        for intf in intflist:
-                            pzoneset.interfaces.add(intf)
-                        for zone in zonelist:
-                            pzoneset.zones.add(zone)
-                        pzoneset.save()
-                except:
-                    raise
-                if len(pzoneset.zones.all()) + len(pzoneset.interfaces.all()) > 0:
-                    pzoneset.save()
+                        policyobj.destination = paddrset
+
+            elif key == 'srcintf' or key == 'dstintf':
+                found = resolver.resolve_all(obj[key], (Interface, ZoneObject), context % key)
+                pzoneset = get_policyset(PolicyZoneSet, found[ZoneObject], found[Interface], policysets=policysets)
+                if pzoneset is not None:
                     if key == 'srcintf':
-                        srcpzoneset = pzoneset
-                        policyobj.srczone = srcpzoneset
-                    elif key == 'dstintf':
-                        dstpzoneset = pzoneset
-                        policyobj.dstzone = dstpzoneset
+                        policyobj.srczone = pzoneset
+                    else:
+                        policyobj.dstzone = pzoneset
 
             elif key == 'service':
-                compoundservicelist = []
-                servicegrplist = []
-                for i in obj[key]:
-                    try:
-                        so = CompoundServiceObject.objects.get(name=i, device=dev)
-                        compoundservicelist.append(so)
-                    except:
-                        try:
-                            sgo = ServiceGroup.objects.get(name=i, device=dev)
-                            servicegrplist.append(sgo)
-                        except:
-                            pass
-                try:
-                    pservicesetqs = PolicyServiceSet.objects.annotate(servicecount=Count('compoundservices'),
-                        servicegrpcount=Count('servicegroups')).filter(servicecount=len(compoundservicelist),
-                                                                    servicegrpcount=len(servicegrplist))
-                    if len(pservicesetqs) > 0:
-                        for so in compoundservicelist:
-                            pservicesetqs = pservicesetqs.filter(compoundservices=so)
-                        for sgo in servicegrplist:
-                            pservicesetqs = pservicesetqs.filter(servicegroups=sgo)
-                    if len(pservicesetqs) == 1:
-                        pserviceset = pservicesetqs[0]
-                    else:
-                        pserviceset = PolicyServiceSet()
-                        pserviceset.save()
-                        for so in compoundservicelist:
-                            pserviceset.compoundservices.add(so)
-                        for sgo in servicegrplist:
-                            pserviceset.servicegroups.add(sgo)
-                        pserviceset.save()
-                except:
-                    raise
-                if len(pserviceset.compoundservices.all()) + len(pserviceset.servicegroups.all()) > 0:
-                    pserviceset.save()
+                found = resolver.resolve_all(obj[key], (CompoundServiceObject, ServiceGroup), context % key)
+                pserviceset = get_policyset(PolicyServiceSet, [], *found.values(), policysets=policysets)
+                if pserviceset is not None:
                     policyobj.services = pserviceset
 
-            policyobj.device = dev
-            # FG policies write 'permit' as 'accept'
-            if obj['action'] == ['accept'] or obj['action'] == 'accept':
-                policyobj.action = 'permit'
-            else:
-                policyobj.action = 'deny'
-                print(obj)
-                input()
-            policyobj.save()
+        # FG policies write 'permit' as 'accept'
+        if obj.get('action') == ['accept']:
+            policyobj.action = 'permit'
+        else:
+            policyobj.action = 'deny'
+        policyobj.save()
 
 class Command(BaseCommand):
     help = 'Process Fortigate configuration and populate Normalized Model Objects'
+    # Replaced by handle(), import_config() may also be called directly (parsefgconfig-batch)
+    profiler = PhaseProfiler(enabled=False)
+
     def add_arguments(self, parser):
         parser.add_argument('-f', action='store',
                             metavar='<configuration-file>',
@@ -416,11 +234,57 @@ class Command(BaseCommand):
                             required=True)
 
         parser.add_argument('-d', metavar='y|n',
-                            help='Dry Run (Don\'t alter database)',
+                            help='Dry Run (validate the configuration in memory without accessing the database)',
                             required=False,
                             default='n'
                             )
 
+        parser.add_argument('--fast', action='store_true',
+                            help='Import each VDOM in a single transaction with SQLite tuned for bulk writes',
+                            default=False
+                            )
+
+        parser.add_argument('--bulk', action='store_true',
+                            help='Bulk ingest mode (preload existing objects and write in batches)',
+                            default=False
+                            )
+
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only write objects which changed since the previous import (implies --bulk)',
+                            default=False
+                            )
+
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Parse the file even if its parsed tree is cached, and do not cache it',
+                            default=False
+                            )
+
+        parser.add_argument('--purge-cache', action='store_true',
+                            help='Remove all cached parsed configurations before parsing',
+                            default=False
+                            )
+
+        parser.add_argument('--profile', action='store_true',
+                            help='Print wall time, CPU time, SQL queries and peak memory of every import phase',
+                            default=False
+                            )
+
+        parser.add_argument('--profile-json', metavar='<report-file>',
+                            help='Write the profile to a JSON file (implies --profile)',
+                            default=None
+                            )
+
+        parser.add_argument('--compression', choices=sorted(CODECS),
+                            help='Compression of the stored raw configuration (default: %s)' % DEFAULT_CODEC,
+                            default=DEFAULT_CODEC
+                            )
+
+        parser.add_argument('--workers', metavar='N', type=int,
+                            help='Normalize VDOMs in N worker processes (implies --bulk)',
+                            required=False,
+                            default=1
+                            )
+
     def init_discovery(self,
                        device,
                        options,
@@ -432,86 +296,241 @@ class Command(BaseCommand):
                        interfacedict,
                        policydict):
 
-        populate_addressobjs(device, addressobjdict, options)
-        populate_addrgrpobjects(device, addrgrpdict, options)
-        populate_serviceobjects(device, serviceobjdict, options)
-        populate_servicegroupobjects(device, servicegroupdict, options)
-        populate_zoneobjects(device, zoneobjdict, options)
-        populate_interfaces(device, interfacedict, options)
-        populate_policies(device, policydict, options)
+        if options.get('bulk'):
+            with self.profiler.phase('stage'):
+                staged = stage_vdom(device.vsys, addressobjdict, addrgrpdict, serviceobjdict, servicegroupdict,
+                                    zoneobjdict, interfacedict, policydict)
+            self.write_staged(device, staged, options)
+            return
+
+        # The objects of a model are loaded into the resolver when they are first referenced, after they were written
+        resolver = ObjectResolver(device)
+        with self.profiler.phase('populate_addressobjs'):
+            populate_addressobjs(device, addressobjdict, options)
+        with self.profiler.phase('populate_addrgrpobjects'):
+            populate_addrgrpobjects(device, addrgrpdict, options, resolver)
+        with self.profiler.phase('populate_serviceobjects'):
+            populate_serviceobjects(device, serviceobjdict, options)
+        with self.profiler.phase('populate_servicegroupobjects'):
+            populate_servicegroupobjects(device, servicegroupdict, options, resolver)
+        with self.profiler.phase('populate_zoneobjects'):
+            populate_zoneobjects(device, zoneobjdict, options)
+        with self.profiler.phase('populate_interfaces'):
+            populate_interfaces(device, interfacedict, options)
+        with self.profiler.phase('populate_policies'):
+            populate_policies(device, policydict, options, resolver)
+        for line in resolver.report():
+            print(line)
+
+    def get_rawconfig(self):
+        """
+        Create the RawConfig Object on first use
+        """
+        if self.rawconfig is None:
+            self.rawconfig, rawconfigcreated = RawConfigFile.objects.get_or_create(
+                name=ntpath.basename(self.configfile),
+                import_date=datetime.datetime.fromtimestamp(self.configtime))
+            self.rawconfig.name = ntpath.basename(self.configfile)
+            self.rawconfig.import_date = datetime.datetime.fromtimestamp(self.configtime)
+        return self.rawconfig
+
+    def write_staged(self, device, staged, options, **ingestoptions):
+        ingest = BulkIngest(device, **ingestoptions)
+        with self.profiler.phase('write'):
+            stats = ingest.apply(staged)
+        for (action, model), count in sorted(stats.items()):
+            print("%s %s: %d" % (model, action, count))
+        for line in ingest.resolver.report():
+            print(line)
+
+    def get_device(self, hostname, vdom, options):
+        device, devicecreated = Device.objects.get_or_create(hostname=hostname, vsys=vdom)
+        device.devtype = 'fgt52'
+        device.hostname = hostname
+        device.save()
+        return device
+
+    def import_vdom(self, hostname, vdom, sections, options):
+        """
+        Create or update the Device for a VDOM and populate its objects
+
+        :param sections: the parsed configuration sections of the VDOM as returned by vdom_sections()
+        """
+        if options['incremental']:
+            self.import_vdom_incremental(hostname, vdom, sections, options)
+            return
+        # Digests are computed before the populate_* functions convert values in place
+        with self.profiler.phase('digests'):
+            digests = compute_digests(vdom, sections)
+        device = self.get_device(hostname, vdom, options)
+        self.init_discovery(device, options, *sections)
+        self.record_version(device, digests)
+
+    def import_vdom_incremental(self, hostname, vdom, sections, options):
+        """
+        Write only the objects of a VDOM which were added, modified or removed since the current ConfigVersion of its
+        Device, and record the new object digests in a new ConfigVersion
+        """
+        with self.profiler.phase('digests'):
+            digests = compute_digests(vdom, sections)
+            digest = config_digest(digests)
+        device = self.get_device(hostname, vdom, options)
+        previous = ConfigVersion.objects.filter(device=device, current_active=True).order_by('-pk').first()
+        # Without object digests (no previous import, or a version left over from an older import) all objects are
+        # written
+        if previous is not None and previous.objectdigests:
+            if previous.digest == digest:
+                print("\nVDOM %s unchanged since configuration version %d" % (vdom, previous.pk))
+                return
+            changes = diff_digests(json.loads(previous.objectdigests), digests)
+        else:
+            changes = diff_digests({}, digests)
+        for section, change in changes.items():
+            if change:
+                print("%s: %d added, %d modified, %d removed" % (section, len(change.added), len(change.modified),
+                                                                 len(change.removed)))
+        with self.profiler.phase('stage'):
+            staged = filter_staged(stage_vdom(vdom, *sections), changes)
+        with transaction.atomic():
+            version = self.record_version(device, digests)
+            deleted = delete_removed(device, changes)
+            if deleted:
+                print("Objects deleted: %d" % deleted)
+            self.write_staged(device, staged, options, configversion=version, replace=True)
+
+    def record_version(self, device, digests):
+        """
+        Record the digests of an import in a new ConfigVersion, which becomes the current active version of the
+        device. Every import records one, so the next incremental import compares against what is in the database.
+        """
+        version = ConfigVersion.objects.create(device=device, current_active=True, rawfile=self.get_rawconfig(),
+                                               digest=config_digest(digests), objectdigests=json.dumps(digests))
+        # Object digests are only needed for the next import, older versions keep the overall digest
+        ConfigVersion.objects.filter(device=device, current_active=True).exclude(pk=version.pk).update(
+            current_active=False, objectdigests='')
+        return version
+
+    def import_vdoms_parallel(self, hostname, vdoms, interfacedict, options):
+        """
+        Normalize the VDOMs in a pool of worker processes, this process writes each staged VDOM (in its own
+        transaction) as soon as it is ready.
+
+        :return: list of VDOMs which failed to import
+        """
+        failedvdoms = []
+        vdomsections = [(vdom, vdom_sections(vdomconfig, interfacedict)) for vdom, vdomconfig in vdoms]
+        sections = dict(vdomsections)
+        for vdom, future in stage_vdoms(vdomsections, options['workers']):
+            try:
+                staged, stageseconds = future.result()
+                start = time.time()
+                with transaction.atomic():
+                    device = self.get_device(hostname, vdom, options)
+                    self.write_staged(device, staged, options)
+                    self.record_version(device, compute_digests(vdom, sections[vdom]))
+                writeseconds = time.time() - start
+            except Exception as e:
+                print("\nImport of VDOM %s failed, changes rolled back: %s" % (vdom, e))
+                failedvdoms.append(vdom)
+                continue
+            self.print_statistics(vdom, sections[vdom])
+            print("VDOM %s: normalized in %.2fs, written in %.2fs" % (vdom, stageseconds, writeseconds))
+        return failedvdoms
+
+    def dry_run(self, vdoms, interfacedict):
+        """
+        Normalize and validate the VDOMs in memory and print what an import would write, without any database access
+        """
+        invalidvdoms = []
+        for vdom, vdomconfig in vdoms:
+            sections = vdom_sections(vdomconfig, interfacedict)
+            with self.profiler.phase('stage'):
+                staged = stage_vdom(vdom, *sections)
+            with self.profiler.phase('validate'):
+                missing, resolver = validate_staged(staged)
+            self.print_statistics(vdom, sections)
+            print("Would write:")
+            for model, count in staged_summary(staged):
+                print("  %s: %d" % (model, count))
+            for group, member in missing:
+                print("Missing member of group %s: %s" % (group, member))
+            for line in resolver.report():
+                print(line)
+            if missing:
+                invalidvdoms.append(vdom)
+        if invalidvdoms:
+            raise CommandError("Dry run found missing group members in VDOMs: %s" % ', '.join(invalidvdoms))
+
+    def print_statistics(self, vdom, sections):
+        addressobjdict, addrgrpdict, serviceobjdict, servicegroupdict, zoneobjdict, interfacedict, policydict = \
+            sections
+        print("\nStatistics for VDOM: %s" % vdom)
+        print("Total Address Objects: %d" % len(list(addressobjdict.keys())))
+        print("Total Address Group Objects: %d" % len(list(addrgrpdict.keys())))
+        print("Total Service Objects: %d" % len(list(serviceobjdict.keys())))
+        print("Total Policies: %d" % len(list(policydict.keys())))
 
     def handle(self, *args, **options):
+        self.profiler = PhaseProfiler(enabled=options['profile'] or bool(options['profile_json']))
+        # The outermost phase keeps memory tracing and query counting installed for the whole command
+        self.profiler.start('total')
+        try:
+            self.parse_and_import(options)
+        finally:
+            self.profiler.finish()
+            if self.profiler.enabled:
+                self.profiler.print_summary()
+                if options['profile_json']:
+                    self.profiler.write_json(options['profile_json'])
+
+    def parse_and_import(self, options):
         CONFIGFILE = options['f']
         print(("Parsing Configuration File: %s" % CONFIGFILE))
+        cache = None if options['no_cache'] else ParseCache()
+        if options['purge_cache']:
+            print("Parse cache entries removed: %d" % ParseCache().purge())
         try:
-            fullconfigstr = open(CONFIGFILE, 'r').read()
             configtime = os.path.getmtime(CONFIGFILE)
-        except:
+            # Convert the config to a dict, streaming it line by line from the file unless it was parsed before
+            with self.profiler.phase('parse'):
+                configdict, cached = load_config(CONFIGFILE, cache)
+        except (IOError, OSError):
             print(("Error reading config file: %s" % CONFIGFILE))
+            raise CommandError("Unable to read %s" % CONFIGFILE)
+        self.import_config(CONFIGFILE, configtime, configdict, cached, options)
 
-        fullconfiglines = fullconfigstr.splitlines()
-
-        # Create the RawConfig Object
-        rawconfig, rawconfigcreated = RawConfigFile.objects.get_or_create(name=ntpath.basename(CONFIGFILE),
-                                                            import_date = datetime.datetime.fromtimestamp(configtime))
-
+    def import_config(self, CONFIGFILE, configtime, configdict, cached, options):
+        """
+        Import a parsed configuration file
 
-        #configversion, configversioncreated = ConfigVersion.objects.get_or_create(rawfile=rawconfig)
-        rawconfig.configstr = fullconfigstr
-        rawconfig.name = ntpath.basename(CONFIGFILE)
-        rawconfig.import_date = datetime.datetime.fromtimestamp(configtime)
+        :param configdict: the tree returned by parse_config()
+        :param cached: True if the tree was read from the parse cache
+        """
+        self.configfile = CONFIGFILE
+        self.configtime = configtime
+        self.rawconfig = None
+        if options['incremental'] and options['workers'] > 1:
+            raise CommandError("--incremental can not be combined with --workers")
 
         # Get device and vdom information
-        globalconfig = fullconfiglines[fullconfiglines.index('config system global') + 1:]
-        globalconfig = globalconfig[:globalconfig.index('end')]
-
-        for line in globalconfig:
-            if line.strip() != 'next' and line.strip().startswith('set'):
-                key, val = re.match(r'^set (\S*) (.+)$', line.strip()).groups()
-                val = val.strip('"')
-                if key == 'hostname':
-                    hostname = val
-
-        configdict = {}
-        #Try to convert the config to a dict
-        elementstack = []
-        for line in fullconfiglines:
-            currentdict = configdict
-            for key in elementstack:
-                currentdict = currentdict[key]
-            arguments = line.split()
-            if arguments != []:
-                action = arguments.pop(0)
-                #python3: action, *arguments = line.split()
-                if action == 'config':
-                    header = ' '.join(arguments)
-                    if (header == 'vdom' and ('vdom' not in elementstack)) or (header != 'vdom'):
-                        if header not in currentdict:
-                            currentdict[header] = {}
-                        elementstack.append(header)
-                if action == 'edit':
-                    section = ' '.join(arguments).strip('"')
-                    if section not in currentdict:
-                        currentdict[section] = {}
-                    elementstack.append(section)
-                if action == 'set':
-                    name = arguments.pop(0)
-                    value = ' '.join(arguments).strip('"')
-                    currentdict[name] = value
-                if action == 'end' or action == 'next':
-                    elementstack.pop()
-
-        if settings.DEBUG:
+        hostname = find_hostname(configdict)
+        if hostname is None:
+            raise CommandError("No hostname found in 'config system global' of %s" % CONFIGFILE)
+
+        if cached:
+            print("Parsed configuration loaded from cache")
+        elif settings.DEBUG:
+            # The dump is only rewritten when the file was parsed
             configjson = open('config.json', 'w')
             configjson.write(json.dumps(configdict, sort_keys=True, indent=2, separators=(',', ': ')))
             configjson.close()
 
-        if 'system interface' in configdict['global']:
+        if 'system interface' in configdict.get('global', {}):
             interfacedict = configdict['global']['system interface']
             #print(json.dumps(interfacedict, sort_keys=True, indent=2, separators=(',', ': ')))
             #
         else:
-            interfacedict = {}
+            interfacedict = configdict.get('system interface', {})
 
         # Create one Device Object and ConfigSet for each VDOM
         if 'vdom' in configdict:
@@ -519,66 +538,48 @@ class Command(BaseCommand):
                 len(list(configdict['vdom'].keys())),
                 str(list(configdict['vdom'].keys())))
                   )
-            for vdom in configdict['vdom']:
-                device, devicecreated = Device.objects.get_or_create(hostname=hostname, vsys=vdom)
-                device.devtype = 'fgt52'
-                device.hostname = hostname
-                if options['d'] == 'n':
-                    device.save()
-                if 'firewall address' in configdict['vdom'][vdom]:
-                    addressobjdict = configdict['vdom'][vdom]['firewall address']
-                else:
-                    addressobjdict = {}
-
-                if 'firewall addrgrp' in configdict['vdom'][vdom]:
-                    addrgrpdict = configdict['vdom'][vdom]['firewall addrgrp']
-                else:
-                    addrgrpdict = {}
-
-                if 'firewall service custom' in configdict['vdom'][vdom]:
-                    serviceobjdict = configdict['vdom'][vdom]['firewall service custom']
-                else:
-                    serviceobjdict = {}
-
-                if 'firewall service group' in configdict['vdom'][vdom]:
-                    servicegroupdict = configdict['vdom'][vdom]['firewall service group']
-                else:
-                    servicegroupdict = {}
-
-                if 'firewall policy' in configdict['vdom'][vdom]:
-                    policydict = configdict['vdom'][vdom]['firewall policy']
-                else:
-                    policydict = {}
-
-                if 'firewall zone' in configdict['vdom'][vdom]:
-                    zoneobjdict = configdict['vdom'][vdom]['firewall zone']
-                else:
-                    zoneobjdict = {}
-
-                self.init_discovery(device,options,addressobjdict,addrgrpdict,serviceobjdict,servicegroupdict,
-                                    zoneobjdict, interfacedict, policydict)
-                print("\nStatistics for VDOM: %s" % vdom)
-                print("Total Address Objects: %d" % len(list(addressobjdict.keys())))
-                print("Total Address Group Objects: %d" % len(list(addrgrpdict.keys())))
-                print("Total Service Objects: %d" % len(list(serviceobjdict.keys())))
-                print("Total Policies: %d" % len(list(policydict.keys())))
+            vdoms = list(configdict['vdom'].items())
         else:
-            device, devicecreated = Device.objects.get_or_create(hostname=hostname, vsys='default')
-            device.devtype = 'fgt52'
-            device.hostname = hostname
-            if options['d'] == 'n':
-                device.save()
-            addressobjdict = configdict['firewall address']
-            addrgrpdict = configdict['firewall addrgrp']
-            serviceobjdict = configdict['firewall service custom']
-            servicegroupdict = configdict['firewall service group']
-            policydict = configdict['firewall policy']
-            zoneobjdict = configdict['firewall zone']
-            interfacedict = configdict['system interface']
-            self.init_discovery(device, options, addressobjdict, addrgrpdict, serviceobjdict, servicegroupdict,
-                                zoneobjdict, interfacedict, policydict)
-
-        # Create the current configversion object
-
-        if options['d'] == 'n':
-            rawconfig.save()
\ No newline at end of file
+            vdoms = [('default', configdict)]
+
+        if options['d'] != 'n':
+            self.dry_run(vdoms, interfacedict)
+            return
+
+        if options['fast']:
+            enable_import_pragmas()
+
+        importstart = time.time()
+        failedvdoms = []
+        if options['workers'] > 1:
+            failedvdoms = self.import_vdoms_parallel(hostname, vdoms, interfacedict, options)
+            vdoms = []
+        for vdom, vdomconfig in vdoms:
+            sections = vdom_sections(vdomconfig, interfacedict)
+            if options['fast']:
+                # Each VDOM is imported in a single transaction, a failure rolls back only that VDOM
+                try:
+                    with transaction.atomic():
+                        self.import_vdom(hostname, vdom, sections, options)
+                except Exception as e:
+                    print("\nImport of VDOM %s failed, changes rolled back: %s" % (vdom, e))
+                    failedvdoms.append(vdom)
+                    continue
+            else:
+                self.import_vdom(hostname, vdom, sections, options)
+            self.print_statistics(vdom, sections)
+        print("\nImport finished in %.2fs" % (time.time() - importstart))
+
+        # Unchanged incremental re-imports do not store the raw configuration again
+        if self.rawconfig is not None or not options['incremental']:
+            rawconfig = self.get_rawconfig()
+            # The raw file is only read back once the tree has been processed, chunks already in the store are not
+            # written again
+            with open(CONFIGFILE, 'rb') as configfile, self.profiler.phase('store raw config'):
+                blob = BlobStore(codec=options['compression']).put(configfile)
+            rawconfig.digest = blob.digest
+            rawconfig.size = blob.size
+            rawconfig.save()
+
+        if failedvdoms:
+            raise CommandError("Import failed for VDOMs: %s" % ', '.join(failedvdoms))
@@ -0,0 +1,116 @@
+#!/usr/local/bin/python
+"""
+Replay flow logs against the policies of a device and count the hits of every policy. The flows are matched in
+chunks with NumPy, see normalized_fw_config.flowreplay for the file formats and how flows are matched.
+"""
+
+import csv
+import gzip
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from normalized_fw_config.flowreplay import CHUNK_BYTES, FlowReader, FlowReplay
+from normalized_fw_config.models import *
+from normalized_fw_config.policymatch import MatcherCache, compiled_matcher
+
+
+def policy_label(policy):
+    if policy['name']:
+        return '%d (%s, %s)' % (policy['policyid'], policy['name'], policy['action'])
+    return '%d (%s)' % (policy['policyid'], policy['action'])
+
+
+class Command(BaseCommand):
+    help = 'Replay flow logs against the policies of a device, count the policy hits and show unmatched flows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', metavar='<flow-file>', nargs='+',
+                            help='CSV file with a header line (src,dst,proto,dport[,srcintf,dstintf]) or FortiGate '
+                                 'traffic log, may be gzipped')
+
+        parser.add_argument('--hostname', metavar='device-hostname',
+                            help='Hostname of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--vsys', metavar='<vdom>',
+                            help='vsys/vdom/context of the device',
+                            required=True
+                            )
+
+        parser.add_argument('--chunk-bytes', type=int, metavar='<bytes>',
+                            help='Size of the blocks of whole lines matched at once (default: %d)' % CHUNK_BYTES,
+                            default=CHUNK_BYTES
+                            )
+
+        parser.add_argument('--samples', type=int, metavar='<count>',
+                            help='Number of unmatched flows to show (default: 20)',
+                            default=20
+                            )
+
+        parser.add_argument('--hits-csv', metavar='<csv-file>',
+                            help='Write the hit count of every policy to a CSV file',
+                            default=None
+                            )
+
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Do not read or write compiled matchers on disk',
+                            default=False
+                            )
+
+    def handle(self, *args, **options):
+        try:
+            device = Device.objects.get(hostname=options['hostname'], vsys=options['vsys'])
+        except Device.DoesNotExist:
+            raise CommandError("Device %s [%s] does not exist" % (options['hostname'], options['vsys']))
+        if options['chunk_bytes'] < 1:
+            raise CommandError("--chunk-bytes must be positive")
+
+        start = time.time()
+        matcher, fromcache = compiled_matcher(device, None if options['no_cache'] else MatcherCache())
+        print("%d policies %s in %.2fs" % (len(matcher.policies), 'read from the cache' if fromcache else 'compiled',
+                                          time.time() - start))
+        try:
+            replay = FlowReplay(matcher, options['samples'])
+        except (ImportError, ValueError) as e:
+            raise CommandError(e)
+
+        start = time.time()
+        for filename in options['files']:
+            try:
+                with (gzip.open if filename.endswith('.gz') else open)(filename, 'rb') as fh:
+                    reader = FlowReader(fh, options['chunk_bytes'])
+                    for chunk in reader.chunks():
+                        replay.replay(chunk)
+            except (IOError, ValueError) as e:
+                raise CommandError("%s: %s" % (filename, e))
+        elapsed = time.time() - start
+
+        hits = replay.policy_hits()
+        permitted = sum(count for policy, count in hits if policy['action'] == 'permit')
+        denied = sum(count for policy, count in hits if policy['action'] != 'permit')
+        unmatched = int(replay.hits[-1])
+        print("%d flows replayed in %.2fs (%d flows/s): %d permitted, %d denied by policy, %d unmatched, %d invalid" % (
+            replay.flows, elapsed, replay.flows / elapsed if elapsed else 0, permitted, denied, unmatched,
+            replay.invalid))
+
+        used = sorted((h for h in hits if h[1]), key=lambda h: -h[1])
+        print("\n%d policies hit, %d without hits" % (len(used), len(hits) - len(used)))
+        for policy, count in used[:20]:
+            print("  %-40s %d" % (policy_label(policy), count))
+
+        if replay.examples:
+            print("\nUnmatched flows:")
+            for source, destination, protocol, port, srczone, dstzone in replay.examples:
+                print("  %s -> %s %d/%d%s" % (source, destination, protocol, port,
+                                              ' %s -> %s' % (srczone or 'any', dstzone or 'any')
+                                              if srczone or dstzone else ''))
+
+        if options['hits_csv']:
+            with open(options['hits_csv'], 'w') as fh:
+                writer = csv.writer(fh)
+                writer.writerow(['policyid', 'name', 'sequence', 'action', 'hits'])
+                for policy, count in hits:
+                    writer.writerow([policy['policyid'], policy['name'], policy['sequence'], policy['action'], count])
+            print("Policy hits written to %s" % options['hits_csv'])
@@ -0,0 +1,215 @@
+#!/usr/local/bin/python
+"""
+End to end benchmark of the parse, ingest and ASA export stages on synthetic configurations.
+
+For every size a configuration is generated, parsed, imported as a fresh device and exported with create-asa-config.
+The imports go to a scratch SQLite database in the working directory, the configured database is not touched. The wall and CPU time of every stage are appended as one JSON line per size to the results file and
+compared with the previous result of the same size, VDOM count and ingest mode found there.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+from normalized_fw_config.models import Device
+from normalized_fw_config.parsecache import load_config
+from normalized_fw_config.synthetic import generate_config
+from normalized_fw_config.management.commands.parsefgconfig import Command as ImportCommand
+
+STAGES = ('parse', 'ingest', 'export')
+INGEST_MODES = OrderedDict([
+    ('legacy', []),
+    ('fast', ['--fast']),
+    ('bulk', ['--bulk']),
+    ('fast-bulk', ['--fast', '--bulk']),
+])
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def scratch_database(path):
+    """
+    Replace the default connection with one to a migrated SQLite database at path
+    """
+    original = connections[DEFAULT_DB_ALIAS]
+    settings_dict = dict(original.settings_dict, ENGINE='django.db.backends.sqlite3', NAME=path, OPTIONS={})
+    scratch = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, DEFAULT_DB_ALIAS)
+    connections[DEFAULT_DB_ALIAS] = scratch
+    try:
+        call_command('migrate', verbosity=0, interactive=False)
+        yield
+    finally:
+        scratch.close()
+        connections[DEFAULT_DB_ALIAS] = original
+
+
+def timed(func, *args, **kwargs):
+    """
+    :return: (result of func, {'wall': seconds, 'cpu': seconds})
+    """
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = func(*args, **kwargs)
+    return result, OrderedDict([('wall', time.perf_counter() - wall), ('cpu', time.process_time() - cpu)])
+
+
+def source_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(path):
+    """
+    :return: {(policies, vdoms, ingest mode): last result} of a results file
+    """
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                result = json.loads(line)
+                previous[(result['policies'], result['vdoms'], result['ingest'])] = result
+    return previous
+
+
+class Command(BaseCommand):
+    help = 'Benchmark parsing, importing and exporting synthetic Fortigate configurations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', metavar='N', type=int, nargs='+',
+                            help='Numbers of policies per VDOM to benchmark (default: 1000 10000 100000)',
+                            default=[1000, 10000, 100000]
+                            )
+
+        parser.add_argument('--vdoms', metavar='N', type=int,
+                            help='Number of VDOMs (default: 1)',
+                            default=1
+                            )
+
+        parser.add_argument('--seed', type=int,
+                            help='Seed of the configuration generator (default: 0)',
+                            default=0
+                            )
+
+        parser.add_argument('--stages', nargs='+', choices=STAGES,
+                            help='Stages to run (default: all). The export needs the ingested device.',
+                            default=list(STAGES)
+                            )
+
+        parser.add_argument('--ingest', choices=list(INGEST_MODES),
+                            help='parsefgconfig import mode (default: bulk)',
+                            default='bulk'
+                            )
+
+        parser.add_argument('--label', metavar='<text>',
+                            help='Label stored with the results, e.g. the change being measured',
+                            default=''
+                            )
+
+        parser.add_argument('-o', metavar='<results-file>',
+                            help='JSON lines file the results are appended to (default: benchmark-results.jsonl)',
+                            default='benchmark-results.jsonl'
+                            )
+
+        parser.add_argument('--workdir', metavar='<directory>',
+                            help='Keep the generated configurations in this directory (default: a temporary one)',
+                            default=None
+                            )
+
+    def handle(self, *args, **options):
+        if 'export' in options['stages'] and 'ingest' not in options['stages']:
+            raise CommandError("The export stage needs the ingest stage")
+        resultsfile = os.path.abspath(options['o'])
+        previous = previous_results(resultsfile)
+        workdir = options['workdir'] or tempfile.mkdtemp(prefix='fgt-benchmark-')
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            # The commands write their JSON dumps to the working directory
+            with working_directory(workdir), scratch_database(os.path.join(workdir, 'benchmark.sqlite3')):
+                for size in options['sizes']:
+                    result = self.benchmark(size, options)
+                    self.print_result(result, previous.get((size, options['vdoms'], options['ingest'])))
+                    with open(resultsfile, 'a') as fh:
+                        fh.write(json.dumps(result) + '\n')
+        finally:
+            if not options['workdir']:
+                shutil.rmtree(workdir, True)
+        print("\nResults appended to %s" % resultsfile)
+
+    def benchmark(self, size, options):
+        hostname = 'FGT-BENCH-%d' % size
+        path = os.path.abspath('fgt-bench-%d-%d-%d.conf' % (size, options['vdoms'], options['seed']))
+        print("\nGenerating %d policies x %d VDOMs: %s" % (size, options['vdoms'], path))
+        with open(path, 'w') as fh:
+            counts = generate_config(fh, size, vdoms=options['vdoms'], seed=options['seed'], hostname=hostname)
+
+        result = OrderedDict([
+            ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('label', options['label']),
+            ('revision', source_revision()),
+            ('python', platform.python_version()),
+            ('policies', size),
+            ('vdoms', options['vdoms']),
+            ('seed', options['seed']),
+            ('ingest', options['ingest']),
+            ('config_bytes', os.path.getsize(path)),
+            ('objects', counts),
+            ('stages', OrderedDict()),
+        ])
+        stages = result['stages']
+        (configdict, cached), stages['parse'] = timed(load_config, path)
+        if 'ingest' in options['stages']:
+            Device.objects.filter(hostname=hostname).delete()
+            importer = ImportCommand()
+            importoptions = vars(importer.create_parser('manage.py', 'parsefgconfig').parse_args(
+                ['-f', path] + INGEST_MODES[options['ingest']]))
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                stages['ingest'] = timed(importer.import_config, path, os.path.getmtime(path), configdict, False,
+                                         importoptions)[1]
+        if 'export' in options['stages']:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                stages['export'] = timed(self.export, hostname, list(configdict['vdom']))[1]
+        if 'parse' not in options['stages']:
+            # Parsing is always needed for the import, it is only reported when asked for
+            del stages['parse']
+        return result
+
+    def export(self, hostname, vdoms):
+        for vdom in vdoms:
+            call_command('create-asa-config', '--hostname', hostname, '--vsys', vdom)
+
+    def print_result(self, result, previous):
+        print("%-8s  %9s  %9s  %9s  %8s" % ('Stage', 'Wall', 'CPU', 'Previous', 'Change'))
+        for stage, times in result['stages'].items():
+            before = previous and previous['stages'].get(stage)
+            if before:
+                change = (times['wall'] - before['wall']) / before['wall'] * 100 if before['wall'] else 0.0
+                print("%-8s  %8.2fs  %8.2fs  %8.2fs  %+7.1f%%" % (stage, times['wall'], times['cpu'], before['wall'],
+                                                                   change))
+            else:
+                print("%-8s  %8.2fs  %8.2fs  %9s  %8s" % (stage, times['wall'], times['cpu'], '-', '-'))
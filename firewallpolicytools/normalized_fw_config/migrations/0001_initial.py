@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AddressGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AddressObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('range4', 'IPv4 Range Object'), ('range6', 'IPv6 Range Object'), ('net4', 'IPv4 Network Object'), ('net6', 'IPv6 Network Object'), ('ip4', 'IPv4 Single Address Object'), ('ip6', 'IPv6 Single Address Object'), ('fqdn', 'Fully Qualified Domain Name (FQDN) Object')], max_length=6)),
+                ('name', models.CharField(max_length=64)),
+                ('start_ip', models.GenericIPAddressField(null=True)),
+                ('end_ip', models.GenericIPAddressField(null=True)),
+                ('prefixlen', models.IntegerField(default=None, null=True)),
+                ('fqdn', models.CharField(default=None, max_length=256, null=True)),
+                ('description', models.CharField(default=None, max_length=512, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompoundServiceObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConfigVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_active', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('devtype', models.CharField(choices=[('asa9', 'Cisco ASA 9.x'), ('fgt52', 'Fortigate 5.2+')], max_length=10)),
+                ('hostname', models.CharField(max_length=128)),
+                ('vsys', models.CharField(default=None, max_length=64, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Interface',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('description', models.CharField(default=None, max_length=512, null=True)),
+                ('configs', models.ManyToManyField(to='normalized_fw_config.ConfigVersion')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Policy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default=None, max_length=128, null=True)),
+                ('policyid', models.IntegerField(default=0)),
+                ('sequence', models.IntegerField(default=0)),
+                ('action', models.CharField(choices=[('permit', 'Allow traffic to pass'), ('deny', 'Deny traffic silently (Drop)'), ('reject', 'Deny Traffic with and notify sender (TCP RST or ICMP Unreachable)')], max_length=6)),
+                ('configs', models.ManyToManyField(to='normalized_fw_config.ConfigVersion')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PolicyAddrSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('addresses', models.ManyToManyField(to='normalized_fw_config.AddressObject')),
+                ('addressgroups', models.ManyToManyField(to='normalized_fw_config.AddressGroup')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PolicyServiceSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('compoundservices', models.ManyToManyField(to='normalized_fw_config.CompoundServiceObject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PolicyZoneSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interfaces', models.ManyToManyField(to='normalized_fw_config.Interface')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RawConfigFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('configstr', models.TextField()),
+                ('name', models.CharField(max_length=300)),
+                ('import_date', models.DateTimeField(auto_now=True, verbose_name='Import Timestamp')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ServiceGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('configs', models.ManyToManyField(to='normalized_fw_config.ConfigVersion')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device')),
+                ('members', models.ManyToManyField(to='normalized_fw_config.CompoundServiceObject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ServiceObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('protocol', models.IntegerField(choices=[(0, 'HOPOPT'), (1, 'ICMP'), (2, 'IGMP'), (3, 'GGP'), (4, 'IPv4'), (5, 'ST'), (6, 'TCP'), (7, 'CBT'), (8, 'EGP'), (9, 'IGP'), (10, 'BBN-RCC-MON'), (11, 'NVP-II'), (12, 'PUP'), (13, 'ARGUS'), (14, 'EMCON'), (15, 'XNET'), (16, 'CHAOS'), (17, 'UDP'), (18, 'MUX'), (19, 'DCN-MEAS'), (20, 'HMP'), (21, 'PRM'), (22, 'XNS-IDP'), (23, 'TRUNK-1'), (24, 'TRUNK-2'), (25, 'LEAF-1'), (26, 'LEAF-2'), (27, 'RDP'), (28, 'IRTP'), (29, 'ISO-TP4'), (30, 'NETBLT'), (31, 'MFE-NSP'), (32, 'MERIT-INP'), (33, 'DCCP'), (34, '3PC'), (35, 'IDPR'), (36, 'XTP'), (37, 'DDP'), (38, 'IDPR-CMTP'), (39, 'TP++'), (40, 'IL'), (41, 'IPv6'), (42, 'SDRP'), (43, 'IPv6-Route'), (44, 'IPv6-Frag'), (45, 'IDRP'), (46, 'RSVP'), (47, 'GRE'), (48, 'DSR'), (49, 'BNA'), (50, 'ESP'), (51, 'AH'), (52, 'I-NLSP'), (53, 'SWIPE'), (54, 'NARP'), (55, 'MOBILE'), (56, 'TLSP'), (57, 'SKIP'), (58, 'IPv6-ICMP'), (59, 'IPv6-NoNxt'), (60, 'IPv6-Opts'), (62, 'CFTP'), (64, 'SAT-EXPAK'), (65, 'KRYPTOLAN'), (66, 'RVD'), (67, 'IPPC'), (69, 'SAT-MON'), (70, 'VISA'), (71, 'IPCV'), (72, 'CPNX'), (73, 'CPHB'), (74, 'WSN'), (75, 'PVP'), (76, 'BR-SAT-MON'), (77, 'SUN-ND'), (78, 'WB-MON'), (79, 'WB-EXPAK'), (80, 'ISO-IP'), (81, 'VMTP'), (82, 'SECURE-VMTP'), (83, 'VINES'), (84, 'TTP'), (84, 'IPTM'), (85, 'NSFNET-IGP'), (86, 'DGP'), (87, 'TCF'), (88, 'EIGRP'), (89, 'OSPFIGP'), (90, 'Sprite-RPC'), (91, 'LARP'), (92, 'MTP'), (93, 'AX.25'), (94, 'IPIP'), (96, 'SCC-SP'), (97, 'ETHERIP'), (98, 'ENCAP'), (100, 'GMTP'), (101, 'IFMP'), (102, 'PNNI'), (103, 'PIM'), (104, 'ARIS'), (105, 'SCPS'), (106, 'QNX'), (107, 'A/N'), (108, 'IPComp'), (109, 'SNP'), (110, 'Compaq-Peer'), (111, 'IPX-in-IP'), (112, 'VRRP'), (113, 'PGM'), (115, 'L2TP'), (116, 'DDX'), (117, 'IATP'), (118, 'STP'), (119, 'SRP'), (120, 'UTI'), (121, 'SMP'), (122, 'SM'), (123, 'PTP'), (124, 'ISIS over IPv4'), (125, 'FIRE'), (126, 'CRTP'), (127, 'CRUDP'), (128, 'SSCOPMCE'), (129, 'IPLT'), (130, 'SPS'), (131, 'PIPE'), (132, 'SCTP'), (133, 'FC'), (134, 'RSVP-E2E-IGNORE'), (135, 'Mobility Header'), (136, 'UDPLite'), (137, 'MPLS-in-IP'), (138, 'manet'), (139, 'HIP'), (140, 'Shim6'), (141, 'WESP'), (142, 'ROHC'), (256, 'TCP+UDP'), (257, 'TCP+UDP+SCTP')], default=256)),
+                ('start_port', models.IntegerField(default=None, null=True)),
+                ('end_port', models.IntegerField(default=None, null=True)),
+                ('src_start_port', models.IntegerField(default=None, null=True)),
+                ('src_end_port', models.IntegerField(default=None, null=True)),
+                ('icmp_code', models.IntegerField(default=None, null=True)),
+                ('description', models.CharField(default='', max_length=512)),
+                ('configs', models.ManyToManyField(to='normalized_fw_config.ConfigVersion')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ZoneObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('description', models.CharField(default=None, max_length=512, null=True)),
+                ('configs', models.ManyToManyField(to='normalized_fw_config.ConfigVersion')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device')),
+                ('members', models.ManyToManyField(to='normalized_fw_config.Interface')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='policyzoneset',
+            name='zones',
+            field=models.ManyToManyField(to='normalized_fw_config.ZoneObject'),
+        ),
+        migrations.AddField(
+            model_name='policyserviceset',
+            name='servicegroups',
+            field=models.ManyToManyField(to='normalized_fw_config.ServiceGroup'),
+        ),
+        migrations.AddField(
+            model_name='policyserviceset',
+            name='services',
+            field=models.ManyToManyField(to='normalized_fw_config.ServiceObject'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='destination',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dst_addr_set', to='normalized_fw_config.PolicyAddrSet'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='dstzone',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dst_zone_set', to='normalized_fw_config.PolicyZoneSet'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='services',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.PolicyServiceSet'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='src_addr_set', to='normalized_fw_config.PolicyAddrSet'),
+        ),
+        migrations.AddField(
+            model_name='policy',
+            name='srczone',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='src_zone_set', to='normalized_fw_config.PolicyZoneSet'),
+        ),
+        migrations.AddField(
+            model_name='configversion',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device'),
+        ),
+        migrations.AddField(
+            model_name='configversion',
+            name='rawfile',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.RawConfigFile'),
+        ),
+        migrations.AddField(
+            model_name='compoundserviceobject',
+            name='configs',
+            field=models.ManyToManyField(to='normalized_fw_config.ConfigVersion'),
+        ),
+        migrations.AddField(
+            model_name='compoundserviceobject',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device'),
+        ),
+        migrations.AddField(
+            model_name='compoundserviceobject',
+            name='members',
+            field=models.ManyToManyField(to='normalized_fw_config.ServiceObject'),
+        ),
+        migrations.AddField(
+            model_name='addressobject',
+            name='configs',
+            field=models.ManyToManyField(to='normalized_fw_config.ConfigVersion'),
+        ),
+        migrations.AddField(
+            model_name='addressobject',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device'),
+        ),
+        migrations.AddField(
+            model_name='addressgroup',
+            name='configs',
+            field=models.ManyToManyField(to='normalized_fw_config.ConfigVersion'),
+        ),
+        migrations.AddField(
+            model_name='addressgroup',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device'),
+        ),
+        migrations.AddField(
+            model_name='addressgroup',
+            name='members',
+            field=models.ManyToManyField(to='normalized_fw_config.AddressObject'),
+        ),
+    ]
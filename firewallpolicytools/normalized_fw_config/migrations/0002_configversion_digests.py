@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized_fw_config', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configversion',
+            name='digest',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='configversion',
+            name='objectdigests',
+            field=models.TextField(default=''),
+        ),
+    ]
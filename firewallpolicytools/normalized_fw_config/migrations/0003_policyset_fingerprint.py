@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized_fw_config', '0002_configversion_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='policyaddrset',
+            name='fingerprint',
+            field=models.CharField(default=None, max_length=40, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='policyserviceset',
+            name='fingerprint',
+            field=models.CharField(default=None, max_length=40, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='policyzoneset',
+            name='fingerprint',
+            field=models.CharField(default=None, max_length=40, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:44
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized_fw_config', '0003_policyset_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='addressgroup',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='addressobject',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='compoundserviceobject',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='interface',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='policy',
+            unique_together=set([('device', 'policyid')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='servicegroup',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='serviceobject',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='zoneobject',
+            unique_together=set([('device', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='configversion',
+            index_together=set([('device', 'current_active')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='device',
+            index_together=set([('hostname', 'vsys')]),
+        ),
+    ]
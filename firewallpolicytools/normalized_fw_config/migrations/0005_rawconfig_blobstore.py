@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:45
+from __future__ import unicode_literals
+
+import io
+
+from django.db import migrations, models
+
+
+def move_configstr_to_blobstore(apps, schema_editor):
+    from normalized_fw_config.blobstore import BlobStore
+    RawConfigFile = apps.get_model('normalized_fw_config', 'RawConfigFile')
+    store = BlobStore(apps.get_model('normalized_fw_config', 'Blob'),
+                      apps.get_model('normalized_fw_config', 'BlobChunk'))
+    for rawconfig in RawConfigFile.objects.iterator():
+        blob = store.put(io.BytesIO(rawconfig.configstr.encode('utf-8')))
+        rawconfig.digest = blob.digest
+        rawconfig.size = blob.size
+        rawconfig.save(update_fields=['digest', 'size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized_fw_config', '0004_object_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('chunks', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('size', models.IntegerField()),
+                ('codec', models.CharField(max_length=8)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='rawconfigfile',
+            name='digest',
+            field=models.CharField(db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='rawconfigfile',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(move_configstr_to_blobstore, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='rawconfigfile',
+            name='configstr',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized_fw_config', '0005_rawconfig_blobstore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Route',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.GenericIPAddressField(protocol='IPv4')),
+                ('prefixlen', models.IntegerField()),
+                ('gateway', models.GenericIPAddressField(default=None, null=True, protocol='IPv4')),
+                ('interface', models.CharField(max_length=128)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='normalized_fw_config.Device')),
+            ],
+        ),
+    ]
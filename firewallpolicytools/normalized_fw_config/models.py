@@ -1,10 +1,41 @@
+import hashlib
+import io
+
 from django.db import models
 
 # Create your models here.
+class BlobChunk(models.Model):
+    # sha256 of the uncompressed content
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.IntegerField()
+    codec = models.CharField(max_length=8)
+    data = models.BinaryField()
+
+class Blob(models.Model):
+    # sha256 of the whole content
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    # Space separated digests of the BlobChunks, in order
+    chunks = models.TextField()
+
 class RawConfigFile(models.Model):
-    configstr = models.TextField()
     name = models.CharField(max_length=300)
     import_date = models.DateTimeField('Import Timestamp', auto_now=True)
+    # The content is kept in the blob store (normalized_fw_config.blobstore) under its sha256
+    digest = models.CharField(max_length=64, default='', db_index=True)
+    size = models.BigIntegerField(default=0)
+
+    def open(self):
+        """
+        Return a text file object decompressing the configuration while it is read
+        """
+        from normalized_fw_config.blobstore import BlobStore
+        return io.TextIOWrapper(BlobStore().open(self.digest), encoding='utf-8', errors='replace')
+
+    @property
+    def configstr(self):
+        with self.open() as configfile:
+            return configfile.read()
 
 class Device(models.Model):
     DEVTYPE_CHOICES = (
@@ -15,6 +46,9 @@ class Device(models.Model):
     hostname = models.CharField(max_length=128)
     vsys = models.CharField(max_length=64, null=True, default=None)
 
+    class Meta:
+        index_together = (('hostname', 'vsys'),)
+
     def __str__(self):
         return self.hostname + " [" + self.vsys +"]"
 
@@ -23,6 +57,13 @@ class ConfigVersion(models.Model):
     current_active = models.BooleanField(default=False)
     date = models.DateTimeField(auto_now=True)
     rawfile = models.ForeignKey(RawConfigFile, null=True, default=None)
+    # Digest over all configuration sections of the device, used to skip unchanged re-imports
+    digest = models.CharField(max_length=64, default='')
+    # JSON {section: {'digest': ..., 'objects': {name: digest}}}, only kept for the current active version
+    objectdigests = models.TextField(default='')
+
+    class Meta:
+        index_together = (('device', 'current_active'),)
 
 class AddressObject(models.Model):
     TYPE_CHOICES = (
@@ -44,6 +85,9 @@ class AddressObject(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
@@ -203,6 +247,9 @@ class ServiceObject(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
@@ -212,6 +259,9 @@ class CompoundServiceObject(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
@@ -221,6 +271,9 @@ class AddressGroup(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
@@ -230,6 +283,9 @@ class ServiceGroup(models.Model):
     device = models.ForeignKey(Device)
     configs = models.ManyToManyField(ConfigVersion)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
@@ -239,9 +295,23 @@ class Interface(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
+class Route(models.Model):
+    # Routing table entry of a device, the ASA export derives the interface behind each address from these
+    network = models.GenericIPAddressField(protocol='IPv4')
+    prefixlen = models.IntegerField()
+    gateway = models.GenericIPAddressField(protocol='IPv4', null=True, default=None)
+    interface = models.CharField(max_length=128)
+    device = models.ForeignKey(Device)
+
+    def __str__(self):
+        return "%s/%d via %s" % (self.network, self.prefixlen, self.interface)
+
 class ZoneObject(models.Model):
     # An interface can be treated as a zone
     name = models.CharField(max_length=128)
@@ -250,18 +320,45 @@ class ZoneObject(models.Model):
     configs = models.ManyToManyField(ConfigVersion)
     device = models.ForeignKey(Device)
 
+    class Meta:
+        unique_together = (('device', 'name'),)
+
     def __str__(self):
         return self.name
 
-class PolicyAddrSet(models.Model):
+def set_fingerprint(members):
+    """
+    Fingerprint of a policy set: a hash of the sorted member pks of each of its relations
+
+    :param members: one iterable of member pks per relation, in the order of the model's FINGERPRINT_RELATIONS
+    """
+    canonical = '|'.join(','.join(str(pk) for pk in sorted(set(pks))) for pks in members)
+    return hashlib.sha1(canonical.encode('ascii')).hexdigest()
+
+class PolicySet(models.Model):
+    # Identical sets are shared between policies and looked up by their fingerprint
+    fingerprint = models.CharField(max_length=40, unique=True, null=True, default=None)
+
+    class Meta:
+        abstract = True
+
+    def update_fingerprint(self):
+        self.fingerprint = set_fingerprint(
+            [getattr(self, relation).values_list('pk', flat=True) for relation in self.FINGERPRINT_RELATIONS])
+        self.save(update_fields=['fingerprint'])
+
+class PolicyAddrSet(PolicySet):
+    FINGERPRINT_RELATIONS = ('addresses', 'addressgroups')
     addresses = models.ManyToManyField(AddressObject)
     addressgroups = models.ManyToManyField(AddressGroup)
 
-class PolicyZoneSet(models.Model):
+class PolicyZoneSet(PolicySet):
+    FINGERPRINT_RELATIONS = ('zones', 'interfaces')
     zones = models.ManyToManyField(ZoneObject)
     interfaces = models.ManyToManyField(Interface)
 
-class PolicyServiceSet(models.Model):
+class PolicyServiceSet(PolicySet):
+    FINGERPRINT_RELATIONS = ('services', 'compoundservices', 'servicegroups')
     services = models.ManyToManyField(ServiceObject)
     compoundservices = models.ManyToManyField(CompoundServiceObject)
     servicegroups = models.ManyToManyField(ServiceGroup)
@@ -285,6 +382,9 @@ class Policy(models.Model):
     device = models.ForeignKey(Device)
     action = models.CharField(max_length=6, choices=ACTION_CHOICES)
 
+    class Meta:
+        unique_together = (('device', 'policyid'),)
+
     def __str__(self):
         if self.name:
             return str(self.policyid) + ': ' + self.name
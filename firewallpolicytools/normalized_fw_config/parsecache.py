@@ -0,0 +1,159 @@
+"""
+On-disk cache of parsed FortiGate configurations.
+
+The tree built by parse_config() is stored with marshal under the sha256 of the configuration file, the parser version
+and the marshal format version, so a changed file or parser never reads a stale tree. The least recently used
+entries are evicted once the cache grows beyond its size limit.
+"""
+
+import gc
+import hashlib
+import marshal
+import os
+import tempfile
+
+from django.conf import settings
+
+from normalized_fw_config.fgtparser import PARSER_VERSION, parse_config
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+SUFFIX = '.marshal'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    SUFFIX = SUFFIX
+
+    def __init__(self, directory=None, maxbytes=None):
+        """
+        :param directory: defaults to settings.FGT_PARSE_CACHE_DIR
+        :param maxbytes: defaults to settings.FGT_PARSE_CACHE_MAX_BYTES
+        """
+        if directory is None:
+            directory = getattr(settings, 'FGT_PARSE_CACHE_DIR', os.path.join(settings.BASE_DIR, '.parsecache'))
+        if maxbytes is None:
+            maxbytes = getattr(settings, 'FGT_PARSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.directory = directory
+        self.maxbytes = maxbytes
+
+    def path(self, digest):
+        return os.path.join(self.directory, '%s-p%d-m%d%s' % (digest, PARSER_VERSION, marshal.version, self.SUFFIX))
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+    def dump(self, value, fh):
+        marshal.dump(value, fh)
+
+    def get(self, digest):
+        """
+        :return: the cached configdict, or None
+        """
+        path = self.path(digest)
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            # The modification time orders the entries for eviction
+            os.utime(path, None)
+        except OSError:
+            return None
+        # The tree consists of many small containers, the cyclic garbage collector would otherwise run many times
+        # while it is built although none of them can be garbage yet
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+        finally:
+            if gcenabled:
+                gc.enable()
+
+    def put(self, digest, configdict):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, concurrent readers never see a partial entry
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                self.dump(configdict, fh)
+            os.replace(tmppath, self.path(digest))
+        except:
+            os.unlink(tmppath)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (modification time, size, path) of the cache entries, oldest first
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits into maxbytes
+
+        :return: number of removed entries
+        """
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def purge(self):
+        """
+        :return: number of removed entries
+        """
+        entries = self.entries()
+        for mtime, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return len(entries)
+
+
+def load_config(path, cache=None):
+    """
+    Parse a configuration file, reusing the cached tree when the file was parsed before
+
+    :param cache: ParseCache, or None to always parse
+    :return: (configdict, True if it was read from the cache)
+    """
+    if cache is None:
+        with open(path, 'r') as configfile:
+            return parse_config(configfile), False
+    digest = file_digest(path)
+    configdict = cache.get(digest)
+    if configdict is not None:
+        return configdict, True
+    with open(path, 'r') as configfile:
+        configdict = parse_config(configfile)
+    cache.put(digest, configdict)
+    return configdict, False
@@ -0,0 +1,112 @@
+"""
+Loader for the policies of a device with all their sets, groups and members.
+
+load_policies() reads the whole policy graph with a fixed number of queries, one per model and many-to-many relation,
+and returns plain python structures in the shape the export used to build with the JSON serializer for every policy:
+
+    policy:     {'policyid', 'name', 'sequence', 'action', 'device', 'srczone', 'dstzone',
+                 'source': addrset, 'destination': addrset, 'services': serviceset}
+    addrset:    {'fingerprint', 'addresses': [address], 'addressgroups': [{'name', 'device', 'members': [address]}]}
+    serviceset: {'fingerprint', 'services': [service],
+                 'compoundservices': [{'name', 'device', 'members': [service]}],
+                 'servicegroups': [{'name', 'device', 'members': [compound service pk]}]}
+
+Policies without a source, destination or service set get an empty set. The many-to-many 'configs' lists are not
+loaded. Objects referenced several times are the same dict, callers must copy them before making changes.
+"""
+
+from collections import defaultdict
+
+from django.db.models import Q
+
+from normalized_fw_config.models import *
+
+ADDRESS_FIELDS = ('type', 'name', 'start_ip', 'end_ip', 'prefixlen', 'fqdn', 'description', 'device')
+SERVICE_FIELDS = ('name', 'protocol', 'start_port', 'end_port', 'src_start_port', 'src_end_port', 'icmp_code',
+                  'description', 'device')
+POLICY_FIELDS = ('policyid', 'name', 'sequence', 'action', 'device', 'srczone', 'dstzone')
+GROUP_FIELDS = ('name', 'device')
+
+
+def load_objects(queryset, fields):
+    """
+    :return: {pk: {field: value}}
+    """
+    objects = {}
+    for row in queryset.values('pk', *fields):
+        objects[row.pop('pk')] = row
+    return objects
+
+
+def load_members(relation, owners, members):
+    """
+    Read a many-to-many relation
+
+    :param relation: the ManyToManyField descriptor, e.g. AddressGroup.members
+    :param owners: queryset of the owners to read the rows of, used as a subquery
+    :param members: {pk: object} the member pks are replaced with, or None to keep the pks
+    :return: defaultdict {owner pk: [members]}
+    """
+    field = relation.field
+    ownercolumn = field.m2m_field_name() + '_id'
+    membercolumn = field.m2m_reverse_field_name() + '_id'
+    # Members in primary key order, like the queries of the JSON serializer returned them
+    rows = relation.through.objects.filter(**{ownercolumn + '__in': owners.values('pk')}).order_by(ownercolumn,
+                                                                                                   membercolumn)
+    result = defaultdict(list)
+    for owner, member in rows.values_list(ownercolumn, membercolumn):
+        result[owner].append(member if members is None else members[member])
+    return result
+
+
+def load_sets(model, owners, relations):
+    """
+    :param relations: (relation name, {pk: object} or None) in the order of the set's keys
+    :return: {pk: set dict}
+    """
+    sets = load_objects(owners, ('fingerprint',))
+    for name, members in relations:
+        setmembers = load_members(getattr(model, name), owners, members)
+        for pk, policyset in sets.items():
+            policyset[name] = setmembers.get(pk, [])
+    return sets
+
+
+def load_groups(model, devices, members):
+    groups = load_objects(model.objects.filter(device__in=devices), GROUP_FIELDS)
+    groupmembers = load_members(model.members, model.objects.filter(device__in=devices), members)
+    for pk, group in groups.items():
+        group['members'] = groupmembers.get(pk, [])
+    return groups
+
+
+def load_policies(devices):
+    """
+    :param devices: queryset or list of Device objects
+    :return: list of policy dicts in sequence order
+    """
+    policies = Policy.objects.filter(device__in=devices)
+    addresses = load_objects(AddressObject.objects.filter(device__in=devices), ADDRESS_FIELDS)
+    addrgroups = load_groups(AddressGroup, devices, addresses)
+    services = load_objects(ServiceObject.objects.filter(device__in=devices), SERVICE_FIELDS)
+    compoundservices = load_groups(CompoundServiceObject, devices, services)
+    servicegroups = load_groups(ServiceGroup, devices, None)
+
+    addrsets = load_sets(PolicyAddrSet, PolicyAddrSet.objects.filter(
+        Q(pk__in=policies.values('source')) | Q(pk__in=policies.values('destination'))),
+        (('addresses', addresses), ('addressgroups', addrgroups)))
+    servicesets = load_sets(PolicyServiceSet, PolicyServiceSet.objects.filter(pk__in=policies.values('services')),
+                            (('services', services), ('compoundservices', compoundservices),
+                             ('servicegroups', servicegroups)))
+    emptyaddrset = {'fingerprint': None, 'addresses': [], 'addressgroups': []}
+    emptyserviceset = {'fingerprint': None, 'services': [], 'compoundservices': [], 'servicegroups': []}
+
+    result = []
+    # FortiGate evaluates the policies of a device in sequence (configuration) order, not by policy id
+    for row in policies.order_by('device', 'sequence', 'policyid').values('source', 'destination', 'services',
+                                                                         *POLICY_FIELDS):
+        row['source'] = addrsets.get(row['source'], emptyaddrset)
+        row['destination'] = addrsets.get(row['destination'], emptyaddrset)
+        row['services'] = servicesets.get(row['services'], emptyserviceset)
+        result.append(row)
+    return result
@@ -0,0 +1,221 @@
+"""
+Compiled matcher answering which policy of a device handles a packet.
+
+PolicyMatcher is compiled from the interval sets of normalized_fw_config.anomalies.PolicyIntervals. Every dimension is
+partitioned into the segments between the starts and ends of all intervals of the policies. All values of a segment
+are matched by the same policies, whose bitset is computed with the dimension's DimensionIndex when the segment is
+looked up first and then kept. A lookup is one bisect and one dict lookup per dimension and the intersection of five
+bitsets, whose lowest bit is the first matching policy in sequence order.
+
+Compiled matchers are cached per device under the digest of its current ConfigVersion, in the process and in a
+MatcherCache on disk for other processes. Every import records a ConfigVersion, so they are only compiled again when
+an import changes the configuration.
+Devices imported without configuration versions are keyed by their policy rows and the fingerprints of the policies'
+sets, which does not notice objects changed in place.
+"""
+
+import hashlib
+import ipaddress
+import os
+import pickle
+from bisect import bisect_right
+
+from django.conf import settings
+
+from normalized_fw_config.anomalies import ANY_NAME, IPV6_OFFSET, PORTS, DimensionIndex, PolicyIntervals, \
+    bit_positions
+from normalized_fw_config.models import *
+from normalized_fw_config.parsecache import DEFAULT_MAX_BYTES, ParseCache
+from normalized_fw_config.routing import parse_ip
+
+MATCHER_VERSION = 1
+PROTOCOL_NUMBERS = dict((name.lower(), number) for number, name in ServiceObject.PROTO_CHOICES if number < 256)
+POLICY_FIELDS = ('policyid', 'name', 'sequence', 'action')
+
+# {device pk: (key, PolicyMatcher)}
+_matchers = {}
+
+
+def address_value(ip):
+    """
+    :param ip: IPv4 or IPv6 address string
+    :return: the address in the address dimension of PolicyIntervals
+    """
+    if ':' in ip:
+        return IPV6_OFFSET + int(ipaddress.IPv6Address(ip))
+    return parse_ip(ip)
+
+
+def protocol_number(protocol):
+    """
+    :param protocol: protocol number, or name like 'tcp'
+    """
+    if isinstance(protocol, int):
+        number = protocol
+    elif protocol.isdigit():
+        number = int(protocol)
+    else:
+        try:
+            number = PROTOCOL_NUMBERS[protocol.lower()]
+        except KeyError:
+            raise ValueError("Unknown protocol: %s" % protocol)
+    if not 0 <= number < 256:
+        raise ValueError("Invalid protocol number: %s" % protocol)
+    return number
+
+
+class DimensionPartition(object):
+    def __init__(self, sets):
+        """
+        :param sets: list of merged intervals, one per policy bit
+        """
+        self.index = DimensionIndex(sets)
+        boundaries = {0}
+        for intervals in set(sets):
+            for start, end in intervals:
+                boundaries.add(start)
+                boundaries.add(end + 1)
+        self.boundaries = sorted(boundaries)
+        # {segment: bitset of the policies matching its values}
+        self.masks = {}
+
+    def mask(self, value):
+        return self.segment_mask(bisect_right(self.boundaries, value) - 1)
+
+    def segment_mask(self, segment):
+        """
+        :param segment: index of the segment starting at self.boundaries[segment]
+        """
+        try:
+            return self.masks[segment]
+        except KeyError:
+            start = self.boundaries[segment]
+            mask = self.masks[segment] = self.index.interval_mask(start, start)
+            return mask
+
+
+class PolicyMatcher(object):
+    def __init__(self, policies):
+        """
+        :param policies: PolicyIntervals of the device
+        """
+        self.policies = [dict((field, p[field]) for field in POLICY_FIELDS) for p in policies.policies]
+        self.zone_values = policies.zone_values
+        self.partitions = dict((dimension, DimensionPartition(sets)) for dimension, sets in policies.intervals.items())
+        self.all = (1 << len(self.policies)) - 1
+
+    def zone_mask(self, dimension, name):
+        """
+        A zone matches the policies matching all of its interfaces, no name matches all policies
+        """
+        if name is None or name == ANY_NAME:
+            return self.all
+        try:
+            values = self.zone_values[name]
+        except KeyError:
+            raise ValueError("Unknown interface or zone: %s" % name)
+        mask = self.all
+        for value in values:
+            mask &= self.partitions[dimension].mask(value)
+        return mask
+
+    def match_mask(self, source, destination, protocol, port=0, srczone=None, dstzone=None):
+        """
+        :param source: source IP address
+        :param destination: destination IP address
+        :param protocol: protocol number or name
+        :param port: destination port, the ICMP type for ICMP and 0 for protocols without ports
+        :param srczone: name of the ingress interface or zone, None for any
+        :param dstzone: name of the egress interface or zone, None for any
+        :return: bitset of the matching policies
+        """
+        if not 0 <= port < PORTS:
+            raise ValueError("Invalid port: %s" % port)
+        mask = self.zone_mask('srczone', srczone) & self.zone_mask('dstzone', dstzone)
+        mask &= self.partitions['source'].mask(address_value(source))
+        mask &= self.partitions['destination'].mask(address_value(destination))
+        return mask & self.partitions['services'].mask(protocol_number(protocol) * PORTS + port)
+
+    def lookup(self, *args, **kwargs):
+        """
+        Arguments of match_mask()
+
+        :return: policy dict ('policyid', 'name', 'sequence', 'action') of the policy handling the packet, None when
+                 no policy matches
+        """
+        mask = self.match_mask(*args, **kwargs)
+        if not mask:
+            return None
+        return self.policies[(mask & -mask).bit_length() - 1]
+
+    def matches(self, *args, **kwargs):
+        """
+        Arguments of match_mask()
+
+        :return: list of the policy dicts of all matching policies, in sequence order
+        """
+        return [self.policies[bit] for bit in bit_positions(self.match_mask(*args, **kwargs))]
+
+
+class MatcherCache(ParseCache):
+    """
+    On-disk cache of compiled PolicyMatchers, with the eviction of ParseCache
+    """
+    SUFFIX = '.matcher'
+
+    def __init__(self, directory=None, maxbytes=None):
+        """
+        :param directory: defaults to settings.FGT_MATCHER_CACHE_DIR
+        :param maxbytes: defaults to settings.FGT_MATCHER_CACHE_MAX_BYTES
+        """
+        if directory is None:
+            directory = getattr(settings, 'FGT_MATCHER_CACHE_DIR', os.path.join(settings.BASE_DIR, '.matchercache'))
+        if maxbytes is None:
+            maxbytes = getattr(settings, 'FGT_MATCHER_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        super(MatcherCache, self).__init__(directory, maxbytes)
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s-v%d-p%d%s' % (key, MATCHER_VERSION, pickle.HIGHEST_PROTOCOL,
+                                                             self.SUFFIX))
+
+    def loads(self, data):
+        try:
+            return pickle.loads(data)
+        except (pickle.UnpicklingError, AttributeError, ImportError) as e:
+            raise ValueError(e)
+
+    def dump(self, value, fh):
+        pickle.dump(value, fh, pickle.HIGHEST_PROTOCOL)
+
+
+def matcher_key(device):
+    """
+    :return: key of the current configuration of the device
+    """
+    version = ConfigVersion.objects.filter(device=device, current_active=True).order_by('-pk').first()
+    if version is not None and version.digest:
+        content = version.digest
+    else:
+        content = repr(list(Policy.objects.filter(device=device).order_by('pk').values_list(
+            'policyid', 'sequence', 'action', 'source__fingerprint', 'destination__fingerprint',
+            'srczone__fingerprint', 'dstzone__fingerprint', 'services__fingerprint')))
+    return hashlib.sha256(('%d:%s' % (device.pk, content)).encode('utf-8')).hexdigest()
+
+
+def compiled_matcher(device, cache=None):
+    """
+    :param cache: MatcherCache shared with other processes, or None
+    :return: (PolicyMatcher of the device's current policies, True if it was read from a cache)
+    """
+    key = matcher_key(device)
+    cached = _matchers.get(device.pk)
+    if cached is not None and cached[0] == key:
+        return cached[1], True
+    matcher = cache.get(key) if cache is not None else None
+    fromcache = matcher is not None
+    if matcher is None:
+        matcher = PolicyMatcher(PolicyIntervals(device))
+        if cache is not None:
+            cache.put(key, matcher)
+    _matchers[device.pk] = (key, matcher)
+    return matcher, fromcache
@@ -0,0 +1,160 @@
+"""
+Per phase profiling of the import and export commands.
+
+PhaseProfiler records wall time, CPU time, the number and duration of SQL queries and the tracemalloc peak of named
+phases. Phases may be nested and a name may be used several times (e.g. once per VDOM), the measurements of a name
+are summed up and its peak is the highest peak seen.
+
+Django 1.11 has no execute_wrapper() (added in 2.0), queries are counted by enabling the debug cursor and temporarily
+replacing the connection's queries_log with a collector which forwards every entry to the original log.
+"""
+
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from django.db import connections
+
+
+class QueryCollector(object):
+    """
+    Stand-in for connection.queries_log counting the logged queries
+    """
+    def __init__(self, log):
+        self.log = log
+        # connection.queries compares the length of the log with its maxlen
+        self.maxlen = log.maxlen
+        self.count = 0
+        self.seconds = 0.0
+
+    def append(self, entry):
+        self.count += 1
+        self.seconds += float(entry['time'])
+        self.log.append(entry)
+
+    def clear(self):
+        self.log.clear()
+
+    def __iter__(self):
+        return iter(self.log)
+
+    def __len__(self):
+        return len(self.log)
+
+
+class PhaseProfiler(object):
+    FIELDS = ('calls', 'wall', 'cpu', 'queries', 'query_time', 'peak_memory')
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = OrderedDict()
+        self.stack = []
+        self.collectors = []
+        self.started_tracemalloc = False
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        if not self.stack:
+            self.install()
+        elif tracemalloc.is_tracing():
+            # The peak of the enclosing phase would be lost by the reset below
+            parent = self.stack[-1]
+            parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.phases.setdefault(name, dict((f, 0) for f in self.FIELDS))
+        self.stack.append({
+            'name': name,
+            'wall': time.perf_counter(),
+            'cpu': time.process_time(),
+            'queries': sum(c.count for c in self.collectors),
+            'query_time': sum(c.seconds for c in self.collectors),
+            'peak': 0,
+        })
+
+    def stop(self):
+        if not self.enabled:
+            return
+        entry = self.stack.pop()
+        peak = max(entry['peak'], tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0)
+        stats = self.phases[entry['name']]
+        stats['calls'] += 1
+        stats['wall'] += time.perf_counter() - entry['wall']
+        stats['cpu'] += time.process_time() - entry['cpu']
+        stats['queries'] += sum(c.count for c in self.collectors) - entry['queries']
+        stats['query_time'] += sum(c.seconds for c in self.collectors) - entry['query_time']
+        stats['peak_memory'] = max(stats['peak_memory'], peak)
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+        else:
+            self.uninstall()
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def finish(self):
+        """
+        Stop the phases which are still running, e.g. after an exception
+        """
+        while self.stack:
+            self.stop()
+
+    def install(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        for connection in connections.all():
+            collector = QueryCollector(connection.queries_log)
+            collector.connection = connection
+            collector.force_debug_cursor = connection.force_debug_cursor
+            connection.queries_log = collector
+            connection.force_debug_cursor = True
+            self.collectors.append(collector)
+
+    def uninstall(self):
+        for collector in self.collectors:
+            collector.connection.queries_log = collector.log
+            collector.connection.force_debug_cursor = collector.force_debug_cursor
+        # The totals of the collectors are kept by the phases, the next outermost phase starts from zero
+        self.collectors = []
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def report(self):
+        """
+        :return: list of {'phase': name, field: value} dicts in the order the phases were first started
+        """
+        return [OrderedDict([('phase', name)] + [(f, stats[f]) for f in self.FIELDS])
+                for name, stats in self.phases.items()]
+
+    def print_summary(self):
+        if not self.phases:
+            return
+        width = max(len('Phase'), max(len(name) for name in self.phases))
+        print("\n%-*s  %5s  %9s  %9s  %8s  %9s  %10s" % (width, 'Phase', 'Calls', 'Wall', 'CPU', 'Queries',
+                                                         'SQL time', 'Peak MiB'))
+        for row in self.report():
+            print("%-*s  %5d  %8.3fs  %8.3fs  %8d  %8.3fs  %10.1f" % (
+                width, row['phase'], row['calls'], row['wall'], row['cpu'], row['queries'], row['query_time'],
+                row['peak_memory'] / 1048576.0))
+
+    def write_json(self, path):
+        with open(path, 'w') as fh:
+            json.dump({'phases': self.report()}, fh, indent=2)
+
+
+class Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.start(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.stop()
+        return False
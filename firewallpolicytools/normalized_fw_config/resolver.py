@@ -0,0 +1,87 @@
+"""
+Name resolution for the objects of one Device during an import.
+"""
+
+from collections import OrderedDict
+
+
+class ObjectResolver(object):
+    """
+    Per-import cache resolving object names of one Device.
+
+    The objects of a model are loaded with a single query the first time one of its names is looked up. Since the
+    cache holds every object of the model, a name missing from it does not exist and negative lookups never reach
+    the database either. Names that do not resolve are recorded together with the place they were referenced from,
+    so they can be reported after the import instead of being dropped silently.
+
+    The caches are not refreshed automatically: look up names of a model only after its objects have been written,
+    or hand the new objects over with update().
+    """
+    def __init__(self, device, pks=False):
+        """
+        :param pks: cache primary keys instead of model instances
+        """
+        self.device = device
+        self.pks = pks
+        self.caches = {}
+        # (context, name) of every reference which could not be resolved
+        self.unresolved = []
+
+    def cache(self, model):
+        if model not in self.caches:
+            qs = model.objects.filter(device=self.device)
+            if self.pks:
+                self.caches[model] = dict(qs.values_list('name', 'pk'))
+            else:
+                self.caches[model] = dict((obj.name, obj) for obj in qs)
+        return self.caches[model]
+
+    def update(self, model, objects):
+        """
+        Replace the cache of a model
+
+        :param objects: {name: object or pk}
+        """
+        self.caches[model] = objects
+
+    def resolve(self, name, models, context=None):
+        """
+        Look a name up in the objects of several models, in order
+
+        :param models: tuple of models, e.g. (AddressObject, AddressGroup)
+        :param context: where the name is referenced from, recorded when it can not be resolved
+        :return: (model, object) of the first model having an object with this name, or (None, None)
+        """
+        for model in models:
+            obj = self.cache(model).get(name)
+            if obj is not None:
+                return model, obj
+        if context is not None:
+            self.unresolved.append((context, name))
+        return None, None
+
+    def resolve_all(self, names, models, context=None):
+        """
+        Resolve several names, grouping the results by model
+
+        :return: OrderedDict {model: [objects]} with an entry (possibly empty) for every model
+        """
+        found = OrderedDict((model, []) for model in models)
+        for name in names:
+            model, obj = self.resolve(name, models, context)
+            if model is not None:
+                found[model].append(obj)
+        return found
+
+    def report(self, limit=20):
+        """
+        :return: lines describing the unresolved references
+        """
+        if not self.unresolved:
+            return []
+        lines = ["Unresolved references: %d" % len(self.unresolved)]
+        for context, name in self.unresolved[:limit]:
+            lines.append("  %s: %s" % (context, name))
+        if len(self.unresolved) > limit:
+            lines.append("  ... %d more" % (len(self.unresolved) - limit))
+        return lines
@@ -0,0 +1,240 @@
+"""
+Synthetic FortiGate configurations for benchmarks and tests.
+
+generate_config() writes a configuration with the given number of policies in the format parse_config() reads. The
+objects are scaled with the number of policies: hosts, networks, ranges and FQDNs, address groups of very different
+sizes, custom services with several TCP/UDP port ranges (some with source ports), ICMP and IP protocol services,
+service groups and policies with several interfaces, addresses and services per field. A part of the addresses lies
+in INSIDE_NETS, so the ASA export has policies to classify in both directions.
+
+The same arguments and seed always produce the same file.
+"""
+
+import ipaddress
+import random
+from collections import OrderedDict
+
+# The monitored networks of the ASA export
+INSIDE_NETS = ('10.21.32.0/19', '10.21.128.0/19', '10.21.160.0/20')
+OUTSIDE_NETS = ('10.0.0.0/9', '172.16.0.0/12', '192.168.0.0/16', '198.51.100.0/24', '203.0.113.0/24')
+INSIDE_RATIO = 0.3
+# Share of the policies which deny
+DENY_RATIO = 0.1
+
+WELL_KNOWN_SERVICES = (
+    ('HTTP', 'tcp-portrange', '80'),
+    ('HTTPS', 'tcp-portrange', '443'),
+    ('SSH', 'tcp-portrange', '22'),
+    ('DNS', 'udp-portrange', '53'),
+    ('NTP', 'udp-portrange', '123'),
+    ('SMTP', 'tcp-portrange', '25 465 587'),
+    ('RDP', 'tcp-portrange', '3389'),
+    ('LDAP', 'tcp-portrange', '389 636'),
+)
+
+
+def quote(name):
+    return '"%s"' % name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def quoted_list(names):
+    return ' '.join(quote(n) for n in names)
+
+
+def group_size(rng, limit):
+    """
+    Member count of a group: mostly small groups and a few very large ones
+    """
+    return max(2, min(limit, int(rng.paretovariate(1.1) * 2)))
+
+
+class SyntheticVDOM(object):
+    """
+    Objects of one generated VDOM
+    """
+    def __init__(self, rng, name, interfaces, policies):
+        self.rng = rng
+        self.name = name
+        self.interfaces = interfaces
+        self.npolicies = policies
+        self.addresses = OrderedDict()
+        self.addrgroups = OrderedDict()
+        self.services = OrderedDict()
+        self.servicegroups = OrderedDict()
+
+    def random_network(self, prefixlen):
+        pool = INSIDE_NETS if self.rng.random() < INSIDE_RATIO else OUTSIDE_NETS
+        parent = ipaddress.IPv4Network(self.rng.choice(pool))
+        prefixlen = max(prefixlen, parent.prefixlen)
+        offset = self.rng.randrange(parent.num_addresses >> (32 - prefixlen))
+        return ipaddress.IPv4Network((int(parent.network_address) + (offset << (32 - prefixlen)), prefixlen))
+
+    def add_addresses(self, count):
+        self.addresses['all'] = {}
+        while len(self.addresses) < count + 1:
+            kind = self.rng.random()
+            if kind < 0.55:
+                host = self.random_network(32).network_address
+                self.addresses['h-%s' % host] = OrderedDict([('subnet', '%s 255.255.255.255' % host)])
+            elif kind < 0.85:
+                net = self.random_network(self.rng.choice((16, 20, 22, 24, 24, 24, 26, 28, 30)))
+                self.addresses[str(net)] = OrderedDict([('subnet', '%s %s' % (net.network_address, net.netmask))])
+            elif kind < 0.95:
+                net = self.random_network(24)
+                start = self.rng.randrange(1, 200)
+                end = start + self.rng.randrange(1, 50)
+                startip, endip = net.network_address + start, net.network_address + end
+                self.addresses['r-%s-%s' % (startip, endip)] = OrderedDict([
+                    ('type', 'iprange'), ('start-ip', str(startip)), ('end-ip', str(endip))])
+            else:
+                fqdn = 'app%d.%s.example.com' % (len(self.addresses), self.name)
+                self.addresses[fqdn] = OrderedDict([('type', 'fqdn'), ('fqdn', fqdn)])
+
+    def add_addrgroups(self, count):
+        names = list(self.addresses)[1:]
+        for i in range(count):
+            members = self.rng.sample(names, min(len(names), group_size(self.rng, 64)))
+            self.addrgroups['grp-%s-%d' % (self.name, i)] = OrderedDict([('member', quoted_list(members))])
+
+    def port_range(self):
+        low = self.rng.choice((self.rng.randrange(1, 1024), self.rng.randrange(1024, 65000)))
+        portrange = str(low)
+        if self.rng.random() < 0.3:
+            portrange += '-%d' % min(65535, low + self.rng.randrange(1, 500))
+        if self.rng.random() < 0.05:
+            portrange += ':1024-65535'
+        return portrange
+
+    def add_services(self, count):
+        for name, key, ranges in WELL_KNOWN_SERVICES[:count]:
+            self.services[name] = OrderedDict([(key, ranges)])
+        while len(self.services) < count:
+            name = 'svc-%s-%d' % (self.name, len(self.services))
+            kind = self.rng.random()
+            if kind < 0.05:
+                icmptype = self.rng.choice((0, 3, 8, 11))
+                self.services[name] = OrderedDict([('protocol', 'ICMP'), ('icmptype', str(icmptype))])
+            elif kind < 0.08:
+                number = self.rng.choice((47, 50, 51, 89))
+                self.services[name] = OrderedDict([('protocol', 'IP'), ('protocol-number', str(number))])
+            else:
+                obj = OrderedDict()
+                for key in ('tcp-portrange', 'udp-portrange'):
+                    if not obj or self.rng.random() < 0.2:
+                        obj[key] = ' '.join(self.port_range() for j in range(self.rng.choice((1, 1, 1, 2, 3, 4))))
+                self.services[name] = obj
+
+    def add_servicegroups(self, count):
+        names = list(self.services)
+        for i in range(count):
+            members = self.rng.sample(names, min(len(names), group_size(self.rng, 16)))
+            self.servicegroups['svcgrp-%s-%d' % (self.name, i)] = OrderedDict([('member', quoted_list(members))])
+
+    def policy_members(self, objects, groups, limit):
+        """
+        Names for one address or service field of a policy, a mix of objects and groups
+        """
+        count = self.rng.choice((1, 1, 1, 1, 2, 2, 3, 5, 8))
+        names = []
+        for i in range(count):
+            if groups and self.rng.random() < 0.25:
+                names.append(self.rng.choice(groups))
+            else:
+                names.append(self.rng.choice(objects))
+        return list(OrderedDict.fromkeys(names))[:limit]
+
+    def policies(self, deny_ratio):
+        """
+        :return: generator of (policyid, settings) in rule order, a few policies are moved away from their id order
+        """
+        ids = list(range(1, self.npolicies + 1))
+        for i in range(len(ids) // 20):
+            a, b = self.rng.randrange(len(ids)), self.rng.randrange(len(ids))
+            ids[a], ids[b] = ids[b], ids[a]
+        addresses = list(self.addresses)[1:]
+        addrgroups = list(self.addrgroups)
+        services = list(self.services)
+        servicegroups = list(self.servicegroups)
+        for policyid in ids:
+            srcintf, dstintf = self.rng.sample(self.interfaces, 2)
+            obj = OrderedDict([('srcintf', quote(srcintf)), ('dstintf', quote(dstintf))])
+            obj['srcaddr'] = quoted_list(self.policy_members(addresses, addrgroups, 10))
+            if self.rng.random() < 0.05:
+                obj['dstaddr'] = quote('all')
+            else:
+                obj['dstaddr'] = quoted_list(self.policy_members(addresses, addrgroups, 10))
+            if self.rng.random() >= deny_ratio:
+                # A policy without an action denies
+                obj['action'] = 'accept'
+            obj['schedule'] = quote('always')
+            obj['service'] = quoted_list(self.policy_members(services, servicegroups, 4))
+            obj['logtraffic'] = 'all'
+            yield policyid, obj
+
+
+def write_section(fh, section, entries, quoted=True):
+    fh.write('config %s\n' % section)
+    for name, obj in entries:
+        fh.write('    edit %s\n' % (quote(name) if quoted else name))
+        for key, value in obj.items():
+            fh.write('        set %s %s\n' % (key, value))
+        fh.write('    next\n')
+    fh.write('end\n')
+
+
+def generate_config(fh, policies, vdoms=1, seed=0, hostname=None, deny_ratio=DENY_RATIO):
+    """
+    Write a synthetic configuration
+
+    :param fh: text file object
+    :param policies: number of policies per VDOM
+    :param vdoms: number of VDOMs
+    :param seed: seed of the random generator
+    :param hostname: defaults to FGT-SYNTH-<policies>
+    :param deny_ratio: share of policies without 'set action accept'
+    :return: OrderedDict of the object counts of all VDOMs by section
+    """
+    rng = random.Random(seed)
+    hostname = hostname or 'FGT-SYNTH-%d' % policies
+    vdomnames = ['root'] + ['vdom%d' % i for i in range(1, vdoms)]
+    interfaces = OrderedDict()
+    for i, vdom in enumerate(vdomnames):
+        for j in range(rng.randrange(4, 9)):
+            interfaces['port%d' % (len(interfaces) + 1)] = (vdom, '10.%d.%d.1 255.255.255.0' % (200 + i, j))
+
+    fh.write('#config-version=FGVM64-5.06-FW-build1700-190130:opmode=0:vdom=1:user=admin\n')
+    fh.write('config vdom\n')
+    for vdom in vdomnames:
+        fh.write('edit %s\nnext\n' % vdom)
+    fh.write('end\nconfig global\n')
+    fh.write('config system global\n    set hostname %s\nend\n' % quote(hostname))
+    fh.write('config system interface\n')
+    for name, (vdom, ip) in interfaces.items():
+        fh.write('    edit %s\n        set vdom %s\n        set ip %s\n        set type physical\n    next\n' % (
+            quote(name), quote(vdom), ip))
+    fh.write('end\nend\n')
+
+    counts = OrderedDict((section, 0) for section in ('firewall address', 'firewall addrgrp',
+                                                      'firewall service custom', 'firewall service group',
+                                                      'firewall policy'))
+    fh.write('config vdom\n')
+    for vdom in vdomnames:
+        synthetic = SyntheticVDOM(rng, vdom, [n for n, (v, ip) in interfaces.items() if v == vdom], policies)
+        synthetic.add_addresses(max(16, policies))
+        synthetic.add_addrgroups(max(4, policies // 10))
+        synthetic.add_services(max(len(WELL_KNOWN_SERVICES), policies // 20))
+        synthetic.add_servicegroups(max(2, policies // 200))
+        fh.write('edit %s\n' % vdom)
+        write_section(fh, 'firewall address', synthetic.addresses.items())
+        write_section(fh, 'firewall addrgrp', synthetic.addrgroups.items())
+        write_section(fh, 'firewall service custom', synthetic.services.items())
+        write_section(fh, 'firewall service group', synthetic.servicegroups.items())
+        write_section(fh, 'firewall policy', synthetic.policies(deny_ratio), quoted=False)
+        fh.write('next\n')
+        counts['firewall address'] += len(synthetic.addresses)
+        counts['firewall addrgrp'] += len(synthetic.addrgroups)
+        counts['firewall service custom'] += len(synthetic.services)
+        counts['firewall service group'] += len(synthetic.servicegroups)
+        counts['firewall policy'] += policies
+    fh.write('end\n')
+    return counts
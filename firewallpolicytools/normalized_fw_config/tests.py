@@ -1,3 +1,1067 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.forms import modelform_factory
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from normalized_fw_config import addressarrays, blobstore, policymatch
+from normalized_fw_config.admin import PolicyAddrSetAdmin, PolicySetForm
+from normalized_fw_config.acecost import ACECostModel, acl_totals
+from normalized_fw_config.anomalies import DimensionIndex, PolicyAnomalies
+from normalized_fw_config.aclcompact import ACLCompactor, network_members, service_members
+from normalized_fw_config.models import *
+from normalized_fw_config.flowreplay import FlowReader, FlowReplay
+from normalized_fw_config.fgtparser import tokenize, parse_config, find_hostname, split_tokens, value_list
+from normalized_fw_config.profiling import PhaseProfiler, QueryCollector
+from normalized_fw_config.parsecache import ParseCache, load_config
+from normalized_fw_config.ingest import stage_vdom, vdom_sections, validate_staged, BulkIngest
+from normalized_fw_config.intervals import INSIDE, OUTSIDE, PARTIAL, NetworkClassifier, cidr_blocks, ip_to_int
+from normalized_fw_config.policygraph import load_policies
+from normalized_fw_config.policymatch import MatcherCache, compiled_matcher
+from normalized_fw_config.resolver import ObjectResolver
+from normalized_fw_config.routing import RouteTable, parse_route
+from normalized_fw_config.synthetic import generate_config
+from normalized_fw_config.management.commands.parsefgconfig import populate_addressobjs, populate_addrgrpobjects, \
+    populate_serviceobjects, populate_policies
+
+SAMPLE_VDOM_CONFIG = """#config-version=FGT3HD-5.02-FW-build718-170329:opmode=0:vdom=1:user=admin
+config vdom
+edit root
+next
+end
+config global
+config system global
+    set hostname "FGT-LAB"
+end
+config system interface
+    edit "port1"
+        set vdom "root"
+        set ip 10.0.0.1 255.255.255.0
+    next
+end
+end
+config vdom
+edit root
+config firewall address
+    edit "all"
+    next
+    edit "net_10.1.0.0/16"
+        set subnet 10.1.0.0 255.255.0.0
+        set comment "Branch \\"A\\" network"
+    next
+    edit "host 1"
+        set subnet 10.1.1.1 255.255.255.255
+    next
+end
+config firewall addrgrp
+    edit "grp1"
+        set member "host 1" "net_10.1.0.0/16"
+    next
+end
+config firewall service custom
+    edit "HTTP"
+        set tcp-portrange 80 8080-8081
+    next
+end
+config firewall policy
+    edit 1
+        set srcintf "port1"
+        set dstintf "port1"
+        set srcaddr "grp1"
+        set dstaddr "all"
+        set action accept
+        set service "HTTP"
+    next
+end
+next
+end
+"""
+
+
+class FortiGateTokenizerTests(SimpleTestCase):
+    def test_quoted_tokens(self):
+        self.assertEqual(split_tokens('set member "host 1" "b\\"c" d'), ['set', 'member', 'host 1', 'b"c', 'd'])
+
+    def test_multiline_quoted_value(self):
+        config = io.StringIO('config vpn certificate local\nedit "c1"\nset certificate "-----BEGIN\nabc\n-----END"\n'
+                             'next\nend\n')
+        events = list(tokenize(config))
+        self.assertEqual(events[2], (('vpn certificate local', 'c1'), 'set', 'certificate', '-----BEGIN\nabc\n-----END'))
+        self.assertEqual(events[-1], (('vpn certificate local',), 'end', None, None))
+
+    def test_parse_config_tree(self):
+        configdict = parse_config(io.StringIO(SAMPLE_VDOM_CONFIG))
+        self.assertEqual(find_hostname(configdict), 'FGT-LAB')
+        root = configdict['vdom']['root']
+        self.assertEqual(root['firewall address']['net_10.1.0.0/16']['comment'], 'Branch "A" network')
+        self.assertEqual(value_list(root['firewall addrgrp']['grp1']['member']), ['host 1', 'net_10.1.0.0/16'])
+        self.assertEqual(root['firewall address']['host 1']['subnet'], ['10.1.1.1', '255.255.255.255'])
+        self.assertEqual(root['firewall policy']['1']['action'], 'accept')
+        self.assertEqual(configdict['global']['system interface']['port1']['vdom'], 'root')
+
+
+class MigrationTests(TestCase):
+    def test_migrations_cover_the_models(self):
+        output = io.StringIO()
+        try:
+            call_command('makemigrations', 'normalized_fw_config', check=True, dry_run=True, stdout=output)
+        except SystemExit:
+            self.fail("Model changes without a migration:\n%s" % output.getvalue())
+
+
+class ParseFortiGateConfigCommandTests(TestCase):
+    def setUp(self):
+        temp_parse_cache(self)
+        self.configfile = tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False)
+        self.configfile.write(SAMPLE_VDOM_CONFIG)
+        self.configfile.close()
+        self.addCleanup(os.unlink, self.configfile.name)
+
+    def import_config(self, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('parsefgconfig', '-f', self.configfile.name, *args)
+
+    def test_import(self):
+        self.import_config()
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        self.assertEqual(AddressObject.objects.get(device=device, name='host 1').type, 'ip4')
+        grp = AddressGroup.objects.get(device=device, name='grp1')
+        self.assertEqual(sorted(m.name for m in grp.members.all()), ['host 1', 'net_10.1.0.0/16'])
+        http = CompoundServiceObject.objects.get(device=device, name='HTTP')
+        self.assertEqual(sorted(m.name for m in http.members.all()), ['tcp-80', 'tcp-8080-8081'])
+        policy = Policy.objects.get(device=device, policyid=1)
+        self.assertEqual([a.name for a in policy.source.addressgroups.all()], ['grp1'])
+        self.assertEqual([a.name for a in policy.destination.addresses.all()], ['all'])
+        self.assertEqual(policy.action, 'permit')
+
+    def test_import_deny_policy(self):
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set action accept', 'set action deny'))
+        self.import_config()
+        self.assertEqual(Policy.objects.get(device__hostname='FGT-LAB', policyid=1).action, 'deny')
+
+    def test_fast_import_rolls_back_failed_vdom(self):
+        broken = SAMPLE_VDOM_CONFIG.replace('config vdom\nedit root\nconfig firewall address', '''config vdom
+edit broken
+config firewall address
+    edit "h1"
+        set subnet 10.9.9.9 255.255.255.255
+    next
+end
+config firewall addrgrp
+    edit "g1"
+        set member "h1" "missing"
+    next
+end
+next
+edit root
+config firewall address''')
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(broken)
+        with self.assertRaisesMessage(CommandError, 'broken'):
+            self.import_config('--fast')
+        self.assertFalse(Device.objects.filter(vsys='broken').exists())
+        self.assertFalse(AddressObject.objects.filter(name='h1').exists())
+        self.assertTrue(Policy.objects.filter(device__vsys='root', policyid=1).exists())
+
+    def test_parallel_import_matches_serial(self):
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG + scaled_config(20).replace('edit root', 'edit branch'))
+        self.import_config('--bulk')
+        serial = [device_snapshot(d) for d in Device.objects.order_by('vsys')]
+        Device.objects.all().delete()
+        self.import_config('--workers', '2')
+        self.assertEqual([d.vsys for d in Device.objects.order_by('vsys')], ['branch', 'root'])
+        self.assertEqual([device_snapshot(d) for d in Device.objects.order_by('vsys')], serial)
+
+    def test_batch_import_reports_failed_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, config in (('a.conf', SAMPLE_VDOM_CONFIG), ('b.conf', 'config system dns\nend\n'),
+                             ('c.conf', SAMPLE_VDOM_CONFIG.replace('FGT-LAB', 'FGT-LAB2'))):
+            with open(os.path.join(directory, name), 'w') as configfile:
+                configfile.write(config)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaisesMessage(CommandError, '1 of 3 files failed'):
+            call_command('parsefgconfig-batch', directory, '--workers', '2', '--bulk')
+        self.assertEqual(sorted(Device.objects.values_list('hostname', flat=True)), ['FGT-LAB', 'FGT-LAB2'])
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split()[1] for line in lines if line.startswith(directory)], ['ok', 'FAILED', 'ok'])
+        self.assertIn('No hostname found', output.getvalue())
+
+    def test_batch_import_deny_policy(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'a.conf'), 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set action accept', 'set action deny'))
+        with contextlib.redirect_stdout(io.StringIO()), mock.patch('builtins.input', side_effect=AssertionError):
+            call_command('parsefgconfig-batch', directory, '--workers', '1')
+        self.assertEqual(Policy.objects.get(device__hostname='FGT-LAB', policyid=1).action, 'deny')
+
+    def test_incremental_reimport_without_changes(self):
+        self.import_config('--incremental')
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        version = ConfigVersion.objects.get(device=device, current_active=True)
+        self.assertEqual(AddressObject.objects.get(device=device, name='host 1').configs.get(), version)
+        with CaptureQueriesContext(connection) as queries:
+            self.import_config('--incremental')
+        writes = [q['sql'] for q in queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual([sql.split(' SET ')[0] for sql in writes], ['UPDATE "normalized_fw_config_device"'])
+        self.assertEqual(ConfigVersion.objects.filter(device=device).count(), 1)
+        self.assertEqual(RawConfigFile.objects.count(), 1)
+
+    def test_incremental_reimport_writes_changes(self):
+        self.import_config('--incremental')
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        first = ConfigVersion.objects.get(device=device, current_active=True)
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set member "host 1" "net_10.1.0.0/16"', 'set member "host 1"')
+                             .replace('    edit "all"\n    next\n', ''))
+        self.import_config('--incremental')
+        version = ConfigVersion.objects.get(device=device, current_active=True)
+        self.assertNotEqual(version, first)
+        self.assertEqual(ConfigVersion.objects.get(pk=first.pk).objectdigests, '')
+        grp = AddressGroup.objects.get(device=device, name='grp1')
+        self.assertEqual([m.name for m in grp.members.all()], ['host 1'])
+        self.assertEqual(list(grp.configs.order_by("pk")), [first, version])
+        self.assertFalse(AddressObject.objects.filter(device=device, name='all').exists())
+        self.assertEqual(list(AddressObject.objects.get(device=device, name='host 1').configs.all()), [first])
+
+    def test_incremental_reimport_after_full_import(self):
+        self.import_config('--incremental')
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set action accept', 'set action deny'))
+        self.import_config('--bulk')
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        self.assertEqual(ConfigVersion.objects.filter(device=device, current_active=True).count(), 1)
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG)
+        self.import_config('--incremental')
+        self.assertEqual(Policy.objects.get(device=device, policyid=1).action, 'permit')
+
+    def test_bulk_import_matches_legacy(self):
+        self.import_config()
+        legacy = device_snapshot(Device.objects.get(hostname='FGT-LAB', vsys='root'))
+        Device.objects.all().delete()
+        self.import_config('--bulk')
+        self.assertEqual(device_snapshot(Device.objects.get(hostname='FGT-LAB', vsys='root')), legacy)
+
+    def test_bulk_reimport_writes_nothing(self):
+        self.import_config('--bulk')
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        staged = stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG))
+        self.assertEqual(BulkIngest(device).apply(staged), {})
+
+    def test_bulk_reimport_updates_changed_rows(self):
+        self.import_config('--bulk')
+        device = Device.objects.get(hostname='FGT-LAB', vsys='root')
+        changed = SAMPLE_VDOM_CONFIG.replace('10.1.1.1 255.255.255.255', '10.1.1.0 255.255.255.0').replace(
+            'set dstaddr "all"', 'set dstaddr "host 1"')
+        staged = stage_vdom('root', *sample_sections(changed))
+        stats = BulkIngest(device).apply(staged)
+        self.assertEqual(stats[('updated', 'AddressObject')], 1)
+        self.assertEqual(stats[('updated', 'Policy')], 1)
+        host = AddressObject.objects.get(device=device, name='host 1')
+        self.assertEqual((host.type, host.start_ip, host.prefixlen), ('net4', '10.1.1.0', 24))
+        policy = Policy.objects.get(device=device, policyid=1)
+        self.assertEqual([a.name for a in policy.destination.addresses.all()], ['host 1'])
+
+    def test_bulk_query_count_is_constant(self):
+        counts = []
+        for size in (5, 50):
+            device = Device.objects.create(hostname='FGT-SCALE', vsys='size%d' % size, devtype='fgt52')
+            staged = stage_vdom(device.vsys, *sample_sections(scaled_config(size)))
+            with CaptureQueriesContext(connection) as queries:
+                BulkIngest(device).apply(staged)
+            counts.append(len(queries))
+            self.assertEqual(Policy.objects.filter(device=device).count(), size)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_dry_run_does_not_touch_the_database(self):
+        output = io.StringIO()
+        with CaptureQueriesContext(connection) as queries, contextlib.redirect_stdout(output):
+            call_command('parsefgconfig', '-f', self.configfile.name, '-d', 'y')
+        self.assertEqual(len(queries), 0)
+        self.assertIn('Would write:\n  AddressObject: 3\n  AddressGroup: 1\n  ServiceObject: 2\n', output.getvalue())
+        self.assertFalse(Device.objects.exists())
+
+    def test_dry_run_fails_on_missing_group_members(self):
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set member "host 1" "net_10.1.0.0/16"',
+                                                        'set member "host 1" "missing"'))
+        with self.assertRaisesMessage(CommandError, 'root'):
+            self.import_config('-d', 'y')
+
+    def test_unresolved_policy_members_are_reported(self):
+        with open(self.configfile.name, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG.replace('set dstaddr "all"', 'set dstaddr "all" "missing"'))
+        for args in ((), ('--bulk',)):
+            Device.objects.all().delete()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                call_command('parsefgconfig', '-f', self.configfile.name, *args)
+            self.assertIn('Unresolved references: 1\n  policy 1 dstaddr: missing\n', output.getvalue())
+            policy = Policy.objects.get(device__vsys='root', policyid=1)
+            self.assertEqual([a.name for a in policy.destination.addresses.all()], ['all'])
+
+    def test_legacy_policy_import_loads_each_model_once(self):
+        device = Device.objects.create(hostname='FGT-SCALE', vsys='root', devtype='fgt52')
+        sections = sample_sections(scaled_config(30))
+        options = {'d': 'n'}
+        populate_addressobjs(device, sections[0], options)
+        populate_addrgrpobjects(device, sections[1], options)
+        populate_serviceobjects(device, sections[2], options)
+        resolver = ObjectResolver(device)
+        with CaptureQueriesContext(connection) as queries:
+            populate_policies(device, sections[6], options, resolver)
+        lookups = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and (
+            'FROM "normalized_fw_config_addressobject"' in q['sql'] or
+            'FROM "normalized_fw_config_addressgroup"' in q['sql'])]
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(resolver.unresolved, [])
+        self.assertEqual(Policy.objects.filter(device=device).count(), 30)
+
+
+def temp_parse_cache(testcase):
+    """
+    Point the parse cache of a test to a temporary directory
+    """
+    directory = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, directory, True)
+    override = override_settings(FGT_PARSE_CACHE_DIR=directory)
+    override.enable()
+    testcase.addCleanup(override.disable)
+    return directory
+
+
+def sample_sections(config, vdom='root'):
+    configdict = parse_config(io.StringIO(config))
+    return vdom_sections(configdict['vdom'][vdom], configdict['global'].get('system interface', {}))
+
+
+def scaled_config(size):
+    """
+    Build a single VDOM configuration with 'size' addresses, groups, services and policies
+    """
+    lines = ['config vdom', 'edit root', 'config firewall address']
+    for i in range(size):
+        lines += ['edit "h%d"' % i, 'set subnet 10.0.%d.%d 255.255.255.255' % (i // 256, i % 256), 'next']
+    lines += ['end', 'config firewall addrgrp']
+    for i in range(size):
+        lines += ['edit "g%d"' % i, 'set member "h%d" "h%d"' % (i, (i + 1) % size), 'next']
+    lines += ['end', 'config firewall service custom']
+    for i in range(size):
+        lines += ['edit "s%d"' % i, 'set tcp-portrange %d %d-%d' % (1000 + i, 2000 + i, 3000 + i), 'next']
+    lines += ['end', 'config firewall policy']
+    for i in range(size):
+        lines += ['edit %d' % (i + 1), 'set srcaddr "g%d"' % i, 'set dstaddr "h%d" "g%d"' % (i, (i + 1) % size),
+                  'set service "s%d"' % i, 'set action accept', 'next']
+    lines += ['end', 'next', 'end', 'config global', 'end']
+    return '\n'.join(lines) + '\n'
+
+
+def device_snapshot(device):
+    """
+    Return the objects of a device as comparable python structures, independent of primary keys
+    """
+    def names(qs):
+        return sorted(str(o) for o in qs)
+
+    snapshot = {
+        'addresses': sorted(AddressObject.objects.filter(device=device).values_list(
+            'name', 'type', 'start_ip', 'end_ip', 'prefixlen', 'fqdn')),
+        'services': sorted(ServiceObject.objects.filter(device=device).values_list(
+            'name', 'protocol', 'start_port', 'end_port', 'src_start_port', 'src_end_port')),
+        'addrgroups': sorted((g.name, names(g.members.all())) for g in AddressGroup.objects.filter(device=device)),
+        'compoundservices': sorted((c.name, names(c.members.all()))
+                                   for c in CompoundServiceObject.objects.filter(device=device)),
+        'servicegroups': sorted((g.name, names(g.members.all())) for g in ServiceGroup.objects.filter(device=device)),
+        'interfaces': names(Interface.objects.filter(device=device)),
+        'policies': [],
+    }
+    for policy in Policy.objects.filter(device=device).order_by('policyid'):
+        row = [policy.policyid, policy.sequence, policy.action]
+        for addrset in (policy.source, policy.destination):
+            row.append(addrset and (names(addrset.addresses.all()), names(addrset.addressgroups.all())))
+        for zoneset in (policy.srczone, policy.dstzone):
+            row.append(zoneset and (names(zoneset.interfaces.all()), names(zoneset.zones.all())))
+        row.append(policy.services and (names(policy.services.compoundservices.all()),
+                                        names(policy.services.servicegroups.all())))
+        snapshot['policies'].append(row)
+    return snapshot
+
+
+class PolicySetFingerprintTests(TestCase):
+    def test_backfill_merges_duplicate_sets(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        host = AddressObject.objects.create(device=device, name='h1', type='ip4', start_ip='10.0.0.1')
+        sets = []
+        for i in range(3):
+            addrset = PolicyAddrSet.objects.create()
+            addrset.addresses.add(host)
+            sets.append(addrset)
+        other = PolicyAddrSet.objects.create()
+        for i, addrset in enumerate(sets):
+            Policy.objects.create(device=device, policyid=i + 1, source=addrset, destination=other)
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('fingerprint-policy-sets')
+        self.assertEqual(PolicyAddrSet.objects.count(), 2)
+        self.assertEqual(set(Policy.objects.values_list('source', flat=True)), {sets[0].pk})
+        self.assertEqual(PolicyAddrSet.objects.get(pk=sets[0].pk).fingerprint, set_fingerprint([[host.pk], []]))
+        self.assertEqual(PolicyAddrSet.objects.get(pk=other.pk).fingerprint, set_fingerprint([[], []]))
+
+    def test_admin_rejects_members_of_another_set(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        host = AddressObject.objects.create(device=device, name='h1', type='ip4', start_ip='10.0.0.1')
+        groups = [AddressGroup.objects.create(device=device, name='g%d' % i) for i in range(2)]
+        existing, edited = PolicyAddrSet.objects.create(), PolicyAddrSet.objects.create()
+        existing.addresses.add(host)
+        existing.addressgroups.add(groups[0])
+        existing.update_fingerprint()
+        form_class = modelform_factory(PolicyAddrSet, form=PolicySetForm, fields=PolicyAddrSetAdmin.fields)
+        form = form_class({'addresses': [host.pk], 'addressgroups': [groups[0].pk]}, instance=edited)
+        self.assertFalse(form.is_valid())
+        self.assertIn('Policy set %d already has exactly these members' % existing.pk, str(form.errors))
+        form = form_class({'addresses': [host.pk], 'addressgroups': [groups[1].pk]}, instance=edited)
+        self.assertTrue(form.is_valid())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+    def query_plan(self, qs):
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, qs, table):
+        plan = self.query_plan(qs)
+        self.assertTrue([step for step in plan if table in step and 'USING' in step and 'INDEX' in step], plan)
+        self.assertFalse([step for step in plan if step.startswith('SCAN')], plan)
+
+    def test_hot_queries_use_indexes(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        # Importer: objects are looked up by (name, device), policies by (policyid, device)
+        for model in (AddressObject, ServiceObject, CompoundServiceObject, AddressGroup, ServiceGroup, Interface,
+                      ZoneObject):
+            self.assertUsesIndex(model.objects.filter(name='all', device=device), model._meta.db_table)
+        self.assertUsesIndex(Policy.objects.filter(policyid=1, device=device), Policy._meta.db_table)
+        self.assertUsesIndex(ConfigVersion.objects.filter(device=device, current_active=True).order_by('-pk'),
+                             ConfigVersion._meta.db_table)
+        # Exporter: the device is looked up by hostname and vsys, then its policies are read
+        devices = Device.objects.filter(hostname='FGT-LAB', vsys='root')
+        self.assertUsesIndex(devices, Device._meta.db_table)
+        self.assertUsesIndex(Policy.objects.filter(device__in=devices), Policy._meta.db_table)
+
+
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        # Small chunks, so a few KB of configuration already spans many of them
+        for name, value in (('MIN_CHUNK_SIZE', 512), ('MAX_CHUNK_SIZE', 2048), ('CHUNK_BOUNDARY', 8)):
+            patcher = mock.patch.object(blobstore, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.content = scaled_config(200).encode('utf-8')
+        temp_parse_cache(self)
+
+    def test_roundtrip(self):
+        for codec in sorted(blobstore.CODECS):
+            store = blobstore.BlobStore(codec=codec)
+            blob = store.put(io.BytesIO(self.content))
+            self.assertEqual((blob.digest, blob.size), (hashlib.sha256(self.content).hexdigest(), len(self.content)))
+            self.assertGreater(len(blob.chunks.split()), 5)
+            self.assertEqual(store.open(blob.digest).read(), self.content)
+
+    def test_identical_and_edited_content_share_chunks(self):
+        store = blobstore.BlobStore()
+        blob = store.put(io.BytesIO(self.content))
+        chunks = BlobChunk.objects.count()
+        self.assertEqual(store.put(io.BytesIO(self.content)), blob)
+        self.assertEqual((Blob.objects.count(), BlobChunk.objects.count()), (1, chunks))
+        edited = self.content.replace(b'set subnet 10.0.0.100 ', b'set subnet 10.0.1.100 ')
+        store.put(io.BytesIO(edited))
+        self.assertLessEqual(BlobChunk.objects.count(), chunks + 2)
+
+    def test_import_stores_raw_config(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG)
+        self.addCleanup(os.unlink, configfile.name)
+        for i in range(2):
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command('parsefgconfig', '-f', configfile.name, '--compression', 'lzma')
+        # Every import records its RawConfigFile, both refer to the same blob
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(set(RawConfigFile.objects.values_list('digest', flat=True)), {Blob.objects.get().digest})
+        rawconfig = RawConfigFile.objects.first()
+        self.assertEqual(rawconfig.size, len(SAMPLE_VDOM_CONFIG.encode('utf-8')))
+        self.assertEqual(rawconfig.configstr, SAMPLE_VDOM_CONFIG)
+
+
+class ParseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = temp_parse_cache(self)
+        self.configfile = os.path.join(self.directory, 'fgt.conf')
+        with open(self.configfile, 'w') as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG)
+
+    def test_second_load_is_cached(self):
+        cache = ParseCache()
+        configdict, cached = load_config(self.configfile, cache)
+        self.assertFalse(cached)
+        with mock.patch('normalized_fw_config.parsecache.parse_config') as parse:
+            self.assertEqual(load_config(self.configfile, cache), (configdict, True))
+        parse.assert_not_called()
+        with open(self.configfile, 'a') as configfile:
+            configfile.write('config firewall vip\nend\n')
+        self.assertFalse(load_config(self.configfile, cache)[1])
+        self.assertEqual(cache.purge(), 2)
+        self.assertEqual(cache.entries(), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ParseCache()
+        configdict = parse_config(io.StringIO(SAMPLE_VDOM_CONFIG))
+        cache.put('a', configdict)
+        size = cache.entries()[0][1]
+        cache.maxbytes = 2 * size
+        cache.put('b', configdict)
+        os.utime(cache.path('a'), (0, 0))
+        os.utime(cache.path('b'), (1, 1))
+        cache.get('a')
+        cache.put('c', configdict)
+        self.assertEqual([path for mtime, size, path in cache.entries()], [cache.path('a'), cache.path('c')])
+
+    def test_command_flags(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('parsefgconfig', '-f', self.configfile, '-d', 'y')
+            call_command('parsefgconfig', '-f', self.configfile, '-d', 'y')
+            call_command('parsefgconfig', '-f', self.configfile, '-d', 'y', '--no-cache')
+            call_command('parsefgconfig', '-f', self.configfile, '-d', 'y', '--purge-cache')
+        self.assertEqual(output.getvalue().count('Parsed configuration loaded from cache'), 1)
+        self.assertIn('Parse cache entries removed: 1', output.getvalue())
+
+
+class PhaseProfilerTests(TestCase):
+    def test_nested_phases(self):
+        profiler = PhaseProfiler()
+        with profiler.phase('outer'):
+            for i in range(2):
+                with profiler.phase('inner'):
+                    Device.objects.create(hostname='FGT-%d' % i, vsys='root', devtype='fgt52')
+                    data = [bytearray(1024) for j in range(1024)]
+            with CaptureQueriesContext(connection) as queries:
+                Device.objects.count()
+            self.assertEqual(len(queries), 1)
+        report = dict((row['phase'], row) for row in profiler.report())
+        self.assertEqual((report['outer']['calls'], report['inner']['calls']), (1, 2))
+        self.assertEqual((report['outer']['queries'], report['inner']['queries']), (3, 2))
+        self.assertGreater(report['inner']['peak_memory'], 1024 * 1024)
+        self.assertGreaterEqual(report['outer']['peak_memory'], report['inner']['peak_memory'])
+        self.assertFalse(isinstance(connection.queries_log, QueryCollector))
+
+    def test_command_report(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as configfile:
+            configfile.write(SAMPLE_VDOM_CONFIG)
+        self.addCleanup(os.unlink, configfile.name)
+        reportfile = configfile.name + '.json'
+        self.addCleanup(os.unlink, reportfile)
+        temp_parse_cache(self)
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('parsefgconfig', '-f', configfile.name, '--profile-json', reportfile)
+        with open(reportfile) as fh:
+            phases = dict((row['phase'], row) for row in json.load(fh)['phases'])
+        self.assertIn('parse', phases)
+        self.assertGreater(phases['populate_addressobjs']['queries'], 0)
+        self.assertGreaterEqual(phases['total']['queries'], phases['populate_policies']['queries'])
+
+
+class SyntheticConfigTests(TestCase):
+    def test_generated_config_imports_cleanly(self):
+        configs = []
+        for i in range(2):
+            fh = io.StringIO()
+            counts = generate_config(fh, 50, vdoms=2, seed=1)
+            configs.append(fh.getvalue())
+        self.assertEqual(configs[0], configs[1])
+        self.assertEqual(counts['firewall policy'], 100)
+        configdict = parse_config(io.StringIO(configs[0]))
+        self.assertEqual(sorted(configdict['vdom']), ['root', 'vdom1'])
+        actions = [p.get('action') for p in configdict['vdom']['root']['firewall policy'].values()]
+        self.assertTrue(0 < actions.count(None) < len(actions))
+        for vdom in configdict['vdom']:
+            sections = vdom_sections(configdict['vdom'][vdom], configdict['global']['system interface'])
+            missing, resolver = validate_staged(stage_vdom(vdom, *sections))
+            self.assertEqual((missing, resolver.unresolved), ([], []))
+
+    def test_benchmark_results(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, True)
+        resultsfile = os.path.join(workdir, 'results.jsonl')
+        for i in range(2):
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command('run-benchmarks', '--sizes', '20', '-o', resultsfile, '--workdir', workdir)
+        with open(resultsfile) as fh:
+            results = [json.loads(line) for line in fh]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(list(results[1]['stages']), ['parse', 'ingest', 'export'])
+        self.assertEqual(results[1]['objects']['firewall policy'], 20)
+        with contextlib.closing(sqlite3.connect(os.path.join(workdir, 'benchmark.sqlite3'))) as scratch:
+            self.assertEqual(scratch.execute('SELECT COUNT(*) FROM normalized_fw_config_policy').fetchone(), (20,))
+        self.assertFalse(Device.objects.exists())
+
+
+class PolicyGraphLoaderTests(TestCase):
+    def test_policy_structure(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG)))
+        policy, = load_policies(Device.objects.filter(pk=device.pk))
+        self.assertEqual((policy['policyid'], policy['action'], policy['device']), (1, 'permit', device.pk))
+        group, = policy['source']['addressgroups']
+        self.assertEqual(group['name'], 'grp1')
+        self.assertEqual(sorted(m['name'] for m in group['members']), ['host 1', 'net_10.1.0.0/16'])
+        self.assertEqual([(a['name'], a['start_ip'], a['prefixlen']) for a in policy['destination']['addresses']],
+                         [('all', '0.0.0.0', 0)])
+        http, = policy['services']['compoundservices']
+        self.assertEqual(sorted((m['protocol'], m['start_port'], m['end_port']) for m in http['members']),
+                         [(6, 80, None), (6, 8080, 8081)])
+
+    def test_policies_are_in_sequence_order(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG.replace(
+            'config firewall policy\n', 'config firewall policy\n    edit 5\n        set srcaddr "all"\n'
+            '        set dstaddr "all"\n        set service "HTTP"\n    next\n'))))
+        self.assertEqual([p['policyid'] for p in load_policies([device])], [5, 1])
+
+    def test_query_count_is_constant(self):
+        counts = []
+        for size in (5, 50):
+            device = Device.objects.create(hostname='FGT-SCALE', vsys='size%d' % size, devtype='fgt52')
+            BulkIngest(device).apply(stage_vdom(device.vsys, *sample_sections(scaled_config(size))))
+            with CaptureQueriesContext(connection) as queries:
+                policies = load_policies([device])
+            counts.append(len(queries))
+            self.assertEqual(len(policies), size)
+            self.assertEqual([m['name'] for m in policies[0]['source']['addressgroups'][0]['members']], ['h0', 'h1'])
+        self.assertEqual(counts[0], counts[1])
+
+
+def address(name, type, start_ip, end_ip=None, prefixlen=None):
+    return {'name': name, 'type': type, 'start_ip': start_ip, 'end_ip': end_ip, 'prefixlen': prefixlen}
+
+
+class NetworkClassifierTests(SimpleTestCase):
+    def test_cidr_blocks_match_summarize_address_range(self):
+        for first, last in (('10.0.0.0', '10.0.0.0'), ('10.0.0.1', '10.0.1.17'), ('0.0.0.0', '255.255.255.255'),
+                            ('10.21.31.255', '10.21.64.0'), ('255.255.255.254', '255.255.255.255')):
+            expected = [(int(n.network_address), n.prefixlen) for n in ipaddress.summarize_address_range(
+                ipaddress.IPv4Address(first), ipaddress.IPv4Address(last))]
+            self.assertEqual(cidr_blocks(ip_to_int(first), ip_to_int(last)), expected)
+
+    def test_classify(self):
+        classifier = NetworkClassifier(['10.21.32.0/19', '10.21.128.0/19', '10.21.160.0/20', '10.21.136.0/24'])
+        cases = (
+            (address('h', 'ip4', '10.21.140.5'), INSIDE),
+            (address('n', 'net4', '10.21.160.0', prefixlen=21), INSIDE),
+            # Contains monitored networks without lying within one of them
+            (address('n', 'net4', '10.21.128.0', prefixlen=18), OUTSIDE),
+            (address('all', 'net4', '0.0.0.0', prefixlen=0), OUTSIDE),
+            (address('r', 'range4', '10.21.63.250', '10.21.64.10'), PARTIAL),
+            (address('r', 'range4', '10.21.128.0', '10.21.175.255'), INSIDE),
+            (address('h', 'ip4', '10.21.64.1'), OUTSIDE),
+            (address('f', 'fqdn', None), None),
+        )
+        for addr, expected in cases:
+            self.assertEqual(classifier.classify(addr), expected, addr)
+        self.assertEqual(len(classifier.cache), len(cases))
+
+
+EXPORT_CONFIG = SAMPLE_VDOM_CONFIG.replace(
+    'set subnet 10.1.1.1 255.255.255.255',
+    'set subnet 10.21.33.9 255.255.255.255\n    next\n    edit "host 2"\n'
+    '        set subnet 10.21.130.5 255.255.255.255').replace(
+    'set member "host 1" "net_10.1.0.0/16"', 'set member "host 1"').replace(
+    'set dstaddr "all"', 'set dstaddr "host 2" "net_10.1.0.0/16"')
+
+
+class ACECostTests(TestCase):
+    def test_elements_per_policy_and_acl(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG.replace(
+            '    edit "host 1"\n',
+            '    edit "r1"\n        set type iprange\n        set start-ip 10.2.0.1\n        set end-ip 10.2.0.6\n'
+            '    next\n    edit "host 1"\n').replace(
+            'set member "host 1" "net_10.1.0.0/16"', 'set member "host 1" "net_10.1.0.0/16" "r1"').replace(
+            'set srcaddr "grp1"', 'set srcaddr "grp1" "host 1"'))))
+        with self.assertNumQueries(15):
+            policies = ACECostModel(Device.objects.filter(pk=device.pk)).estimate()
+        # host 1 counts once, the range 10.2.0.1-10.2.0.6 as 4 CIDR blocks, HTTP has two port ranges
+        self.assertEqual([(p['policyid'], p['acls'], p['sources'], p['destinations'], p['services'], p['total'])
+                          for p in policies], [(1, ['port1'], 6, 1, 2, 12)])
+        self.assertEqual(dict(acl_totals(policies)), {(device.pk, 'port1'): [1, 12]})
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('estimate-ace-count', '--top', '1')
+        self.assertIn('port1_in', output.getvalue())
+
+
+class PolicyAnomaliesTests(TestCase):
+    def test_dimension_index(self):
+        index = DimensionIndex([((0, 9),), ((3, 3), (20, 29)), ((12, 15),), ((0, 99),)])
+        self.assertEqual(index.overlapping(((10, 19),)), 0b1100)
+        self.assertEqual(index.overlapping(((5, 5), (25, 25))), 0b1011)
+        self.assertEqual(index.interval_overlapping((100, 200)), 0)
+
+    def test_shadowed_redundant_and_correlated_policies(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        policy = '    edit %d\n        set srcintf "port1"\n        set dstintf "port1"\n        set srcaddr "%s"\n' \
+                 '        set dstaddr "%s"\n%s        set service "HTTP"\n    next\n'
+        accept = '        set action accept\n'
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG.replace(
+            '        set service "HTTP"\n    next\n',
+            '        set service "HTTP"\n    next\n' + policy % (2, 'all', 'host 1', '') +
+            policy % (3, 'net_10.1.0.0/16', 'host 1', accept)).replace(
+            'config firewall policy\n', 'config firewall policy\n' + policy % (10, 'host 1', 'all', accept)))))
+        findings = PolicyAnomalies(device).analyze()
+        # 10 is matched by 1 after it, 2 denies part of the traffic of both, 3 is matched by 1 before it
+        self.assertEqual([(f['kind'], f['policyid'], f['other_policyid']) for f in findings],
+                         [('redundant', 10, 1), ('correlated', 2, 10), ('correlated', 2, 1), ('shadowed', 3, 1)])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('find-policy-anomalies', '--hostname', 'FGT-LAB', '--vsys', 'root', '--kind', 'shadowed')
+        self.assertIn('3 (permit) shadowed by 1 (permit)', output.getvalue())
+        self.assertIn('4 policies analyzed', output.getvalue())
+
+    def test_all_contains_fqdns(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG.replace(
+            '    edit "host 1"\n', '    edit "example"\n        set type fqdn\n        set fqdn "example.com"\n'
+            '    next\n    edit "host 1"\n').replace(
+            '        set service "HTTP"\n    next\n',
+            '        set service "HTTP"\n    next\n    edit 2\n        set srcintf "port1"\n'
+            '        set dstintf "port1"\n        set srcaddr "host 1"\n        set dstaddr "example"\n'
+            '        set action accept\n        set service "HTTP"\n    next\n'))))
+        findings = PolicyAnomalies(device).analyze()
+        self.assertEqual([(f['kind'], f['policyid'], f['other_policyid']) for f in findings], [('shadowed', 2, 1)])
+
+
+class PolicyMatcherTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(self.device).apply(stage_vdom('root', *sample_sections(SAMPLE_VDOM_CONFIG.replace(
+            '        set service "HTTP"\n    next\n',
+            '        set service "HTTP"\n    next\n    edit 2\n        set srcaddr "all"\n        set dstaddr "all"\n'
+            '        set service "HTTP"\n    next\n'))))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        patcher = mock.patch.dict(policymatch._matchers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lookup(self):
+        matcher = compiled_matcher(self.device)[0]
+        self.assertEqual(matcher.lookup('10.1.1.1', '8.8.8.8', 'tcp', 80)['policyid'], 1)
+        self.assertEqual(matcher.lookup('10.9.9.9', '8.8.8.8', 6, 8081, srczone='port1')['action'], 'deny')
+        self.assertEqual([p['policyid'] for p in matcher.matches('10.1.200.1', '8.8.8.8', 'TCP', 8080)], [1, 2])
+        self.assertIsNone(matcher.lookup('10.1.1.1', '8.8.8.8', 'tcp', 8082))
+        self.assertIsNone(matcher.lookup('10.1.1.1', '2001:db8::1', 'udp', 80))
+        with self.assertRaises(ValueError):
+            matcher.lookup('10.1.1.1', '8.8.8.8', 'tcp', 80, srczone='port9')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('match-policy', '10.1.1.1', '8.8.8.8', 'tcp', '443', '--all', '--no-cache',
+                         '--hostname', 'FGT-LAB', '--vsys', 'root')
+        self.assertIn('No policy matches', output.getvalue())
+
+    def test_matchers_are_cached_per_configuration(self):
+        cache = MatcherCache(self.directory)
+        ConfigVersion.objects.create(device=self.device, current_active=True, digest='1' * 64)
+        matcher, cached = compiled_matcher(self.device, cache)
+        self.assertFalse(cached)
+        with self.assertNumQueries(1):
+            self.assertEqual(compiled_matcher(self.device, cache), (matcher, True))
+        # Another process finds the matcher on disk
+        policymatch._matchers.clear()
+        with mock.patch('normalized_fw_config.policymatch.PolicyIntervals') as intervals:
+            other, cached = compiled_matcher(self.device, cache)
+        intervals.assert_not_called()
+        self.assertTrue(cached)
+        self.assertEqual(other.matches('10.1.1.1', '8.8.8.8', 'tcp', 80), matcher.matches('10.1.1.1', '8.8.8.8',
+                                                                                           'tcp', 80))
+        ConfigVersion.objects.filter(device=self.device).update(current_active=False)
+        ConfigVersion.objects.create(device=self.device, current_active=True, digest='2' * 64)
+        self.assertFalse(compiled_matcher(self.device, cache)[1])
+        self.assertEqual(len(cache.entries()), 2)
+        # Without versions the policies are the key
+        ConfigVersion.objects.all().delete()
+        self.assertFalse(compiled_matcher(self.device, cache)[1])
+        self.assertTrue(compiled_matcher(self.device, cache)[1])
+
+    def test_matcher_is_compiled_again_after_a_full_reimport(self):
+        temp_parse_cache(self)
+        configfile = os.path.join(self.directory, 'lab.conf')
+        cache = MatcherCache(self.directory)
+        for option, action in (('--incremental', 'accept'), ('--bulk', 'deny')):
+            with open(configfile, 'w') as fh:
+                fh.write(SAMPLE_VDOM_CONFIG.replace('set action accept', 'set action %s' % action))
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command('parsefgconfig', '-f', configfile, option)
+            matcher, cached = compiled_matcher(self.device, cache)
+            self.assertFalse(cached)
+            self.assertEqual(matcher.lookup('10.1.1.1', '8.8.8.8', 'tcp', 80)['policyid'], 1)
+        self.assertEqual(matcher.lookup('10.1.1.1', '8.8.8.8', 'tcp', 80)['action'], 'deny')
+
+
+@skipUnless(addressarrays.numpy, 'NumPy is not installed')
+class FlowReplayTests(TestCase):
+    FLOWS = [
+        ('10.1.1.1', '8.8.8.8', 6, 80),
+        ('10.9.9.9', '8.8.8.8', 6, 8081),
+        ('10.1.200.1', '8.8.8.8', 6, 8080),
+        ('10.1.1.1', '8.8.8.8', 6, 8082),
+        ('10.1.1.1', '8.8.8.8', 6, 80),
+    ]
+
+    setUp = PolicyMatcherTests.setUp
+
+    def replay(self, text, matcher):
+        replay = FlowReplay(matcher, samples=2)
+        for chunk in FlowReader(io.BytesIO(text.encode()), chunk_bytes=64).chunks():
+            replay.replay(chunk)
+        return replay
+
+    def test_replay_counts_the_first_matching_policy(self):
+        matcher = compiled_matcher(self.device)[0]
+        expected = [0] * (len(matcher.policies) + 1)
+        for flow in self.FLOWS:
+            policy = matcher.lookup(*flow)
+            expected[matcher.policies.index(policy) if policy else -1] += 1
+        csv_flows = 'dport,proto,src,dst\n' + ''.join('%d,%d,%s,%s\n' % (f[3], f[2], f[0], f[1]) for f in self.FLOWS)
+        replay = self.replay(csv_flows, matcher)
+        self.assertEqual(replay.hits.tolist(), expected)
+        self.assertEqual(replay.examples, [('10.1.1.1', '8.8.8.8', 6, 8082, None, None)])
+        # Names, IPv6 addresses and unknown interfaces take the line parser
+        replay = self.replay(csv_flows.replace(',6,', ',tcp,') + '80,udp,10.1.1.1,2001:db8::1\n80,tcp,x,y\n', matcher)
+        self.assertEqual(replay.hits.tolist(), [expected[0], expected[1], expected[2] + 1])
+        self.assertEqual((replay.flows, replay.invalid), (6, 1))
+        # Policy 1 is on port1, an interface the device does not have only matches policy 2 for any interface
+        logs = 'date=2024-01-01 srcintf="port9" srcip=10.1.1.1 dstip=8.8.8.8 proto=6 dstport=80 action="accept"\n'
+        self.assertEqual(self.replay(logs, matcher).hits.tolist(), [0, 1, 0])
+
+    def test_replay_command(self):
+        flows = os.path.join(self.directory, 'flows.csv')
+        hits = os.path.join(self.directory, 'hits.csv')
+        with open(flows, 'w') as fh:
+            fh.write('src,dst,proto,dport\n' + ''.join('%s,%s,%d,%d\n' % f for f in self.FLOWS))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('replay-flows', flows, '--hostname', 'FGT-LAB', '--vsys', 'root', '--no-cache',
+                         '--hits-csv', hits, '--chunk-bytes', '64')
+        self.assertIn('5 flows replayed', output.getvalue())
+        self.assertIn('10.1.1.1 -> 8.8.8.8 6/8082', output.getvalue())
+        with open(hits) as fh:
+            self.assertEqual(fh.read().splitlines()[0], 'policyid,name,sequence,action,hits')
+
+
+def interval(first, last=None):
+    return ip_to_int(first), ip_to_int(last or first)
+
+
+class ACLCompactorTests(SimpleTestCase):
+    def test_addresses_and_ports_are_merged(self):
+        self.assertEqual(network_members([interval('10.0.0.0', '10.0.0.255'), interval('10.0.1.0', '10.0.1.255'),
+                                          interval('10.0.0.7'), interval('10.0.2.1')]),
+                         ['network-object 10.0.0.0 255.255.254.0', 'network-object host 10.0.2.1'])
+        compactor = ACLCompactor()
+        compactor.add('in', [('tcp', 80, 80), ('tcp', 81, 90), ('udp', 53, 53), ('tcp', 85, 85)],
+                      [interval('10.0.0.1')], [interval('10.1.0.0', '10.1.0.2')], ('s', 'a', 'b'), 24)
+        entries = compactor.compact()
+        self.assertEqual(service_members(entries[0][1]), ['service-object tcp destination range 80 90',
+                                                          'service-object udp destination eq 53'])
+        self.assertIn('1 ACEs expanding to 24 entries compacted to 1 ACEs expanding to 4 entries', compactor.summary())
+
+    def test_entries_differing_in_one_dimension_are_merged(self):
+        compactor = ACLCompactor()
+        http, dns = [('tcp', 80, 80)], [('udp', 53, 53)]
+        compactor.add('in', http, [interval('10.0.0.1')], [interval('10.1.0.1')], ('s1', 'a1', 'b1'), 1)
+        compactor.add('in', http, [interval('10.0.0.1')], [interval('10.1.0.2')], ('s2', 'a2', 'b2'), 1)
+        compactor.add('in', dns, [interval('10.0.0.1')], [interval('10.1.0.1', '10.1.0.2')], ('s3', 'a3', 'b3'), 1)
+        compactor.add('out', http, [interval('10.0.0.1')], [interval('10.1.0.3')], ('s4', 'a4', 'b4'), 1)
+        # Entries with an empty group match nothing
+        compactor.add('in', http, [], [interval('10.1.0.3')], ('s5', 'a5', 'b5'), 0)
+        self.assertEqual(compactor.compact(), [
+            ('in', (('tcp', 80, 80), ('udp', 53, 53)), (interval('10.0.0.1'),), (interval('10.1.0.1', '10.1.0.2'),),
+             ('s1', 'a1', 'b1')),
+            ('out', (('tcp', 80, 80),), (interval('10.0.0.1'),), (interval('10.1.0.3'),), ('s4', 'a4', 'b4')),
+        ])
+
+
+ROUTES = """! outside, and the two monitored networks behind different interfaces
+route outside 0.0.0.0 0.0.0.0 10.20.8.3 1
+10.21.32.0/19 10.20.10.201 inside-a
+route inside-b 10.21.128.0 255.255.224.0 10.20.10.202
+"""
+
+
+class RouteTableTests(SimpleTestCase):
+    def test_longest_prefix_match(self):
+        table = RouteTable([('0.0.0.0/0', 'gw', 'outside'), ('10.0.0.0/8', 'gw', 'core'),
+                            ('10.1.0.0/16', 'gw', 'dc'), ('10.1.2.0/24', 'gw', 'core'), ('192.168.0.0/16', 'gw', 'lab')])
+        self.assertEqual([table.lookup(ip) for ip in ('8.8.8.8', '10.0.0.1', '10.1.1.1', '10.1.2.3', '10.1.3.0',
+                                                      '10.255.255.255', '192.168.1.1', '255.255.255.255')],
+                         ['outside', 'core', 'dc', 'core', 'dc', 'core', 'lab', 'outside'])
+        self.assertEqual(RouteTable([('10.0.0.0/8', 'gw', 'core')]).lookup('11.0.0.0'), None)
+
+    def test_objects_spanning_several_routes(self):
+        table = RouteTable([parse_route(line) for line in ROUTES.splitlines()[1:]])
+        self.assertEqual(table.resolve(address('r', 'range4', '10.21.63.250', '10.21.64.5')),
+                         {'inside-a', 'outside'})
+        self.assertEqual(table.resolve(address('n', 'net4', '10.21.0.0', prefixlen=16)),
+                         {'inside-a', 'inside-b', 'outside'})
+        self.assertEqual(table.resolve(address('h', 'ip4', '10.21.130.5')), {'inside-b'})
+        self.assertEqual(table.resolve(address('f', 'fqdn', None)), set())
+        with self.assertRaises(ValueError):
+            parse_route('route outside 10.0.0.0 255.0.255.0 10.20.8.3')
+
+
+class ASAExportTests(TestCase):
+    def export(self, *args):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, True)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        self.addCleanup(os.chdir, cwd)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('create-asa-config', '--hostname', 'FGT-LAB', '--vsys', 'root', *args)
+        return output.getvalue()
+
+    def routes_file(self):
+        routesdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, routesdir, True)
+        with open(os.path.join(routesdir, 'routes'), 'w') as fh:
+            fh.write(ROUTES)
+        return fh.name
+
+    def test_hosts_in_any_monitored_network_are_inside(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG)))
+        output = self.export()
+        # host 1 to net_10.1.0.0/16 leaves the monitored networks, host 1 to host 2 stays inside
+        # The source group has the members of the FortiGate group grp1 and keeps its name
+        self.assertIn('object-group network grp1\n network-object host 10.21.33.9\nexit', output)
+        self.assertNotIn('10.21.130.5', output)
+        self.assertNotIn('out2in', output)
+        self.assertNotIn('in2out', self.export('--monitor-net', '10.0.0.0/8'))
+
+    def test_output_is_written_in_dependency_order(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG)))
+        self.assertEqual(self.export('-o', 'asa.cfg', '--json-dump', 'policies.jsonl'),
+                         '3 object-groups written, 0 replaced with an identical group, 0 lines saved\n')
+        with open('asa.cfg') as fh:
+            lines = fh.read().splitlines()
+        with open('policies.jsonl') as fh:
+            policies = [json.loads(line) for line in fh]
+        self.assertEqual([p['policyid'] for p in policies], [1])
+        self.assertEqual(policies[0]['source']['addressgroups'][0]['members'][0]['start_ip'], '10.21.33.9')
+        ace = [line for line in lines if line.startswith('access-list')]
+        self.assertEqual(ace, ['access-list FabricasGW-1294_in line 1 extended permit object-group pol-1-services '
+                               'object-group grp1 object-group pol-1-in2out-dsts log'])
+        # Every group is defined before the access-list entry using it
+        for group in ('pol-1-services', 'grp1', 'pol-1-in2out-dsts'):
+            self.assertLess(next(i for i, line in enumerate(lines) if line.endswith(' ' + group)),
+                            lines.index(ace[0]))
+
+    def test_acls_per_ingress_interface_from_routes(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG)))
+        routes = self.routes_file()
+        output = self.export('--routes-file', routes)
+        self.assertIn('object-group network pol-1-inside-a-dsts\n network-object host 10.21.130.5\nexit', output)
+        self.assertEqual([line for line in output.splitlines() if line.startswith('access-list')],
+                         ['access-list inside-a_in line 1 extended permit object-group pol-1-services '
+                          'object-group grp1 object-group pol-1-inside-a-dsts log'])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('import-routes', '-f', routes, '--hostname', 'FGT-LAB', '--vsys', 'root')
+        self.assertEqual(Route.objects.filter(device=device).count(), 3)
+        self.assertEqual(self.export('--db-routes'), output)
+
+    def test_identical_groups_are_written_once(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG.replace(
+            '        set service "HTTP"\n    next\n',
+            '        set service "HTTP"\n    next\n    edit 2\n        set srcaddr "host 1"\n'
+            '        set dstaddr "host 2" "net_10.1.0.0/16"\n        set action accept\n'
+            '        set service "HTTP"\n    next\n'))))
+        output = self.export()
+        self.assertIn('access-list FabricasGW-1294_in line 1 extended permit object-group pol-1-services '
+                      'object-group grp1 object-group pol-1-in2out-dsts log', output)
+        self.assertEqual(output.count('object-group network grp1\n'), 1)
+        self.assertEqual(output.count('object-group pol-1-services object-group grp1'), 2)
+        self.assertIn('!3 object-groups written, 3 replaced with an identical group, 9 lines saved', output)
+        self.assertIn('object-group network pol-2-in2out-srcs', self.export('--no-group-dedup'))
+
+    def test_compacted_export(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG.replace(
+            '        set service "HTTP"\n    next\n',
+            '        set service "HTTP"\n    next\n    edit 2\n        set srcaddr "host 1"\n'
+            '        set dstaddr "host 2"\n        set action accept\n        set service "HTTP"\n    next\n'))))
+        output = self.export('--compact', '--routes-file', self.routes_file())
+        # Policy 2 is contained in policy 1 and merged into its ACE
+        self.assertEqual([line for line in output.splitlines() if line.startswith('access-list')],
+                         ['access-list inside-a_in line 1 extended permit object-group pol-1-services '
+                          'object-group grp1 object-group pol-1-inside-a-dsts log'])
+        self.assertIn('object-group service pol-1-services\n service-object tcp destination eq 80\n'
+                      ' service-object tcp destination range 8080 8081\nexit', output)
+        self.assertIn('!ACL compaction: 2 ACEs expanding to 4 entries compacted to 1 ACEs expanding to 2 entries',
+                      output)
+
+    @skipUnless(addressarrays.numpy, 'NumPy is not installed')
+    def test_numpy_classification_gives_the_same_export(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG)))
+        self.assertEqual(self.export(), self.export('--numpy'))
+
+
+@skipUnless(addressarrays.numpy, 'NumPy is not installed')
+class AddressArraysTests(TestCase):
+    ADDRESSES = [
+        address('host', 'ip4', '10.21.33.9'),
+        address('net', 'net4', '10.21.32.0', prefixlen=23),
+        address('range', 'range4', '10.21.33.250', '10.21.34.5'),
+        address('all', 'net4', '0.0.0.0', prefixlen=0),
+        address('v6', 'net6', '2001:db8::', prefixlen=64),
+        address('fqdn', 'fqdn', None),
+    ]
+
+    def test_queries_against_networks(self):
+        arrays = addressarrays.AddressArrays(self.ADDRESSES)
+        networks = addressarrays.QueryNetworks(['10.21.32.0/24', '10.21.33.0/24', '2001:db8::/32'])
+        self.assertEqual(list(arrays.overlaps(networks)), [True, True, True, True, True, False])
+        self.assertEqual(list(arrays.within(networks)), [True, True, False, False, True, False])
+        self.assertEqual(list(arrays.contains(networks)), [False, True, False, True, False, False])
+        self.assertEqual(list(arrays.intersection_size(networks)), [1, 512, 6, 512, 2 ** 64, 0])
+        self.assertEqual(arrays.overlap_matrix(networks).tolist()[2], [False, True, False])
+
+    def test_find_network_policies(self):
+        device = Device.objects.create(hostname='FGT-LAB', vsys='root', devtype='fgt52')
+        BulkIngest(device).apply(stage_vdom('root', *sample_sections(EXPORT_CONFIG)))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command('find-network-policies', '10.21.130.0/24', '--mode', 'within')
+        self.assertIn('destination: host 2', output.getvalue())
+        self.assertIn('1 policies found', output.getvalue())